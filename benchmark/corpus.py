@@ -0,0 +1,160 @@
+"""
+    Synthetic mail corpus for benchmarks: plain text, HTML newsletters, multipart mails with
+    attachments and pathological mails (deeply nested, huge). Mails are generated reproducibly
+    by seed, each subject contains a marker 'BM<number>' to identify the mail after delivery.
+"""
+import argparse
+import os
+import random
+import typing
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+KINDS = ('plain', 'html', 'attachments', 'pathological')
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+         'eiusmod', 'tempor', 'incididunt', 'labore', 'dolore', 'magna', 'aliqua', 'Grüße', 'naïve',
+         'café', '_under_score_', '*star*', '[bracket]', '(paren)', 'a<b', 'x&y', '😀', 'Ünïcödé')
+
+# smallest valid PNG (1x1 pixel)
+PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                    '1f15c4890000000d49444154789c6360f8cfc0f01f0005000201a7f5b6'
+                    'd10000000049454e44ae426082')
+
+
+class CorpusGenerator:
+    """
+    Generate mails of benchmark corpus, 'scale' multiplies size of mail bodies and attachments.
+    """
+    rnd: random.Random
+    scale: float
+    pathological_count: int = 0
+
+    def __init__(self, seed: int = 42, scale: float = 1.0):
+        self.rnd = random.Random(seed)
+        self.scale = scale
+
+    def words(self, count: int) -> str:
+        return ' '.join(self.rnd.choice(WORDS) for _ in range(max(1, int(count * self.scale))))
+
+    def paragraphs(self, count: int, words: int) -> list[str]:
+        return [self.words(self.rnd.randint(words // 2, words)) for _ in range(count)]
+
+    @staticmethod
+    def headers(message, number: int, kind: str):
+        message['From'] = '"Benchmark Sender %i" <sender%i@example.com>' % (number % 7, number % 7)
+        message['To'] = 'receiver@example.com'
+        message['Subject'] = 'Benchmark %s mail BM%06i' % (kind, number)
+        message['Message-ID'] = '<bm%06i@example.com>' % number
+        if number % 3 == 0:
+            message['List-Id'] = 'Benchmark list <bench.example.com>'
+
+    def plain(self, number: int) -> bytes:
+        message = MIMEText('\n\n'.join(self.paragraphs(self.rnd.randint(2, 30), 80)), 'plain', 'utf-8')
+        self.headers(message, number, 'plain')
+        return message.as_bytes()
+
+    def newsletter_html(self, images: list[str]) -> str:
+        rows = []
+        for idx, paragraph in enumerate(self.paragraphs(self.rnd.randint(5, 40), 60)):
+            image = '<img src="cid:%s" alt="logo" width="120">' % images[idx % len(images)] if images else ''
+            rows.append('<tr><td style="padding:8px;font-family:Arial"><h2>%s</h2>%s'
+                        '<p style="color:#333">%s <a href="https://example.com/article/%i?utm_source=bench">'
+                        'read more</a></p></td></tr>' % (self.words(6), image, paragraph, idx))
+        return ('<!DOCTYPE html><html><head><style>td {font-size:14px} .x {display:none}</style>'
+                '<script>var tracking = 1;</script></head><body><table width="600" align="center">'
+                '%s</table><p class="x">hidden preheader</p>'
+                '<img src="https://example.com/pixel.gif" width="1" height="1"></body></html>' % ''.join(rows))
+
+    def html(self, number: int) -> bytes:
+        related = MIMEMultipart('related')
+        images = ['logo%i@example.com' % idx for idx in range(self.rnd.randint(0, 3))]
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText('\n\n'.join(self.paragraphs(5, 40)), 'plain', 'utf-8'))
+        alternative.attach(MIMEText(self.newsletter_html(images), 'html', 'utf-8'))
+        related.attach(alternative)
+        for image in images:
+            part = MIMEImage(PNG, 'png')
+            part.add_header('Content-ID', '<%s>' % image)
+            part.add_header('Content-Disposition', 'inline', filename=image.split('@')[0] + '.png')
+            related.attach(part)
+        self.headers(related, number, 'html')
+        return related.as_bytes()
+
+    def attachment(self, size: int, name: str):
+        part = MIMEApplication(self.rnd.randbytes(max(1, int(size * self.scale))), 'octet-stream')
+        part.add_header('Content-Disposition', 'attachment', filename=name)
+        return part
+
+    def attachments(self, number: int) -> bytes:
+        message = MIMEMultipart('mixed')
+        message.attach(MIMEText('\n\n'.join(self.paragraphs(3, 60)), 'plain', 'utf-8'))
+        for idx in range(self.rnd.randint(1, 3)):
+            if self.rnd.random() < 0.3:
+                part = MIMEImage(PNG, 'png')
+                part.add_header('Content-Disposition', 'attachment', filename='image%i.png' % idx)
+                message.attach(part)
+            else:
+                message.attach(self.attachment(self.rnd.randint(50_000, 2_000_000), 'document%i.pdf' % idx))
+        self.headers(message, number, 'attachments')
+        return message.as_bytes()
+
+    def pathological(self, number: int) -> bytes:
+        variant = self.pathological_count % 4
+        self.pathological_count += 1
+        if variant == 0:
+            # deeply nested multipart
+            message = MIMEMultipart('mixed')
+            current = message
+            for _ in range(60):
+                nested = MIMEMultipart('mixed')
+                current.attach(nested)
+                current = nested
+            current.attach(MIMEText(self.words(50), 'plain', 'utf-8'))
+        elif variant == 1:
+            # huge HTML of deeply nested elements
+            depth = int(2000 * self.scale)
+            message = MIMEText('<div><span>' * depth + self.words(200_000) + '</span></div>' * depth,
+                               'html', 'utf-8')
+        elif variant == 2:
+            # single huge line without spaces
+            message = MIMEText('x' * int(5_000_000 * self.scale), 'plain', 'utf-8')
+        else:
+            # many small attachments
+            message = MIMEMultipart('mixed')
+            message.attach(MIMEText(self.words(20), 'plain', 'utf-8'))
+            for idx in range(50):
+                message.attach(self.attachment(2_000, 'file%02i.bin' % idx))
+        self.headers(message, number, 'pathological')
+        return message.as_bytes()
+
+    def generate(self, count: int, kinds: typing.Sequence[str] = KINDS) -> list[tuple[str, bytes]]:
+        """
+        Generate 'count' mails, kinds are used in turn. Returns list of (kind, raw mail).
+        """
+        return [(kinds[number % len(kinds)], getattr(self, kinds[number % len(kinds)])(number))
+                for number in range(count)]
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Generate benchmark mail corpus (*.eml)')
+    args_parser.add_argument('-o', '--output', type=str, required=True, help='Output directory')
+    args_parser.add_argument('-n', '--count', type=int, default=100, help='Number of mails (default: 100)')
+    args_parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    args_parser.add_argument('--scale', type=float, default=1.0, help='Size factor of mails (default: 1.0)')
+    args_parser.add_argument('--kinds', type=str, default=','.join(KINDS),
+                             help='Comma separated kinds of mails (default: %s)' % ','.join(KINDS))
+    args = args_parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    corpus = CorpusGenerator(args.seed, args.scale).generate(args.count, args.kinds.split(','))
+    for number, (kind, raw) in enumerate(corpus):
+        with open(os.path.join(args.output, '%06i-%s.eml' % (number, kind)), 'wb') as mail_file:
+            mail_file.write(raw)
+    print("%i mails written to '%s'" % (len(corpus), args.output))
+
+
+if __name__ == '__main__':
+    main()
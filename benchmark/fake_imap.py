@@ -0,0 +1,273 @@
+"""
+    Minimal IMAP4rev1 server (plain TCP) for benchmarks: a single folder in memory supporting
+    the commands used by the forwarder (LOGIN, LIST, SELECT, UID SEARCH/FETCH/STORE, NOOP, IDLE,
+    and CONDSTORE/QRESYNC: ENABLE, STATUS, SEARCH MODSEQ, SELECT with QRESYNC parameters).
+    Mails can be appended while clients are connected, IDLE clients are notified by EXISTS.
+"""
+import glob
+import os
+import re
+import socketserver
+import sys
+import threading
+import time
+
+
+CAPABILITIES = 'IMAP4rev1 IDLE ENABLE CONDSTORE QRESYNC'
+
+
+class Mailbox:
+    """
+    Mails of folder: UID, flags, raw mail and time of append, mod-sequence of each mail
+    """
+    uid_validity = 1
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.mails: list[tuple[int, set[str], bytes]] = []
+        self.appended: dict[int, float] = {}
+        self.modseqs: dict[int, int] = {}
+        self.highest_modseq = 1
+        self.next_uid = 1
+        # number of commands received by name
+        self.commands: dict[str, int] = {}
+
+    def append(self, raw: bytes, seen: bool = False) -> int:
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.mails.append((uid, {'\\Seen'} if seen else set(), raw))
+            self.appended[uid] = time.perf_counter()
+            self.highest_modseq += 1
+            self.modseqs[uid] = self.highest_modseq
+            self.lock.notify_all()
+        return uid
+
+    def set_seen(self, uid: int, flags: set[str]):
+        with self.lock:
+            if '\\Seen' not in flags:
+                flags.add('\\Seen')
+                self.highest_modseq += 1
+                self.modseqs[uid] = self.highest_modseq
+
+    @staticmethod
+    def parse_uid_set(uid_set: str, max_uid: int) -> list[tuple[int, int]]:
+        ranges = []
+        for item in uid_set.split(','):
+            start, _, end = item.partition(':')
+            first = max_uid if start == '*' else int(start)
+            last = first if not end else (max_uid if end == '*' else int(end))
+            ranges.append((min(first, last), max(first, last)))
+        return ranges
+
+    def select(self, uid_set: str) -> list[tuple[int, int, set[str], bytes]]:
+        """
+        Get (sequence number, UID, flags, raw mail) of mails in UID set
+        """
+        with self.lock:
+            max_uid = self.mails[-1][0] if self.mails else 0
+            ranges = self.parse_uid_set(uid_set, max_uid)
+            return [(seq, uid, flags, raw) for seq, (uid, flags, raw) in enumerate(self.mails, start=1)
+                    if any(first <= uid <= last for first, last in ranges)]
+
+    def changed_since(self, modseq: int) -> list[tuple[int, int, set[str], int]]:
+        """
+        Get (sequence number, UID, flags, mod-sequence) of mails changed after mod-sequence
+        """
+        with self.lock:
+            return [(seq, uid, flags, self.modseqs[uid]) for seq, (uid, flags, _) in enumerate(self.mails, start=1)
+                    if self.modseqs[uid] > modseq]
+
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    server: 'FakeImapServer'
+    # responses are written line by line, don't delay small packets
+    disable_nagle_algorithm = True
+    # number of mails known by client (after SELECT)
+    known: int = 0
+    selected: bool = False
+
+    def send(self, line: str | bytes):
+        self.wfile.write((line.encode() if isinstance(line, str) else line) + b'\r\n')
+
+    def notify_exists(self):
+        """
+        Send EXISTS response, if mails were appended since last response (like real servers)
+        """
+        if not self.selected:
+            return
+        with self.server.mailbox.lock:
+            count = len(self.server.mailbox.mails)
+        if count != self.known:
+            self.known = count
+            self.send('* %i EXISTS' % count)
+
+    def handle(self):
+        self.send('* OK [CAPABILITY %s] Fake IMAP server ready' % CAPABILITIES)
+        mailbox = self.server.mailbox
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, command = line.decode().strip().partition(' ')
+            name, _, args = command.partition(' ')
+            name = name.upper()
+            if name == 'UID':
+                name, _, args = args.partition(' ')
+                name = 'UID ' + name.upper()
+            with mailbox.lock:
+                mailbox.commands[name] = mailbox.commands.get(name, 0) + 1
+
+            if name == 'CAPABILITY':
+                self.send('* CAPABILITY %s' % CAPABILITIES)
+            elif name == 'ENABLE':
+                self.send('* ENABLED %s' % ' '.join(item for item in args.upper().split()
+                                                    if item in ('CONDSTORE', 'QRESYNC')))
+            elif name == 'LIST':
+                self.send('* LIST (\\HasNoChildren) "/" INBOX')
+            elif name == 'STATUS':
+                with mailbox.lock:
+                    self.send('* STATUS INBOX (MESSAGES %i UIDNEXT %i HIGHESTMODSEQ %i)'
+                              % (len(mailbox.mails), mailbox.next_uid, mailbox.highest_modseq))
+            elif name in ('SELECT', 'EXAMINE'):
+                with mailbox.lock:
+                    self.selected = True
+                    self.known = len(mailbox.mails)
+                    self.send('* %i EXISTS' % self.known)
+                    self.send('* OK [UIDVALIDITY %i] UIDs valid' % mailbox.uid_validity)
+                    self.send('* OK [UIDNEXT %i] Predicted next UID' % mailbox.next_uid)
+                    self.send('* OK [HIGHESTMODSEQ %i] Highest' % mailbox.highest_modseq)
+                # QRESYNC: mails changed since known mod-sequence (no mails are expunged)
+                qresync = re.search(r'QRESYNC \((\d+) (\d+)', args, re.IGNORECASE)
+                if qresync is not None and int(qresync.group(1)) == mailbox.uid_validity:
+                    for seq, uid, flags, modseq in mailbox.changed_since(int(qresync.group(2))):
+                        self.send('* %i FETCH (UID %i FLAGS (%s) MODSEQ (%i))' % (seq, uid, ' '.join(flags), modseq))
+                self.send('%s OK [READ-WRITE] %s completed' % (tag, name))
+                continue
+            elif name == 'UID SEARCH':
+                uids, modseq = self.search(args)
+                self.send('* SEARCH ' + ' '.join(map(str, uids)) + (' (MODSEQ %i)' % modseq if modseq else ''))
+            elif name == 'UID FETCH':
+                self.fetch(args)
+            elif name == 'UID STORE':
+                uid_set, _, flags = args.partition(' ')
+                for _, uid, mail_flags, _ in mailbox.select(uid_set):
+                    if '\\Seen' in flags:
+                        mailbox.set_seen(uid, mail_flags)
+            elif name == 'IDLE':
+                self.idle()
+            elif name == 'LOGOUT':
+                self.send('* BYE Fake IMAP server logging out')
+                self.send('%s OK LOGOUT completed' % tag)
+                return
+            elif name not in ('LOGIN', 'NOOP', 'CLOSE', 'CHECK'):
+                self.send('%s BAD Command not supported' % tag)
+                continue
+            self.notify_exists()
+            self.send('%s OK %s completed' % (tag, name))
+
+    def search(self, criteria: str) -> tuple[list[int], int]:
+        """
+        Get UIDs of mails matching criteria, highest mod-sequence of these mails if searched by MODSEQ
+        """
+        tokens = criteria.replace('(', ' ').replace(')', ' ').split()
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            max_uid = mailbox.mails[-1][0] if mailbox.mails else 0
+            selected = [(uid, flags) for uid, flags, _ in mailbox.mails]
+            modseqs = dict(mailbox.modseqs)
+        by_modseq = False
+        idx = 0
+        while idx < len(tokens):
+            token = tokens[idx].upper()
+            if token == 'UID' and idx + 1 < len(tokens):
+                ranges = Mailbox.parse_uid_set(tokens[idx + 1], max_uid)
+                selected = [(uid, flags) for uid, flags in selected
+                            if any(first <= uid <= last for first, last in ranges)]
+                idx += 1
+            elif token == 'UNSEEN':
+                selected = [(uid, flags) for uid, flags in selected if '\\Seen' not in flags]
+            elif token == 'SEEN':
+                selected = [(uid, flags) for uid, flags in selected if '\\Seen' in flags]
+            elif token == 'MODSEQ' and idx + 1 < len(tokens):
+                selected = [(uid, flags) for uid, flags in selected if modseqs[uid] >= int(tokens[idx + 1])]
+                by_modseq = True
+                idx += 1
+            idx += 1
+        return ([uid for uid, _ in selected],
+                max((modseqs[uid] for uid, _ in selected), default=0) if by_modseq else 0)
+
+    def fetch(self, args: str):
+        uid_set, _, items = args.partition(' ')
+        peek = 'PEEK' in items.upper()
+        for seq, uid, flags, raw in self.server.mailbox.select(uid_set):
+            self.wfile.write(b'* %i FETCH (UID %i RFC822 {%i}\r\n' % (seq, uid, len(raw)) + raw + b')\r\n')
+            if not peek:
+                self.server.mailbox.set_seen(uid, flags)
+
+    def idle(self):
+        """
+        Notify client about new mails (EXISTS), until client sends DONE
+        """
+        mailbox = self.server.mailbox
+        self.send('+ idling')
+        done = threading.Event()
+
+        def notify():
+            while not done.is_set():
+                self.notify_exists()
+                with mailbox.lock:
+                    if len(mailbox.mails) == self.known:
+                        mailbox.lock.wait(0.5)
+
+        notifier = threading.Thread(target=notify, daemon=True)
+        notifier.start()
+        try:
+            # wait for DONE
+            self.rfile.readline()
+        finally:
+            done.set()
+            with mailbox.lock:
+                mailbox.lock.notify_all()
+            notifier.join()
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """
+    IMAP server on localhost, use 'port' of server (random free port by default)
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    mailbox: Mailbox
+
+    def __init__(self, port: int = 0):
+        self.mailbox = Mailbox()
+        super().__init__(('127.0.0.1', port), ImapHandler)
+
+    def handle_error(self, request, client_address):
+        # ignore clients closing connection (ex.: during IDLE)
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> 'FakeImapServer':
+        threading.Thread(target=self.serve_forever, name='fake-imap', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    server = FakeImapServer(1143)
+    # optional: directory of mails (*.eml, ex.: written by corpus.py)
+    if len(sys.argv) > 1:
+        for file_name in sorted(glob.glob(os.path.join(sys.argv[1], '*.eml'))):
+            with open(file_name, 'rb') as mail_file:
+                server.mailbox.append(mail_file.read())
+    print("Fake IMAP server listening on port %i (%i mails)" % (server.port, len(server.mailbox.mails)))
+    server.serve_forever()
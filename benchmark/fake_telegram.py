@@ -0,0 +1,152 @@
+"""
+    Fake Telegram Bot API server for benchmarks: answers the methods used by the forwarder
+    (getMe, getChat, sendMessage, sendPhoto, sendDocument, sendMediaGroup) and records time
+    of each request, to measure end-to-end latency of mails (marker 'BM<number>' of subject).
+"""
+import email.parser
+import http.server
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+MARKER = re.compile(rb'BM(\d{6})')
+
+
+class FakeTelegramServer(http.server.ThreadingHTTPServer):
+    """
+    Bot API server on localhost, use 'base_url' as base URL of bot (random free port by default).
+    'latency' (seconds) is added to each response.
+    """
+    daemon_threads = True
+    latency: float
+    lock: threading.Lock
+    requests: list[tuple[str, float, int]]
+    delivered: dict[int, float]
+    message_id: int = 0
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        # (method, time, size of request)
+        self.requests = []
+        # mail number: time of first message of mail
+        self.delivered = {}
+        self.all_delivered = threading.Condition(self.lock)
+        super().__init__(('127.0.0.1', port), TelegramHandler)
+
+    def handle_error(self, request, client_address):
+        # ignore clients closing connection
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        return 'http://127.0.0.1:%i/bot' % self.server_address[1]
+
+    def record(self, method: str, body: bytes) -> int:
+        now = time.perf_counter()
+        with self.lock:
+            self.requests.append((method, now, len(body)))
+            match = MARKER.search(body)
+            if match is not None and method != 'getChat':
+                self.delivered.setdefault(int(match.group(1)), now)
+                self.all_delivered.notify_all()
+            self.message_id += 1
+            return self.message_id
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        """
+        Wait until 'count' mails were delivered
+        """
+        with self.lock:
+            return self.all_delivered.wait_for(lambda: len(self.delivered) >= count, timeout)
+
+    def start(self) -> 'FakeTelegramServer':
+        threading.Thread(target=self.serve_forever, name='fake-telegram', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TelegramHandler(http.server.BaseHTTPRequestHandler):
+    server: FakeTelegramServer
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, message_format, *args):
+        pass
+
+    def fields(self, body: bytes) -> dict[str, str]:
+        """
+        Parse form fields (urlencoded or multipart, files are skipped)
+        """
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/'):
+            message = email.parser.BytesParser().parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode()
+                    for part in message.get_payload()
+                    if part.get_filename() is None and part.get_param('name', header='content-disposition')}
+        if content_type.startswith('application/json'):
+            return {key: json.dumps(value) if not isinstance(value, str) else value
+                    for key, value in json.loads(body or b'{}').items()}
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    def message(self, message_id: int, chat_id: str, **content) -> dict:
+        return dict(message_id=message_id, date=int(time.time()),
+                    chat={'id': int(chat_id or 1), 'type': 'private', 'first_name': 'Benchmark'}, **content)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        method = self.path.rsplit('/', 1)[-1]
+        message_id = self.server.record(method, body)
+        fields = self.fields(body)
+        chat_id = fields.get('chat_id', '1')
+        file_info = {'file_id': 'file%i' % message_id, 'file_unique_id': 'unique%i' % message_id}
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+        elif method == 'getChat':
+            result = {'id': int(chat_id), 'type': 'private', 'first_name': 'Benchmark', 'accent_color_id': 0,
+                      'max_reaction_count': 0, 'accepted_gift_types': {
+                          'unlimited_gifts': False, 'limited_gifts': False,
+                          'unique_gifts': False, 'premium_subscription': False,
+                          'gifts_from_channels': False}}
+        elif method == 'sendMessage':
+            result = self.message(message_id, chat_id, text=fields.get('text', ''))
+        elif method == 'sendPhoto':
+            result = self.message(message_id, chat_id, photo=[dict(file_info, width=1, height=1)])
+        elif method == 'sendDocument':
+            result = self.message(message_id, chat_id, document=file_info)
+        elif method == 'sendMediaGroup':
+            result = []
+            for idx, media in enumerate(json.loads(fields.get('media', '[]'))):
+                info = {'file_id': 'file%i-%i' % (message_id, idx), 'file_unique_id': 'u%i-%i' % (message_id, idx)}
+                if media.get('type') == 'photo':
+                    result.append(self.message(message_id * 100 + idx, chat_id, photo=[dict(info, width=1, height=1)]))
+                else:
+                    result.append(self.message(message_id * 100 + idx, chat_id, document=info))
+        else:
+            result = True
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        response = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST
+
+
+if __name__ == '__main__':
+    server = FakeTelegramServer(8081)
+    print("Fake Telegram Bot API server, use base_url: %s" % server.base_url)
+    server.serve_forever()
@@ -0,0 +1,279 @@
+"""
+    Benchmark of the forwarding pipeline on a synthetic mail corpus (see corpus.py).
+
+    Stages are measured separately, each in a fresh process (peak RSS of stage):
+    - decode_body:  MIME decoding of mails (Mail.decode_body)
+    - cleanup_html: conversion of HTML bodies (HtmlCleaner.convert)
+    - render:       rendering of converted mails as Telegram message (MailRenderer: escaping of Markdown,
+                    line breaks, truncation, attachment summary and header)
+    - parse_mail:   complete parsing of mails (Mail.parse_mail)
+    - pipeline:     end-to-end, mails are appended to a local fake IMAP server and forwarded
+                    to a local fake Telegram Bot API server (latency: append until delivery)
+
+    Reports mails/s, p50/p99 latency per mail and peak RSS for each stage (and kind of mail).
+
+    Usage: python benchmark/run.py [-n 200] [--stages parse_mail,pipeline] [--json result.json]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import email
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# noinspection PyUnresolvedReferences
+from corpus import CorpusGenerator, KINDS
+# noinspection PyUnresolvedReferences
+from fake_imap import FakeImapServer
+# noinspection PyUnresolvedReferences
+from fake_telegram import FakeTelegramServer
+
+STAGES = ('decode_body', 'cleanup_html', 'render', 'parse_mail', 'pipeline')
+
+CONFIG = """
+[Mail]
+server: 127.0.0.1
+port: %(imap_port)i
+ssl: False
+user: benchmark
+password: benchmark
+refresh: 1
+max_refresh: 1
+push_mode: True
+max_in_flight: %(max_in_flight)i
+parse_workers: %(parse_workers)i
+spool_size: %(spool_size)i
+condstore: %(condstore)s
+
+[Telegram]
+bot_token: 1:benchmark
+base_url: %(base_url)s
+forward_to_chat_id: 1
+rate_limit: 100000
+chat_rate_limit: 100000
+delivery_workers: %(delivery_workers)i
+"""
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss: kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def summarize(stage: str, kind: str, latencies: list[float], duration: float, rss: float) -> dict:
+    return {'stage': stage, 'kind': kind, 'mails': len(latencies),
+            'mails_per_second': len(latencies) / duration if duration > 0 else 0.0,
+            'p50_ms': percentile(latencies, 0.5) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000,
+            'peak_rss_mb': rss}
+
+
+def load_config(settings: dict) -> typing.Any:
+    import mailToTelegramForwarder as forwarder
+    with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as config_file:
+        config_file.write(CONFIG % settings)
+    try:
+        return forwarder.Config(forwarder.Tool(), argparse.Namespace(config=config_file.name, read_old_mails=False))
+    finally:
+        os.unlink(config_file.name)
+
+
+def render(renderer: typing.Any, content: str, message_type: typing.Any, truncated: bool,
+           attachments: list) -> str:
+    header, _, subject, summary_line = renderer.render_header('"Benchmark Sender" <sender@example.com>',
+                                                              'Benchmark mail', message_type)
+    return (header + subject + summary_line + renderer.render_content(content, message_type, truncated) + ' '
+            + renderer.render_attachments(attachments, message_type))
+
+
+def run_parse_stage(stage: str, args: argparse.Namespace) -> list[dict]:
+    """
+    Measure decode_body, cleanup_html, render or parse_mail (in-process) for each mail of corpus
+    """
+    import mailToTelegramForwarder as forwarder
+    config = load_config(settings(args, 0, ''))
+    corpus = CorpusGenerator(args.seed, args.scale).generate(args.count, args.kinds.split(','))
+    parser = forwarder.Mail.create_parser(config)
+    cleaner = forwarder.HtmlCleaner(config)
+    renderer = forwarder.MailRenderer(config)
+
+    jobs: list[tuple[str, typing.Callable[[], typing.Any]]] = []
+    for number, (kind, raw) in enumerate(corpus):
+        if stage == 'decode_body':
+            jobs.append((kind, lambda data=raw: forwarder.Mail.decode_body(email.message_from_bytes(data),
+                                                                           config.imap_spool_size)))
+        elif stage == 'cleanup_html':
+            body = forwarder.Mail.decode_body(email.message_from_bytes(raw))
+            if body.html:
+                jobs.append((kind, lambda html=body.html, images=body.images: cleaner.convert(
+                    html, images, config.imap_max_length)))
+        elif stage == 'render':
+            message = email.message_from_bytes(raw)
+            body = forwarder.Mail.decode_body(message)
+            if body.html and (config.tg_prefer_html or not body.text):
+                content, truncated = cleaner.convert(body.html, body.images, config.imap_max_length)
+                jobs.append((kind, lambda html=content, truncated=truncated, attachments=body.attachments:
+                             render(renderer, html, forwarder.MailDataType.HTML, truncated, attachments)))
+            else:
+                jobs.append((kind, lambda text=body.text or '', attachments=body.attachments:
+                             render(renderer, renderer.escape(text), forwarder.MailDataType.TEXT, False,
+                                    attachments)))
+        else:
+            jobs.append((kind, lambda uid=str(number + 1), data=raw: parser.parse_mail(uid, data)))
+    del corpus
+
+    latencies: dict[str, list[float]] = {}
+    started = time.perf_counter()
+    for kind, job in jobs:
+        job_started = time.perf_counter()
+        job()
+        latencies.setdefault(kind, []).append(time.perf_counter() - job_started)
+    duration = time.perf_counter() - started
+
+    rss = peak_rss_mb()
+    results = [summarize(stage, 'all', [value for values in latencies.values() for value in values], duration, rss)]
+    for kind, values in latencies.items():
+        results.append(summarize(stage, kind, values, sum(values), rss))
+    return results
+
+
+async def forward(args: argparse.Namespace, corpus: list[tuple[str, bytes]],
+                  imap: FakeImapServer, telegram: FakeTelegramServer) -> float:
+    """
+    Run forwarder until all mails of corpus were delivered, returns duration
+    """
+    import mailToTelegramForwarder as forwarder
+    config = load_config(settings(args, imap.port, telegram.base_url))
+    store = forwarder.StateStore()
+    client = forwarder.TelegramClient(config, store)
+    pool = forwarder.ParserPool.create([config])
+    mail_forwarder = forwarder.Forwarder(config, store, forwarder.TelegramBot(config, client), pool)
+    task = asyncio.create_task(mail_forwarder.run())
+    try:
+        # wait for first search, mails appended later on are new mails
+        while mail_forwarder.source.mail is None or not mail_forwarder.source.mail.last_uid:
+            await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        for _, raw in corpus:
+            imap.mailbox.append(raw)
+            if args.rate > 0:
+                await asyncio.sleep(1 / args.rate)
+        if not await asyncio.get_running_loop().run_in_executor(None, telegram.wait_for, len(corpus), args.timeout):
+            print("Timeout: %i of %i mails delivered" % (len(telegram.delivered), len(corpus)), file=sys.stderr)
+        return time.perf_counter() - started
+    finally:
+        task.cancel()
+        await mail_forwarder.stop()
+        if pool is not None:
+            pool.close()
+        await client.stop()
+        store.close()
+
+
+def run_pipeline_stage(_stage: str, args: argparse.Namespace) -> list[dict]:
+    """
+    Measure end-to-end latency: mail appended to IMAP server until first message arrived at Telegram
+    """
+    corpus = CorpusGenerator(args.seed, args.scale).generate(args.count, args.kinds.split(','))
+    imap = FakeImapServer().start()
+    telegram = FakeTelegramServer(latency=args.telegram_latency).start()
+    # mail received before start, UID of corpus mail is its number + 2
+    imap.mailbox.append(b'From: sender@example.com\r\nSubject: existing mail\r\n\r\nalready read', seen=True)
+    try:
+        duration = asyncio.run(forward(args, corpus, imap, telegram))
+    finally:
+        imap.stop()
+        telegram.stop()
+
+    latencies: dict[str, list[float]] = {}
+    for number, (kind, _) in enumerate(corpus):
+        if number in telegram.delivered:
+            latencies.setdefault(kind, []).append(telegram.delivered[number] - imap.mailbox.appended[number + 2])
+    rss = peak_rss_mb()
+    results = [summarize('pipeline', 'all', [value for values in latencies.values() for value in values],
+                         duration, rss)]
+    for kind, values in latencies.items():
+        results.append(summarize('pipeline', kind, values, duration, rss))
+    requests: dict[str, int] = {}
+    for method, _, _ in telegram.requests:
+        requests[method] = requests.get(method, 0) + 1
+    print("Telegram requests: %s" % ', '.join('%s: %i' % item for item in sorted(requests.items())),
+          file=sys.stderr)
+    print("IMAP commands: %s" % ', '.join('%s: %i' % item for item in sorted(imap.mailbox.commands.items())),
+          file=sys.stderr)
+    return results
+
+
+def settings(args: argparse.Namespace, imap_port: int, base_url: str) -> dict:
+    return {'imap_port': imap_port, 'base_url': base_url, 'max_in_flight': args.max_in_flight,
+            'parse_workers': args.parse_workers, 'spool_size': args.spool_size,
+            'delivery_workers': args.delivery_workers, 'condstore': args.condstore}
+
+
+def run_stage(stage: str, args: argparse.Namespace) -> list[dict]:
+    if stage == 'pipeline':
+        return run_pipeline_stage(stage, args)
+    return run_parse_stage(stage, args)
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Benchmark of Mail to Telegram Forwarder')
+    args_parser.add_argument('-n', '--count', type=int, default=200, help='Number of mails (default: 200)')
+    args_parser.add_argument('--seed', type=int, default=42, help='Random seed of corpus (default: 42)')
+    args_parser.add_argument('--scale', type=float, default=1.0, help='Size factor of mails (default: 1.0)')
+    args_parser.add_argument('--kinds', type=str, default=','.join(KINDS),
+                             help='Comma separated kinds of mails (default: %s)' % ','.join(KINDS))
+    args_parser.add_argument('--stages', type=str, default=','.join(STAGES),
+                             help='Comma separated stages (default: %s)' % ','.join(STAGES))
+    args_parser.add_argument('--rate', type=float, default=0,
+                             help='Mails appended per second in pipeline stage (default: 0 = all at once)')
+    args_parser.add_argument('--telegram-latency', type=float, default=0.0,
+                             help='Latency (seconds) of fake Telegram server (default: 0)')
+    args_parser.add_argument('--timeout', type=float, default=600, help='Timeout of pipeline stage (seconds)')
+    args_parser.add_argument('--max-in-flight', type=int, default=20, help='Option max_in_flight (default: 20)')
+    args_parser.add_argument('--parse-workers', type=int, default=0, help='Option parse_workers (default: 0)')
+    args_parser.add_argument('--spool-size', type=int, default=0, help='Option spool_size (default: 0)')
+    args_parser.add_argument('--delivery-workers', type=int, default=4,
+                             help='Option delivery_workers (default: 4)')
+    args_parser.add_argument('--condstore', action='store_true', help='Enable option condstore')
+    args_parser.add_argument('--json', type=str, help='Write results to JSON file')
+    args = args_parser.parse_args()
+
+    results: list[dict] = []
+    for stage in args.stages.split(','):
+        if stage not in STAGES:
+            args_parser.error("Unknown stage '%s'" % stage)
+        # fresh process for each stage: peak RSS of stage only
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            results += executor.submit(run_stage, stage, args).result()
+
+    print('%-13s %-13s %6s %10s %10s %10s %12s' % ('stage', 'kind', 'mails', 'mails/s', 'p50 ms', 'p99 ms',
+                                                   'peak RSS MB'))
+    for result in results:
+        print('%-13s %-13s %6i %10.1f %10.2f %10.2f %12.1f' % (
+            result['stage'], result['kind'], result['mails'], result['mails_per_second'],
+            result['p50_ms'], result['p99_ms'], result['peak_rss_mb']))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'arguments': vars(args), 'results': results}, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
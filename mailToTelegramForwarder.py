@@ -19,20 +19,26 @@
 ---
 
         Debian:
-            sudo apt install python3-python-telegram-bot python3-imaplib2 python3-bs4
+            sudo apt install python3-python-telegram-bot python3-imaplib2
         Arch:
-            yay -Su python-telegram-bot python-imaplib2 python-beautifulsoup4
+            yay -Su python-telegram-bot python-imaplib2
 
 """
 
 try:
-    # noinspection except,PyUnusedImports
-    from bs4 import BeautifulSoup
     # noinspection except,PyUnusedImports
     import asyncio
     # noinspection except,PyUnusedImports
     import contextlib
     # noinspection except,PyUnusedImports
+    import functools
+    # noinspection except,PyUnusedImports
+    import collections
+    # noinspection except,PyUnusedImports
+    import dataclasses
+    # noinspection except,PyUnusedImports
+    import concurrent.futures
+    # noinspection except,PyUnusedImports
     import logging
     # noinspection except,PyUnusedImports
     import warnings
@@ -49,12 +55,48 @@ try:
     # noinspection except,PyUnusedImports
     import html
     # noinspection except,PyUnusedImports
+    import html.parser
+    # noinspection except,PyUnusedImports
     import socket
     # noinspection except,PyUnusedImports
     import time
     # noinspection except,PyUnusedImports
     import configparser
     # noinspection except,PyUnusedImports
+    import os
+    # noinspection except,PyUnusedImports
+    import glob
+    # noinspection except,PyUnusedImports
+    import sqlite3
+    # noinspection except,PyUnusedImports
+    import threading
+    # noinspection except,PyUnusedImports
+    import tempfile
+    # noinspection except,PyUnusedImports
+    import binascii
+    # noinspection except,PyUnusedImports
+    import shutil
+    # noinspection except,PyUnusedImports
+    import multiprocessing
+    # noinspection except,PyUnusedImports
+    import hashlib
+    # noinspection except,PyUnusedImports
+    import random
+    # noinspection except,PyUnusedImports
+    import datetime
+    # noinspection except,PyUnusedImports
+    import http.server
+    # noinspection except,PyUnusedImports
+    import json
+    # noinspection except,PyUnusedImports
+    import heapq
+    # noinspection except,PyUnusedImports
+    import marshal
+    # noinspection except,PyUnusedImports
+    import cProfile
+    # noinspection except,PyUnusedImports
+    import tracemalloc
+    # noinspection except,PyUnusedImports
     import imaplib2
     # noinspection except,PyUnusedImports
     import email
@@ -88,11 +130,8 @@ with warnings.catch_warnings(record=True) as w:
     # Cause all warnings to always be triggered.
     warnings.simplefilter("always")
 
-    try:
-        from utils import helpers
-    except ImportError as import_error:
-        from telegram import helpers, Bot
-    from telegram import error, Message, PhotoSize, Bot, ChatFullInfo
+    from telegram import error, Message, PhotoSize, Bot, ChatFullInfo, InputMediaPhoto, InputMediaDocument
+    from telegram import Chat, Document, InputFile
     from telegram.request import HTTPXRequest
     from telegram.constants import ParseMode
 
@@ -163,24 +202,39 @@ class Tool:
 class Config:
     config_parser = None
     tool: Tool
+    account: str = ''
+    name: str = ''
 
     imap_user = None
     imap_password = None
     imap_server = None
     imap_port = 993
+    imap_ssl = True
     imap_timeout = 60
     imap_refresh = 10
+    imap_max_refresh = 120
+    imap_max_reconnect_delay = 600
     imap_push_mode = False
+    imap_idle_timeout = 1500
     imap_disconnect = False
     imap_folder = 'INBOX'
     imap_search = '(UID ${lastUID}:* UNSEEN)'
     imap_mark_as_read = False
     imap_max_length = 2000
+    imap_fetch_batch_size = 50
+    imap_max_in_flight = 20
+    imap_partial_fetch = False
+    imap_condstore = False
     imap_read_old_mails = False
     imap_read_old_mails_processed = False
     imap_ignore_inline_image = ''
+    imap_state_file = ''
+    imap_spool_size = 0
+    imap_parse_workers = 0
+    imap_parse_min_batch = 4
 
     tg_bot_token = None
+    tg_base_url = ''
     tg_forward_to_chat_id = None
     tg_prefer_html = True
     tg_markdown_version = 2
@@ -192,18 +246,33 @@ class Config:
     tg_connection_connect_timeout = 60
     tg_connection_pool_timeout = 60
     tg_connection_pool_size = 256
-
-    def __init__(self, tool, cmd_args):
+    tg_delivery_workers = 4
+    tg_ordered_delivery = True
+    tg_rate_limit = 30.0
+    tg_chat_rate_limit = 1.0
+    tg_media_groups = True
+    tg_file_cache_size = 10000
+    tg_retry_attempts = 5
+    tg_retry_delay = 30
+    tg_retry_max_delay = 3600
+
+    def __init__(self, tool, cmd_args, config_file: str | None = None, account: str = ''):
         """
             Parse config file for login credentials, address of remote mail server,
             telegram config and configuration of this application.
+            Options of account (sections 'Mail:<account>' and 'Telegram:<account>')
+            overwrite options of sections 'Mail' and 'Telegram'.
         """
+        if config_file is None:
+            config_file = cmd_args.config
         try:
             self.tool = tool
+            self.account = account
+            self.name = '%s:%s' % (config_file, account) if account else config_file
             self.config_parser = configparser.ConfigParser()
-            files = self.config_parser.read(cmd_args.config)
+            files = self.config_parser.read(config_file)
             if len(files) == 0:
-                logging.critical("Error parsing config file: File '%s' not found!" % cmd_args.config)
+                logging.critical("Error parsing config file: File '%s' not found!" % config_file)
                 sys.exit(2)
 
             self.imap_user = self.get_config('Mail', 'user', self.imap_user)
@@ -211,20 +280,39 @@ class Config:
             tool.mask_error_data.append(self.imap_password)
             self.imap_server = self.get_config('Mail', 'server', self.imap_server)
             self.imap_port = self.get_config('Mail', 'port', self.imap_port, int)
+            self.imap_ssl = self.get_config('Mail', 'ssl', self.imap_ssl, bool)
             self.imap_timeout = self.get_config('Mail', 'timeout', self.imap_timeout, int)
             self.imap_refresh = self.get_config('Mail', 'refresh', self.imap_refresh, int)
+            self.imap_max_refresh = self.get_config('Mail', 'max_refresh', self.imap_max_refresh, int)
+            self.imap_max_reconnect_delay = self.get_config('Mail', 'max_reconnect_delay',
+                                                            self.imap_max_reconnect_delay, int)
             self.imap_push_mode = self.get_config('Mail', 'push_mode', self.imap_push_mode, bool)
+            self.imap_idle_timeout = self.get_config('Mail', 'idle_timeout', self.imap_idle_timeout, int)
+            if self.imap_idle_timeout > 29 * 60:
+                # RFC 2177: client should re-issue IDLE at least every 29 minutes
+                logging.warning("IDLE timeout of %i seconds exceeds RFC limit, using 29 minutes instead."
+                                % self.imap_idle_timeout)
+                self.imap_idle_timeout = 29 * 60
             self.imap_disconnect = self.get_config('Mail', 'disconnect', self.imap_disconnect, bool)
             self.imap_folder = self.get_config('Mail', 'folder', self.imap_folder)
             self.imap_read_old_mails = self.get_config('Mail', 'read_old_mails', self.imap_read_old_mails)
             self.imap_search = self.get_config('Mail', 'search', self.imap_search)
             self.imap_mark_as_read = self.get_config('Mail', 'mark_as_read', self.imap_mark_as_read, bool)
             self.imap_max_length = self.get_config('Mail', 'max_length', self.imap_max_length, int)
+            self.imap_fetch_batch_size = self.get_config('Mail', 'fetch_batch_size', self.imap_fetch_batch_size, int)
+            self.imap_partial_fetch = self.get_config('Mail', 'partial_fetch', self.imap_partial_fetch, bool)
+            self.imap_condstore = self.get_config('Mail', 'condstore', self.imap_condstore, bool)
+            self.imap_max_in_flight = self.get_config('Mail', 'max_in_flight', self.imap_max_in_flight, int)
             self.imap_ignore_inline_image = self.get_config('Mail', 'ignore_inline_image',
                                                             self.imap_ignore_inline_image)
+            self.imap_state_file = self.get_config('Mail', 'state_file', self.imap_state_file)
+            self.imap_spool_size = self.get_config('Mail', 'spool_size', self.imap_spool_size, int)
+            self.imap_parse_workers = self.get_config('Mail', 'parse_workers', self.imap_parse_workers, int)
+            self.imap_parse_min_batch = self.get_config('Mail', 'parse_min_batch', self.imap_parse_min_batch, int)
 
             self.tg_bot_token = self.get_config('Telegram', 'bot_token', self.tg_bot_token)
             tool.mask_error_data.append(self.tg_bot_token)
+            self.tg_base_url = self.get_config('Telegram', 'base_url', self.tg_base_url)
             self.tg_forward_to_chat_id = self.get_config('Telegram', 'forward_to_chat_id',
                                                          self.tg_forward_to_chat_id, int)
             self.tg_forward_mail_content = self.get_config('Telegram', 'forward_mail_content',
@@ -246,6 +334,15 @@ class Config:
                                                               self.tg_connection_pool_timeout, int)
             self.tg_connection_pool_size = self.get_config('Telegram', 'connection_pool_size',
                                                               self.tg_connection_pool_size, int)
+            self.tg_delivery_workers = self.get_config('Telegram', 'delivery_workers', self.tg_delivery_workers, int)
+            self.tg_ordered_delivery = self.get_config('Telegram', 'ordered_delivery', self.tg_ordered_delivery, bool)
+            self.tg_rate_limit = self.get_config('Telegram', 'rate_limit', self.tg_rate_limit, float)
+            self.tg_chat_rate_limit = self.get_config('Telegram', 'chat_rate_limit', self.tg_chat_rate_limit, float)
+            self.tg_media_groups = self.get_config('Telegram', 'media_groups', self.tg_media_groups, bool)
+            self.tg_file_cache_size = self.get_config('Telegram', 'file_cache_size', self.tg_file_cache_size, int)
+            self.tg_retry_attempts = self.get_config('Telegram', 'retry_attempts', self.tg_retry_attempts, int)
+            self.tg_retry_delay = self.get_config('Telegram', 'retry_delay', self.tg_retry_delay, int)
+            self.tg_retry_max_delay = self.get_config('Telegram', 'retry_max_delay', self.tg_retry_max_delay, int)
 
             if cmd_args.read_old_mails:
                 self.imap_read_old_mails = True
@@ -260,21 +357,66 @@ class Config:
             logging.critical("Error parsing config file: %s." % config_error.message)
             sys.exit(2)
 
+    def get_section_name(self, section: str) -> str:
+        return '%s:%s' % (section, self.account) if self.account else section
+
+    def get_account_id(self) -> str:
+        """
+        Get ID of mailbox (state of mails in state file, label of metrics and profiles)
+        """
+        account_id = '%s@%s:%i' % (self.imap_user, self.imap_server, self.imap_port)
+        if self.account:
+            # separate state of accounts sharing the same mailbox (ex.: different search)
+            account_id += '/' + self.account
+        return account_id
+
+    @staticmethod
+    def load_all(tool, cmd_args) -> list['Config']:
+        """
+        Load configuration of all accounts: config files (or all '*.conf' files of config directories)
+        having section 'Mail' and optional sections 'Mail:<account>' for further accounts/folders.
+        """
+        config_files: list[str] = []
+        for path in cmd_args.config:
+            if os.path.isdir(path):
+                config_files += sorted(glob.glob(os.path.join(path, '*.conf')))
+            else:
+                config_files.append(path)
+
+        configs: list[Config] = []
+        for config_file in config_files:
+            config_parser = configparser.ConfigParser()
+            try:
+                config_parser.read(config_file)
+            except configparser.Error as config_error:
+                logging.critical("Error parsing config file '%s': %s." % (config_file, config_error.message))
+                sys.exit(2)
+            configs.append(Config(tool, cmd_args, config_file))
+            for section in config_parser.sections():
+                if section.startswith('Mail:'):
+                    configs.append(Config(tool, cmd_args, config_file, section[len('Mail:'):]))
+        return configs
+
     def get_config(self, section, key, default=None, value_type=None):
         value = default
         try:
-            if self.config_parser.has_section(section):
-                if self.config_parser.has_option(section, key):
-                    # get value based on type of default value
-                    if value_type is int:
-                        value = self.config_parser.getint(section, key)
-                    elif value_type is float:
-                        value = self.config_parser.getfloat(section, key)
-                    elif value_type is bool:
-                        value = self.config_parser.getboolean(section, key)
-                    else:
-                        # use string as default
-                        value = self.config_parser.get(section, key)
+            # options of account sections (ex.: 'Mail:<account>') overwrite options of main section ('Mail')
+            sections = [name for name in (self.get_section_name(section), section)
+                        if self.config_parser.has_section(name)]
+            if sections:
+                for section_name in sections:
+                    if self.config_parser.has_option(section_name, key):
+                        # get value based on type of default value
+                        if value_type is int:
+                            value = self.config_parser.getint(section_name, key)
+                        elif value_type is float:
+                            value = self.config_parser.getfloat(section_name, key)
+                        elif value_type is bool:
+                            value = self.config_parser.getboolean(section_name, key)
+                        else:
+                            # use string as default
+                            value = self.config_parser.get(section_name, key)
+                        break
             else:
                 # raise exception as both sections are mandatory sections (Mail + Telegram)
                 logging.warning("Get config value error for '%s'.'%s' (default: '%s'): Missing section '%s'."
@@ -299,19 +441,17 @@ class MailAttachmentType(Enum):
     IMAGE = 2
 
 
+@dataclasses.dataclass(slots=True, eq=False)
 class MailAttachment:
+    type: MailAttachmentType = MailAttachmentType.BINARY
     idx: int = 0
     id: str = ''
     name: str = ''
     alt: str = ''
-    type: MailAttachmentType = MailAttachmentType.BINARY
-    file: str | None = None
+    file: bytes | typing.IO[bytes] | None = dataclasses.field(default=None, repr=False)
+    content_hash: str | None = None
     tg_id: str | None = None
 
-    def __init__(self, attachment_type: MailAttachmentType = MailAttachmentType.BINARY):
-        super().__init__()
-        self.type = attachment_type
-
     def set_name(self, file_name: str):
         name: str = ''
         for file_name_part in email.header.decode_header(file_name):
@@ -329,7 +469,61 @@ class MailAttachment:
         elif self.name:
             return self.name
         else:
-            return self.file
+            return self.id
+
+    def get_file(self, attach: bool = False) -> InputFile | None:
+        """
+        Get content for upload named by attachment, spooled files are streamed from start (again).
+        (file name of spooled file kept in memory is None, so name of upload is always given)
+        Files of media groups are attached by name ('attach').
+        """
+        if self.file is None:
+            return None
+        if isinstance(self.file, bytes):
+            return InputFile(self.file, filename=self.name or None, attach=attach)
+        self.file.seek(0)
+        return InputFile(self.file, filename=self.name or 'application.octet-stream', attach=attach,
+                         read_file_handle=False)
+
+    def get_hash(self) -> str:
+        """
+        Get (cached) hash of content
+        """
+        if self.content_hash is None:
+            digest = hashlib.sha256()
+            if hasattr(self.file, 'read'):
+                self.file.seek(0)
+                for block in iter(functools.partial(self.file.read, 65536), b''):
+                    digest.update(block)
+            elif self.file is not None:
+                digest.update(self.file)
+            self.content_hash = digest.hexdigest()
+        return self.content_hash
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+        self.file = None
+
+    def __getstate__(self):
+        # parsed by worker process: content of spooled file is handed over by a named temporary file
+        state = {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
+        if hasattr(self.file, 'read'):
+            self.file.seek(0)
+            with tempfile.NamedTemporaryFile(prefix='mailToTelegramForwarder-', delete=False) as handover:
+                shutil.copyfileobj(self.file, handover)
+            state['file'] = None
+            state['handover_file'] = handover.name
+        return state
+
+    def __setstate__(self, state):
+        handover_file = state.pop('handover_file', None)
+        for name, value in state.items():
+            setattr(self, name, value)
+        if handover_file is not None:
+            # file will be removed, as soon as it was closed
+            self.file = open(handover_file, 'rb')
+            os.unlink(handover_file)
 
 
 class MailDataType(Enum):
@@ -338,395 +532,1984 @@ class MailDataType(Enum):
 
 
 class MailImage(dict):
+    __slots__ = ()
     key: str
     image: MailAttachment
 
 
+@dataclasses.dataclass(slots=True, eq=False)
 class MailBody:
     text: str = ''
     html: str = ''
-    images: list[MailImage] = []
-    attachments: list[MailAttachment] = []
+    images: list[MailImage] = dataclasses.field(default_factory=list)
+    attachments: list[MailAttachment] = dataclasses.field(default_factory=list)
 
 
+@dataclasses.dataclass(slots=True, eq=False)
 class MailData:
+    """
+    Parsed and rendered mail (parsed message isn't kept, attachments are released after delivery)
+    """
     uid: str = ''
-    #raw: str = '' #
-    raw: None # type :email.message.Message[str,str] | None
     type: MailDataType = MailDataType.TEXT
     summary: str = ''
     mail_from: str = ''
     mail_subject: str = ''
     mail_body: str = ''
-    mail_images: list[MailImage] = []
+    mail_images: list[MailImage] = dataclasses.field(default_factory=list)
     attachment_summary: str = ''
-    attachments: list[MailAttachment] = []
+    attachments: list[MailAttachment] = dataclasses.field(default_factory=list)
+    header_summary: str = ''
+    headers: dict[str, str] = dataclasses.field(default_factory=dict)
+    targets: list['RouteTarget'] | None = None
+    # targets of last delivery attempt the mail failed to be sent to
+    failed_targets: list['RouteTarget'] = dataclasses.field(default_factory=list)
+    delivered: bool = False
+    # reason of failed delivery and flood wait requested by Telegram (seconds)
+    error: str = ''
+    retry_after: float = 0
+    # size (bytes) of raw mail, start of fetch (perf_counter) and duration (seconds) of processing stages
+    size: int = 0
+    started: float = 0
+    timings: dict[str, float] = dataclasses.field(default_factory=dict)
+    # cProfile stats, tracemalloc snapshot and memory peak of parsing (profile mode)
+    profile: dict[str, typing.Any] | None = None
+
+    def release(self):
+        """
+        Release content of attachments/images (ex.: temporary files), after delivery.
+        """
+        for attachment in self.attachments:
+            attachment.close()
+        for mail_image in self.mail_images:
+            mail_image['image'].close()
+        self.attachments = []
+        self.mail_images = []
 
 
-class TelegramBot:
+class ControlCharacters(dict):
+    """
+    Translation table (see str.translate) removing control characters and replacing
+    line breaks and tabs by spaces, categories are looked up once per character
+    """
+    def __missing__(self, code: int):
+        char = chr(code)
+        if char.isspace():
+            value = ' '
+        elif unicodedata.category(char)[0] == 'C':
+            value = None
+        else:
+            value = code
+        self[code] = value
+        return value
+
+
+class TelegramHtmlParser(html.parser.HTMLParser):
+    """
+    Convert HTML to Telegram HTML in a single pass: keep supported elements, links and
+    images (as placeholders) only and translate block elements to line breaks.
+    Processing stops after 'max_length' visible characters.
+    """
+    # supported tags
+    # https://core.telegram.org/bots/api#sendmessage
+    # <b>bold</b>, <strong>bold</strong>
+    # <i>italic</i>, <em>italic</em>
+    # <u>underline</u>, <ins>underline</ins>
+    # <s>strikethrough</s>, <strike>strikethrough</strike>, <del>strikethrough</del>
+    # <b>bold <i>italic bold <s>italic bold strikethrough</s> <u>underline italic bold</u></i> bold</b>
+    # <a href="http://www.example.com/">inline URL</a>
+    # <a href="tg://user?id=123456789">inline mention of a user</a>
+    # <code>inline fixed-width code</code>
+    # <pre>pre-formatted fixed-width code block</pre>
+    # span elements only supported as spoiler elements
+    SUPPORTED_ELEMENTS = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'a', 'code', 'pre'}
+    # line break before and after element
+    BLOCK_ELEMENTS = {'p', 'div', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+    # content of element will be removed
+    HIDDEN_ELEMENTS = {'head', 'title', 'script', 'style'}
+    CHUNK_SIZE = 16384
+
+    control_characters = ControlCharacters()
+    whitespace_pattern = re.compile(r'\s+')
+    image_source_pattern = re.compile(r'^(?P<proto>cid|https?):/*(?P<cid>.*)$', flags=(re.DOTALL | re.IGNORECASE))
+
+    config: Config
+    images: dict[str, MailAttachment]
+    max_length: int
+    output: list[str]
+    # open supported elements: (name, start tag), start tags of first 'written' elements are written,
+    # 'open_elements' counts open elements by name
+    stack: list[tuple[str, str]]
+    written: int = 0
+    open_elements: collections.Counter
+    hidden: int = 0
+    pending: str = ''
+    length: int = 0
+    truncated: bool = False
+
+    def __init__(self, config: Config, images: list[MailImage] | None = None, max_length: int = 0):
+        super().__init__(convert_charrefs=True)
+        self.config = config
+        self.images = {image['key']: image['image'] for image in images} if images else {}
+        self.image_seen: set[str] = set()
+        self.max_length = max_length
+        self.output = []
+        self.stack = []
+        self.open_elements = collections.Counter()
+
+    def convert(self, message: str) -> str:
+        for start in range(0, len(message), self.CHUNK_SIZE):
+            self.feed(message[start:start + self.CHUNK_SIZE])
+            if self.truncated:
+                break
+        else:
+            self.close()
+
+        # close open elements
+        while self.stack:
+            self._close_element()
+        return ''.join(self.output)
+
+    def _break(self, separator: str):
+        """
+        Add space or line break before next content (line break wins)
+        """
+        if self.output and self.pending != '\n':
+            self.pending = separator
+
+    def _write(self, text: str, visible: int):
+        """
+        Write visible content, open elements will be written before first content
+        """
+        if self.pending:
+            self.output.append(self.pending)
+            self.pending = ''
+        if self.written < len(self.stack):
+            self.output += [start_tag for _, start_tag in self.stack[self.written:]]
+            self.written = len(self.stack)
+        self.output.append(text)
+        self.length += visible
+
+    def _open_element(self, name: str, start_tag: str):
+        self.stack.append((name, start_tag))
+        self.open_elements[name] += 1
+
+    def _close_element(self) -> str:
+        name, _ = self.stack.pop()
+        self.open_elements[name] -= 1
+        if self.written > len(self.stack):
+            self.written = len(self.stack)
+            self.output.append('</%s>' % name)
+        # else: elements without content (ex.: tracking links) are skipped
+        return name
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.HIDDEN_ELEMENTS:
+            self.hidden += 1
+        elif self.hidden or self.truncated:
+            return
+        elif tag == 'img':
+            self._handle_image(dict(attrs), attrs)
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self._open_element('a', '<a href="%s">' % html.escape(href, quote=True))
+            else:
+                # links without target will be written as text
+                self._break(' ')
+        elif tag in self.SUPPORTED_ELEMENTS:
+            self._open_element(tag, '<%s>' % tag)
+        elif tag == 'li':
+            # prepare list items (migrate list items to "- <text of li element>")
+            self._break('\n')
+            self._write('- ', 0)
+        elif tag in self.BLOCK_ELEMENTS or tag == 'br':
+            self._break('\n')
+        else:
+            # remove unsupported tags
+            self._break(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag != 'img':
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.HIDDEN_ELEMENTS:
+            self.hidden = max(0, self.hidden - 1)
+        elif self.hidden or self.truncated:
+            return
+        elif tag in self.SUPPORTED_ELEMENTS:
+            if self.open_elements[tag]:
+                # close element, and all (unclosed) elements opened after this element
+                while self._close_element() != tag:
+                    pass
+            if tag == 'a':
+                self._break(' ')
+        elif tag in self.BLOCK_ELEMENTS or tag in ('br', 'tr', 'li'):
+            self._break('\n')
+        else:
+            self._break(' ')
+
+    def handle_data(self, data):
+        if self.hidden or self.truncated:
+            return
+        # remove control chars and multiple spaces (regular Browser logic)
+        text = self.whitespace_pattern.sub(' ', data.translate(self.control_characters))
+        if text.startswith(' '):
+            self._break(' ')
+            text = text.lstrip(' ')
+        trailing_space = text.endswith(' ')
+        text = text.rstrip(' ')
+        if not text:
+            return
+
+        if self.max_length and self.length + len(text) > self.max_length:
+            # text exceeding limit is dropped, processing stops
+            text = text[:max(0, self.max_length - self.length)]
+            self.truncated = True
+            if not text:
+                return
+        self._write(html.escape(text, quote=False), len(text))
+        if trailing_space:
+            self._break(' ')
+
+    def _handle_image(self, attributes: dict, attrs: list):
+        # use first alt or title value
+        alt = ''
+        for name, value in attrs:
+            if name in ('alt', 'title') and value:
+                alt = value
+                break
+        alt_text = html.escape(self.whitespace_pattern.sub(' ', alt.translate(self.control_characters)).strip(),
+                               quote=False)
+
+        match = self.image_source_pattern.match(attributes.get('src') or '')
+        placeholder = None
+        if match is not None:
+            if match.group('proto').lower().startswith('http'):
+                # web link
+                src = match.group(0)
+                if not self.config.imap_ignore_inline_image \
+                        or not re.search(self.config.imap_ignore_inline_image, src, re.IGNORECASE):
+                    placeholder = "${img-link:%s|%s}" % (html.escape(src, quote=True).replace('|', '%7C'),
+                                                         alt_text.replace('}', ')'))
+            else:
+                # attached/embedded image
+                cid = match.group('cid')
+                if cid and cid not in self.image_seen and cid in self.images:
+                    self.image_seen.add(cid)
+                    # add image reference and remember alt/title for caption
+                    self.images[cid].alt = alt
+                    placeholder = '${file:%s}' % cid
+
+        if placeholder is not None:
+            self._break(' ')
+            self._write(placeholder, len(alt_text))
+            self._break(' ')
+        elif alt_text:
+            # no file found, use alt text
+            self._write(alt_text, len(alt_text))
+
+
+class HtmlCleaner:
+    """
+    Convert HTML of mails to HTML supported by Telegram
+    """
     config: Config
-    request: HTTPXRequest
-    bot: Bot
-    error_send_message: str = "Failed to send Telegram message: %s"
 
     def __init__(self, config: Config):
         self.config = config
+
+    def convert(self, message: str, images: list[MailImage] | None = None,
+                max_length: int = 0) -> tuple[str, bool]:
+        """
+        Parse HTML message and remove HTML elements not supported by Telegram,
+        returns converted message and if it was truncated after 'max_length' visible characters
+        """
+        tg_msg: str = ''
+        parser = TelegramHtmlParser(self.config, images, max_length)
         try:
-            # Initialize the Bot with HTTPXRequest with increased connection pool size and proper timeouts
-            self.request = HTTPXRequest(
-                connection_pool_size=config.tg_connection_pool_size,
-                pool_timeout=config.tg_connection_pool_timeout,
-                connect_timeout=config.tg_connection_connect_timeout,
-                read_timeout=config.tg_connection_read_timeout,
-                write_timeout=config.tg_connection_read_timeout
-            )
-            self.bot = Bot(token=self.config.tg_bot_token, request=self.request)
-        except error.TelegramError as tg_error:
-            logging.critical(self.error_send_message % tg_error.message)
+            tg_msg = parser.convert(message)
+        except Exception as ex:
+            logging.critical(ex)
+        return tg_msg, parser.truncated
 
     def cleanup_html(self, message: str, images: list[MailImage] | None = None) -> str:
         """
         Parse HTML message and remove HTML elements not supported by Telegram
         """
-        # supported tags
-        # https://core.telegram.org/bots/api#sendmessage
-        # <b>bold</b>, <strong>bold</strong>
-        # <i>italic</i>, <em>italic</em>
-        # <u>underline</u>, <ins>underline</ins>
-        # <s>strikethrough</s>, <strike>strikethrough</strike>, <del>strikethrough</del>
-        # <b>bold <i>italic bold <s>italic bold strikethrough</s> <u>underline italic bold</u></i> bold</b>
-        # <a href="http://www.example.com/">inline URL</a>
-        # <a href="tg://user?id=123456789">inline mention of a user</a>
-        # <code>inline fixed-width code</code>
-        # <pre>pre-formatted fixed-width code block</pre>
-        # <pre><code class="language-python">pre-formatted fixed-width code block
-        #      written in the Python programming language</code></pre>
-        # span elements only supported as spoiler elements
-        # tg_msg = re.sub(r'<\s*span\b', '<span class="tg-spoiler"', tg_msg,
-        #                 flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
-
-        tg_body: str = message
-        tg_msg: str = ''
-        try:
-            soup = BeautifulSoup(tg_body, 'html.parser')
-            tg_body = soup.prettify()
-
-            # extract HTML body to get payload from mail
-            tg_body = re.sub(r'.*<body[^>]*>(?P<body>.*)</body>.*$', r'\g<body>', tg_body,
-                             flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
-
-            # remove control chars
-            tg_body = "".join(ch for ch in tg_body if "C" != unicodedata.category(ch)[0])
-
-            # remove all HTML comments
-            tg_body = re.sub(r'<!--.*?-->', '', tg_body, flags=(re.DOTALL | re.MULTILINE))
-
-            # handle inline images
-            image_seen: dict[str] = {}
-            for match in re.finditer(
-                    r'(?P<img><\s*img\s+[^>]*?\s*src\s*=\s*"'
-                    r'(?P<src>(?P<proto>(cid|https?)):/*(?P<cid>[^"]*))"[^>]*?/?\s*>)',
-                    tg_body,
-                    flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE)):
-                img: str = match.group('img')
-                proto: str = match.group('proto')
-
-                # extract alt or title value
-                alt: str = re.sub(r'^.*?((title|alt)\s*=\s*"(?P<alt>[^"]+)")?.*$', r'\g<alt>',
-                                  img, flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
-
-                if 'http' in proto:
-                    # web link
-                    src = match.group('src')
-                    if self.config.imap_ignore_inline_image \
-                            and re.search(self.config.imap_ignore_inline_image, src, re.IGNORECASE):
-                        continue
-                    tg_body = tg_body.replace(img, "${img-link:%s|%s}" % (src, alt))
+        tg_msg, _ = self.convert(message, images)
+        return tg_msg
+
+
+class MailRenderer:
+    """
+    Render mails as Telegram messages (Markdown or HTML) by precompiled patterns.
+    Markdown is escaped by a table of characters (same result as 'helpers.escape_markdown'),
+    characters are replaced one after another and only if found.
+    """
+    # characters to escape by Markdown version, backslash first (not escaped twice)
+    MARKDOWN_ESCAPE = {1: ('_', '*', '`', '['),
+                       2: ('\\', '_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}',
+                           '.', '!')}
+    SUMMARY_LINE = "\n=============================\n"
+
+    cid_pattern = re.compile(r'\[cid:([^]]*)]', flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+    # multiple line breaks (keeping up to 1 empty line), same as '(\s*\r?\n){2,}' but without group repeat
+    line_breaks_pattern = re.compile(r'\s*\n\s*\n')
+    # end of link and '&gt;' of mail marker (ex.: &lt;<a href="mailto:t@ex.com">t@ex.xom</a>&gt;)
+    link_end_pattern = re.compile(r'(?P<a></a>(\s*&gt;)?)\s*')
+    image_link_pattern = re.compile(r'(\${img-link:(?P<src>[^|]*)\|(?P<alt>[^}]*)})',
+                                    flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+
+    config: Config
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    @classmethod
+    def escape_markdown(cls, text: str, version: int = 2) -> str:
+        for char in cls.MARKDOWN_ESCAPE[int(version)]:
+            if char in text:
+                text = text.replace(char, '\\' + char)
+        return text
+
+    def escape(self, text: str) -> str:
+        """
+        Escape text by configured Markdown version
+        """
+        return self.escape_markdown(text, self.config.tg_markdown_version)
+
+    def render_content(self, content: str, message_type: MailDataType, truncated: bool = False) -> str:
+        """
+        Remove useless line breaks and spaces of content and truncate it after 'max_length' characters
+        """
+        if not content:
+            return content
+        content = self.line_breaks_pattern.sub("\n\n", content)
+
+        if message_type == MailDataType.HTML:
+            # add space after links (provide space for touch on link lists)
+            content = self.link_end_pattern.sub(r'\g<a>\n\n', content)
+
+        # remove spaces and line breaks on start and end (enhanced strip)
+        content = content.strip()
+
+        max_len = self.config.imap_max_length
+        if message_type == MailDataType.HTML:
+            # HTML was truncated during conversion (visible characters, all elements closed)
+            if truncated:
+                content += "... (first " + str(max_len) + " characters)"
+        elif 0 < max_len < len(content):
+            # remove last "\" (escaped character was cut), before a final line break as well (like '\\*$')
+            content = content[:max_len]
+            if content.endswith('\n'):
+                content = content[:-1].rstrip('\\') + '\n'
+            else:
+                content = content.rstrip('\\')
+            content += "... (first " + str(max_len) + " characters)"
+        return content
+
+    def render_attachments(self, attachments: list[MailAttachment], message_type: MailDataType) -> str:
+        """
+        Summary of attachments (number and file names)
+        """
+        if not attachments:
+            return ''
+        if message_type == MailDataType.HTML:
+            lines = ["\n\n" + chr(10133) + " <b>" + str(len(attachments)) + " attachments:</b>\n"]
+            lines += ["\n " + str(attachment.idx) + ": " + attachment.name for attachment in attachments]
+        else:
+            lines = ["\n\n" + chr(10133) + " **" + str(len(attachments)) + " attachments:**\n"]
+            lines += ["\n " + str(attachment.idx) + ": " + self.escape(attachment.name)
+                      for attachment in attachments]
+        return ''.join(lines)
+
+    def render_header(self, mail_from: str, subject: str, message_type: MailDataType) -> tuple[str, str, str, str]:
+        """
+        Returns header (sender and label of subject), escaped sender, subject and summary line
+        """
+        summary_line = self.SUMMARY_LINE if self.config.tg_forward_mail_content else "\n"
+        if message_type == MailDataType.HTML:
+            mail_from = html.escape(mail_from, quote=True)
+            return "<b>From:</b> " + mail_from + "\n<b>Subject:</b> ", mail_from, subject, summary_line
+
+        mail_from = self.escape(mail_from)
+        return "*From:* " + mail_from + "\n*Subject:* ", mail_from, self.escape(subject), self.escape(summary_line)
+
+    def render_image_links(self, message: str) -> str:
+        """
+        Replace placeholders of web images by links
+        """
+        return self.image_link_pattern.sub(
+            lambda img_link: '<a href="%s">🖼 %s</a>' % (img_link.group('src'), img_link.group('alt')), message)
+
+
+class MessageSplitter:
+    """
+    Split long messages into chunks below Telegram's limit (characters after entity parsing)
+    by a single pass: chunks end at paragraph, line or word boundaries, formatting open at the
+    end of a chunk is closed and reopened at the start of the next chunk.
+    """
+    MAX_LENGTH = 4096
+
+    whitespace = r'|(?P<paragraph>\n[ \t]*\n\s*)|(?P<line>\n\s*)|(?P<space>[ \t]+)'
+    html_token_pattern = re.compile(r'(?P<tag><(?P<end>/?)(?P<name>[a-zA-Z0-9-]+)[^>]*>)|(?P<entity>&#?\w+;)'
+                                    + whitespace + r'|(?P<text>[^<&\s]+|[\s\S])')
+    # code of MarkdownV2 may contain escaped characters (ex.: '\`')
+    markdown_v2_token_pattern = re.compile(r'(?P<code>```(?:\\.|[^\\])*?```|`(?:\\.|[^`\\])*`)'
+                                           r'|(?P<marker>\|\||__|[*_~])|(?P<entity>\\.)'
+                                           + whitespace + r'|(?P<text>[^`|_*~\\\s]+|[\s\S])', flags=re.DOTALL)
+    markdown_token_pattern = re.compile(r'(?P<code>```.*?```|`[^`]*`)|(?P<marker>[*_])|(?P<entity>\\.)'
+                                        + whitespace + r'|(?P<text>[^`_*\\\s]+|[\s\S])', flags=re.DOTALL)
+    # preferred breaks: paragraphs and lines filling half of the chunk at least, then words
+    break_preference = (('paragraph', 0.5), ('line', 0.5), ('space', 0), ('line', 0), ('paragraph', 0))
+
+    parse_mode: str
+    max_length: int
+
+    def __init__(self, parse_mode: str, max_length: int = MAX_LENGTH):
+        self.parse_mode = parse_mode
+        self.max_length = max_length
+
+    @staticmethod
+    def text_length(text: str) -> int:
+        # Telegram counts UTF-16 code units
+        return len(text.encode('utf-16-le')) // 2
+
+    def split(self, message: str) -> list[str]:
+        if self.text_length(message) <= self.max_length:
+            return [message]
+
+        html_mode = self.parse_mode == ParseMode.HTML
+        if html_mode:
+            pattern = self.html_token_pattern
+        elif self.parse_mode == ParseMode.MARKDOWN_V2:
+            pattern = self.markdown_v2_token_pattern
+        else:
+            pattern = self.markdown_token_pattern
+
+        chunks: list[str] = []
+        # open formatting: (name, start tag/marker)
+        stack: list[tuple[str, str]] = []
+        prefix = ''
+        chunk_start = 0
+        # visible characters of message before current token and before current chunk
+        total = 0
+        offset = 0
+        # last break per kind: (end of chunk, start of next chunk, visible characters before next chunk, formatting)
+        breaks: dict[str, tuple[int, int, int, tuple]] = {}
+
+        def emit(end: int, next_start: int, next_offset: int, open_elements: tuple):
+            nonlocal prefix, chunk_start, offset
+            text = message[chunk_start:end].rstrip()
+            if text:
+                if html_mode:
+                    suffix = ''.join('</%s>' % name for name, _ in reversed(open_elements))
                 else:
-                    # attached/embedded image
-                    cid = match.group('cid')
-                    if cid == '' or cid in image_seen:
-                        continue
-                    image_seen[cid] = True
-
-                    if cid in images:
-                        # add image reference
-                        tg_body = tg_body.replace(img, '${file:%s}' % cid)
-                        # extract alt/title attributes of img elements
-                        for image in images:
-                            if image.key == cid:
-                                images.alt = alt
-                                break
+                    suffix = ''.join(name for name, _ in reversed(open_elements))
+                chunks.append(prefix + text + suffix)
+            prefix = ''.join(start for _, start in open_elements)
+            chunk_start = next_start
+            offset = next_offset
+            for kind_name in [name for name, item in breaks.items() if item[0] < next_start]:
+                del breaks[kind_name]
+
+        for match in pattern.finditer(message):
+            kind = match.lastgroup
+            token_start = match.start()
+            if kind in ('tag', 'marker'):
+                visible = 0
+            elif kind == 'entity':
+                visible = 1
+            elif kind == 'code':
+                visible = self.text_length(match.group()) - (6 if match.group().startswith('```') else 2)
+            else:
+                visible = self.text_length(match.group())
+
+            if kind == 'code' and visible > self.max_length:
+                # single code entity longer than limit: content is split, code is closed and reopened
+                if total > offset:
+                    emit(token_start, token_start, total, tuple(stack))
+                delimiter = '```' if match.group().startswith('```') else '`'
+                content_start = token_start + len(delimiter)
+                if delimiter == '```' and '\n' in match.group():
+                    # language of code block is kept
+                    content_start = message.index('\n', token_start) + 1
+                content_end = match.end() - len(delimiter)
+                stack.append((delimiter, message[token_start:content_start]))
+                cut = content_start
+                while self.text_length(message[cut:content_end]) > self.max_length:
+                    end = cut
+                    free = self.max_length
+                    while end < content_end:
+                        # escaped characters are kept together
+                        step = 2 if message[end] == '\\' and self.parse_mode == ParseMode.MARKDOWN_V2 else 1
+                        if free - self.text_length(message[end:end + step]) < 0:
+                            break
+                        free -= self.text_length(message[end:end + step])
+                        end += step
+                    line_end = message.rfind('\n', cut, end)
+                    if line_end >= cut + (end - cut) // 2:
+                        end = line_end + 1
+                    total += self.text_length(message[cut:end])
+                    emit(end, end, total, tuple(stack))
+                    cut = end
+                stack.pop()
+                total += self.text_length(message[cut:content_end])
+                continue
+
+            while total + visible - offset > self.max_length:
+                for candidate, min_fill in self.break_preference:
+                    found = breaks.get(candidate)
+                    if found is not None and found[2] - offset >= min_fill * self.max_length:
+                        emit(*found)
+                        break
+                else:
+                    if kind == 'text' and total - offset < self.max_length:
+                        # hard break within word
+                        cut = token_start
+                        free = self.max_length - (total - offset)
+                        while free - self.text_length(message[cut]) >= 0:
+                            free -= self.text_length(message[cut])
+                            cut += 1
+                        used = self.text_length(message[token_start:cut])
+                        emit(cut, cut, total + used, tuple(stack))
+                        total += used
+                        visible -= used
+                        token_start = cut
+                    elif total > offset:
+                        emit(token_start, token_start, total, tuple(stack))
                     else:
-                        # no file found, use alt text
-                        tg_body = tg_body.replace(img, alt)
+                        # single entity longer than limit
+                        break
+
+            if kind == 'tag':
+                name = match.group('name').lower()
+                if match.group('end'):
+                    if stack and stack[-1][0] == name:
+                        stack.pop()
+                else:
+                    stack.append((name, match.group()))
+            elif kind == 'marker':
+                if stack and stack[-1][0] == match.group():
+                    stack.pop()
+                else:
+                    stack.append((match.group(), match.group()))
+            elif kind in ('paragraph', 'line', 'space'):
+                breaks[kind] = (match.start(), match.end(), total + visible, tuple(stack))
+            total += visible
 
-            # use alt text for all images without cid (embedded image)
-            tg_body = re.sub(r'<\s*img\s+[^>]*?((title|alt)\s*=\s*"(?P<alt>[^"]+)")?[^>]*?/?\s*>', r'\g<alt>',
-                             tg_body, flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+        emit(len(message), len(message), total, ())
+        return chunks
 
-            # remove multiple line breaks and spaces (regular Browser logic)
-            tg_body = re.sub(r'\s\s+', ' ', tg_body).strip()
 
-            # remove attributes from elements but href of "a"- elements
-            tg_msg = re.sub(r'<\s*?(?P<elem>\w+)\b\s*?[^>]*?(?P<ref>\s+href\s*=\s*"[^"]+")?[^>]*?>',
-                            r'<\g<elem>\g<ref>>', tg_body, flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+class RouteTarget:
+    """
+    Destination of a routed mail: chat, optional topic (message thread) and message format
+    """
+    FORMAT_FULL = 'full'
+    FORMAT_SUMMARY = 'summary'
 
-            # remove style and script elements/blocks
-            tg_msg = re.sub(r'<\s*(?P<elem>script|style)\s*>.*?</\s*(?P=elem)\s*>',
-                            '', tg_msg, flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+    chat_id: int
+    thread_id: int | None = None
+    message_format: str = FORMAT_FULL
 
-            # translate paragraphs and line breaks (block elements)
-            tg_msg = re.sub(r'</?\s*(?P<elem>(p|div|table|h\d+))\s*>', '\n', tg_msg,
-                            flags=(re.MULTILINE | re.IGNORECASE))
-            tg_msg = re.sub(r'</\s*(?P<elem>(tr))\s*>', '\n', tg_msg, flags=(re.MULTILINE | re.IGNORECASE))
-            tg_msg = re.sub(r'</?\s*(br)\s*[^>]*>', '\n', tg_msg, flags=(re.MULTILINE | re.IGNORECASE))
+    def __init__(self, chat_id: int, thread_id: int | None = None, message_format: str = FORMAT_FULL):
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.message_format = message_format
 
-            # prepare list items (migrate list items to "- <text of li element>")
-            tg_msg = re.sub(r'(<\s*[ou]l\s*>[^<]*)?<\s*li\s*>', '\n- ', tg_msg, flags=(re.MULTILINE | re.IGNORECASE))
-            tg_msg = re.sub(r'</\s*li\s*>([^<]*</\s*[ou]l\s*>)?', '\n', tg_msg, flags=(re.MULTILINE | re.IGNORECASE))
+    def __repr__(self):
+        if self.thread_id is None:
+            return '%s (%s)' % (self.chat_id, self.message_format)
+        return '%s/%s (%s)' % (self.chat_id, self.thread_id, self.message_format)
 
-            # remove unsupported tags
-            # https://core.telegram.org/api/entities
-            regex_filter_elem = re.compile(
-                r'<\s*(?!/?\s*(?P<elem>bold|strong|i|em|u|ins|s|strike|del|b|a|code|pre)\b)[^>]*>',
-                flags=(re.MULTILINE | re.IGNORECASE))
-            tg_msg = re.sub(regex_filter_elem, ' ', tg_msg)
 
-            # remove empty links
-            tg_msg = re.sub(r'<\s*a\s*>(?P<link>[^<]*)</\s*a\s*>', r'\g<link> ', tg_msg,
-                            flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+class Route:
+    """
+    Routing rule (config section 'Route:<name>'): all conditions (regular expressions
+    searched in decoded headers) have to match.
+    """
+    ACTION_FORWARD = 'forward'
+    ACTION_DROP = 'drop'
 
-            # remove links without text (tracking stuff, and none clickable)
-            tg_msg = re.sub(r'<\s*a\s*[^>]*>\s*</\s*a\s*>', ' ', tg_msg,
-                            flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE))
+    name: str
+    conditions: dict[str, str]
+    targets: list[RouteTarget]
+    action: str = ACTION_FORWARD
+    next: bool = False
 
-            # remove empty elements
-            tg_msg = re.sub(r'<\s*\w\s*>\s*</\s*\w\s*>', ' ', tg_msg, flags=(re.DOTALL | re.MULTILINE))
+    def __init__(self, name: str):
+        self.name = name
+        self.conditions = {}
+        self.targets = []
 
-            # remove multiple line breaks
-            tg_msg = re.sub(r'\s*[\r\n](\s*[\r\n])+', "\n", tg_msg)
 
-            # preserve NBSPs
-            tg_msg = re.sub(r'&nbsp;', ' ', tg_msg, flags=re.IGNORECASE)
+class PatternIndex:
+    """
+    Patterns of routing rules for one header, indexed by a substring (n-gram) of the literal text
+    each pattern requires. Only patterns whose n-gram occurs in the header are searched, so the costs
+    depend on the length of the header and not on the number of rules.
+    """
+    GRAM_SIZE = 3
+    # pattern metacharacters, literal text is split at these characters
+    META_CHARS = '.^$*+?{}[]()|'
+    # repetition '{m}', '{m,}', '{,n}' or '{m,n}' (other braces are literal text)
+    QUANTIFIER = re.compile(r'\{(?:\d+(?:,\d*)?|,\d*)\}')
 
-        except Exception as ex:
-            logging.critical(ex)
+    grams: dict[str, list[tuple[int, str, re.Pattern]]]
+    unindexed: list[tuple[int, re.Pattern]]
 
-        return tg_msg
+    def __init__(self):
+        self.grams = {}
+        self.unindexed = []
 
-    async def send_message(self, mails: list[MailData]):
+    @classmethod
+    def required_literal(cls, pattern: str) -> str:
         """
-        Send mail data over Telegram API to chat/user.
+        Get longest (ASCII) text, which every match of pattern must contain (empty if unknown).
+        Only text outside of groups and character sets is used, patterns with alternatives
+        or inline flags are not indexed at all.
         """
-        try:
-            # Initialize the Bot with HTTPXRequest with increased connection pool size and proper timeouts
-            async with Bot(token=self.config.tg_bot_token, request=self.request) as bot:
-                logging.debug("Bot initialized, connecting to Chat '{0}'...".format(self.config.tg_forward_to_chat_id))
+        if '|' in pattern or re.search(r'\(\?[a-zA-Z]', pattern):
+            return ''
+        runs: list[str] = []
+        run = ''
+        depth = 0
+        idx = 0
+        while idx < len(pattern):
+            char = pattern[idx]
+            if char == '\\' and idx + 1 < len(pattern):
+                escaped = pattern[idx + 1]
+                idx += 2
+                if depth == 0 and not escaped.isalnum():
+                    run += escaped
+                else:
+                    # character class (ex.: \d) or back reference
+                    runs.append(run)
+                    run = ''
+                continue
+            if char in cls.META_CHARS:
+                quantifier = cls.QUANTIFIER.match(pattern, idx) if char == '{' else None
+                if (char in '*?' or quantifier) and run:
+                    # previous character is optional (or repeated)
+                    run = run[:-1]
+                runs.append(run)
+                run = ''
+                if quantifier:
+                    # skip repetition count
+                    idx = quantifier.end() - 1
+                elif char in '([':
+                    depth += 1
+                    if char == '[':
+                        # skip character set (']' as first character is part of set)
+                        idx += 2 if pattern[idx + 1:idx + 2] == '^' else 1
+                        if pattern[idx:idx + 1] == ']':
+                            idx += 1
+                        while idx < len(pattern) and pattern[idx] != ']':
+                            idx += 2 if pattern[idx] == '\\' else 1
+                        depth -= 1
+                elif char == ')':
+                    depth = max(0, depth - 1)
+            elif depth == 0:
+                run += char
+            idx += 1
+        runs.append(run)
+        literal = max(runs, key=len).lower()
+        return literal if literal.isascii() else ''
+
+    def add(self, rule_idx: int, pattern: str):
+        compiled = re.compile(pattern, re.IGNORECASE)
+        literal = self.required_literal(pattern)
+        if len(literal) < self.GRAM_SIZE:
+            self.unindexed.append((rule_idx, compiled))
+            return
+        # use least used n-gram of literal, to keep candidate lists short
+        gram = min((literal[i:i + self.GRAM_SIZE] for i in range(len(literal) - self.GRAM_SIZE + 1)),
+                   key=lambda key: len(self.grams.get(key, ())))
+        self.grams.setdefault(gram, []).append((rule_idx, literal, compiled))
+
+    def match(self, value: str) -> list[int]:
+        """
+        Get index of all rules, whose pattern is found in value.
+        """
+        matched = [rule_idx for rule_idx, pattern in self.unindexed if pattern.search(value)]
+        folded = value.casefold()
+        seen = set()
+        for i in range(len(folded) - self.GRAM_SIZE + 1):
+            gram = folded[i:i + self.GRAM_SIZE]
+            if gram in self.grams and gram not in seen:
+                seen.add(gram)
+                matched += [rule_idx for rule_idx, literal, pattern in self.grams[gram]
+                            if literal in folded and pattern.search(value)]
+        return matched
+
+
+class MailRouter:
+    """
+    Route mails to chats/topics by rules (config sections 'Route:<name>'), evaluated in order of
+    config file. Patterns are indexed per header (see PatternIndex), so hundreds of rules are cheap.
+    """
+    FIELDS = ('from', 'to', 'subject', 'list_id', 'folder')
+    SECTION_PREFIX = 'Route:'
 
-                tg_chat: ChatFullInfo = await bot.get_chat(self.config.tg_forward_to_chat_id)
+    routes: list[Route]
+    indexes: dict[str, PatternIndex]
+    # index of rules without conditions
+    unconditional: list[int]
 
-                # get chat title
-                tg_chat_title = tg_chat.full_name
-                if not tg_chat_title:
-                    tg_chat_title = tg_chat.title
-                if not tg_chat_title:
-                    tg_chat_title = tg_chat.id
+    def __init__(self, config: Config):
+        self.routes = []
+        self.indexes = {}
+        self.unconditional = []
 
-                for mail in mails:
+        config_parser = config.config_parser
+        for section in config_parser.sections():
+            if not section.startswith(self.SECTION_PREFIX):
+                continue
+            route = Route(section[len(self.SECTION_PREFIX):])
+            for field in self.FIELDS:
+                if config_parser.has_option(section, field):
+                    pattern = config_parser.get(section, field)
                     try:
-                        if self.config.tg_markdown_version == 2:
-                            parser = ParseMode.MARKDOWN_V2
-                        else:
-                            parser = ParseMode.MARKDOWN
-                        if mail.type == MailDataType.HTML:
-                            parser = ParseMode.HTML
-
-                        if self.config.tg_forward_mail_content or not self.config.tg_forward_attachment:
-                            # send mail content (summary)
-                            message = mail.summary
-
-                            # upload images
-                            image_no = 1
-                            for mail_image in mail.mail_images:
-                                # image = mail.mail_images.[image_id]
-                                image = mail_image['image']
-                                title = '%s' % image.get_title()
-
-                                if self.config.tg_forward_embedded_images:
-                                    title = '%i. %s: %s' % (image_no, mail.mail_subject, image.get_title())
-                                    doc_message: Message = await self.bot.send_photo(
-                                        chat_id=self.config.tg_forward_to_chat_id,
-                                        parse_mode=parser,
-                                        caption=title,
-                                        photo=image.file,
-                                    )
-                                    photo_size: list[PhotoSize] = doc_message.photo
-                                    image.tg_id = photo_size[0].file_id
-
-                                message = message.replace(
-                                    '${file:%s}' % image.id,
-                                    '🖼 %s' % title
-                                )
-                                image_no += 1
-
-                            # write image links
-                            for img_link in re.finditer(r'(\${img-link:(?P<src>[^|]*)\|(?P<alt>[^}]*)})', message,
-                                                        flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE)):
-                                src = img_link.group('src')
-                                alt = img_link.group('alt')
-                                message = message.replace(
-                                    img_link.groups()[0],
-                                    '<a href="%s">🖼 %s</a>' % (src, alt)
-                                )
-
-                            tg_message: Message = await self.bot.send_message(chat_id=self.config.tg_forward_to_chat_id,
-                                                                              parse_mode=parser,
-                                                                              text=message,
-                                                                              disable_web_page_preview=False)
-
-                            logging.info("Mail summary for '%s' (UID: '%s') was sent"
-                                         " with message ID '%i' to '%s' (ID: '%i')"
-                                         % (mail.mail_subject, mail.uid, tg_message.message_id,
-                                            tg_chat_title, self.config.tg_forward_to_chat_id))
-
-                        if self.config.tg_forward_attachment and len(mail.attachments) > 0:
-                            for attachment in mail.attachments:
-                                subject = mail.mail_subject
-                                if mail.type == MailDataType.HTML:
-                                    file_name = attachment.name
-                                    caption = '<b>' + subject + '</b>:\n' + file_name
-                                else:
-                                    file_name = helpers.escape_markdown(
-                                        text=attachment.name, version=self.config.tg_markdown_version)
-                                    caption = '*' + subject + '*:\n' + file_name
-
-                                tg_message = await self.bot.send_document(chat_id=self.config.tg_forward_to_chat_id,
-                                                                          parse_mode=parser,
-                                                                          caption=caption,
-                                                                          document=attachment.file,
-                                                                          filename=attachment.name,
-                                                                          disable_content_type_detection=False)
-
-                                logging.info("Attachment '%s' was sent with ID '%i' to '%s' (ID: '%s')"
-                                             % (attachment.name, tg_message.message_id,
-                                                tg_chat_title, str(self.config.tg_forward_to_chat_id)))
-
-                    except error.TelegramError as tg_mail_error:
-                        msg = "❌ Failed to send Telegram message (UID: %s) to '%s': %s" \
-                              % (mail.uid, str(self.config.tg_forward_to_chat_id), tg_mail_error.message)
-                        logging.critical(msg)
-                        try:
-                            # try to send error via telegram, and ignore further errors
-                            await self.bot.send_message(chat_id=self.config.tg_forward_to_chat_id,
-                                                        parse_mode=ParseMode.MARKDOWN_V2,
-                                                        text=helpers.escape_markdown(msg, version=2),
-                                                        disable_web_page_preview=False)
-                        finally:
-                            logging.critical("Failed to send error message {0}".format(tg_mail_error.message))
-
-                    except Exception as send_mail_error:
-                        error_msgs = [self.config.tool.binary_to_string(arg) for arg in send_mail_error.args]
-                        msg = "Failed to send Telegram message (UID: %s) to '%s': %s" \
-                              % (mail.uid, str(self.config.tg_forward_to_chat_id), ', '.join(error_msgs))
-                        logging.critical(msg)
-                        try:
-                            # try to send error via telegram, and ignore further errors
-                            await self.bot.send_message(chat_id=self.config.tg_forward_to_chat_id,
-                                                        parse_mode=ParseMode.MARKDOWN_V2,
-                                                        text=helpers.escape_markdown(msg, version=2),
-                                                        disable_web_page_preview=False)
-                        finally:
-                            logging.critical("Failed to send error message {0}".format("".join(error_msgs)))
+                        re.compile(pattern)
+                    except re.error as pattern_error:
+                        logging.critical("Error parsing config file: Invalid pattern '%s' of '%s'.'%s': %s."
+                                         % (pattern, section, field, pattern_error))
+                        sys.exit(2)
+                    route.conditions[field] = pattern
+
+            route.action = config_parser.get(section, 'action', fallback=Route.ACTION_FORWARD).lower()
+            route.next = config_parser.getboolean(section, 'continue', fallback=False)
+            message_format = config_parser.get(section, 'format', fallback=RouteTarget.FORMAT_FULL).lower()
+            if route.action not in (Route.ACTION_FORWARD, Route.ACTION_DROP) \
+                    or message_format not in (RouteTarget.FORMAT_FULL, RouteTarget.FORMAT_SUMMARY):
+                logging.critical("Error parsing config file: Invalid action or format of '%s'." % section)
+                sys.exit(2)
 
-        except error.TelegramError as tg_error:
-            logging.critical(self.error_send_message % tg_error.message)
-            return False
+            # targets: list of '<chat ID>' or '<chat ID>/<topic ID>', default: 'forward_to_chat_id'
+            chat_ids = config_parser.get(section, 'chat_id', fallback=str(config.tg_forward_to_chat_id))
+            try:
+                for target in re.split(r'[\s,]+', chat_ids.strip()):
+                    chat_id, _, thread_id = target.partition('/')
+                    route.targets.append(RouteTarget(int(chat_id), int(thread_id) if thread_id else None,
+                                                     message_format))
+            except ValueError:
+                logging.critical("Error parsing config file: Invalid chat ID '%s' of '%s'." % (chat_ids, section))
+                sys.exit(2)
 
-        except Exception as send_error:
-            error_msgs = [self.config.tool.binary_to_string(arg) for arg in send_error.args]
-            logging.critical(self.error_send_message % ', '.join(error_msgs))
-            return False
+            self.routes.append(route)
 
-        return True
+        self.compile()
+        if self.routes:
+            logging.info("Loaded %i routing rules of '%s'." % (len(self.routes), config.name))
 
+    def compile(self):
+        for idx, route in enumerate(self.routes):
+            if not route.conditions:
+                self.unconditional.append(idx)
+            for field, pattern in route.conditions.items():
+                self.indexes.setdefault(field, PatternIndex()).add(idx, pattern)
 
-class Mail:
-    mailbox: typing.Optional[imaplib2.IMAP4_SSL] = None
-    config: Config
-    last_uid: str = ''
+    def route(self, mail: MailData) -> list[RouteTarget] | None:
+        """
+        Get targets of mail: 'None' if no rule matches (use default chat), empty list if mail is dropped.
+        """
+        if not self.routes:
+            return None
 
-    previous_error = None
+        # count matching conditions of rules
+        hits: dict[int, int] = {}
+        for field, index in self.indexes.items():
+            for idx in index.match(mail.headers.get(field, '')):
+                hits[idx] = hits.get(idx, 0) + 1
 
-    class MailError(Exception):
-        def __init__(self, message, errors=None):
-            super().__init__(message)
-            self.errors = errors
+        targets = None
+        for idx in sorted(set(hits).union(self.unconditional)):
+            route = self.routes[idx]
+            if hits.get(idx, 0) < len(route.conditions):
+                continue
+            logging.debug("Mail (UID: '%s') matches routing rule '%s'." % (mail.uid, route.name))
+            if route.action == Route.ACTION_DROP:
+                return targets if targets is not None else []
+            targets = (targets or []) + route.targets
+            if not route.next:
+                break
+        return targets
+
+    def apply(self, mails: list[MailData]):
+        for mail in mails:
+            mail.targets = self.route(mail)
 
-    def __init__(self, config):
+
+class TokenBucket:
+    """
+    Token bucket: allows 'rate' calls per second with bursts up to 'capacity' calls
+    """
+    rate: float
+    capacity: float
+    tokens: float
+    updated: float
+    lock: asyncio.Lock
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
         """
-        Login to remote IMAP server.
+        Block further calls for 'seconds' (ex.: flood wait requested by Telegram)
         """
-        self.config = config
-        try:
-            self.mailbox = imaplib2.IMAP4_SSL(host=config.imap_server,
-                                              port=config.imap_port,
-                                              timeout=config.imap_timeout)
-            rv, _ = self.mailbox.login(config.imap_user, config.imap_password)
-            if rv != 'OK':
-                msg = "Cannot login to mailbox: %s" % str(rv)
-                raise self.MailError(msg)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
 
-        except socket.gaierror as gai_error:
-            msg = "Connection error '%s:%i': %s" % (config.imap_server,
-                                                    config.imap_port,
-                                                    gai_error.strerror)
-            logging.debug(msg)
-            raise self.MailError(msg, gai_error)
 
-        except imaplib2.IMAP4_SSL.error as imap_ssl_error:
-            error_msgs = [self.config.tool.binary_to_string(arg) for arg in imap_ssl_error.args]
-            msg = "Login to '%s:%i' failed: %s" % (config.imap_server,
-                                                   config.imap_port,
-                                                   ', '.join(error_msgs))
-            logging.debug(msg)
-            raise self.MailError(msg, imap_ssl_error)
+class RateLimiter:
+    """
+    Limit Telegram API calls globally and per chat (see: https://core.telegram.org/bots/faq#broadcasting-to-users)
+    """
+    global_bucket: TokenBucket
+    chat_rate: float
+    chat_buckets: dict[typing.Any, TokenBucket]
 
-        except Exception as login_error:
-            msg = "Mail error during connection to '%s:%i' failed: %s" \
-                  % (config.imap_server, config.imap_port, ', '.join(map(str, login_error.args)))
-            logging.debug(msg)
-            raise self.MailError(msg, login_error)
+    def __init__(self, rate: float, chat_rate: float):
+        self.global_bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
 
-        rv, mailboxes = self.mailbox.list()
-        if rv != 'OK':
-            self.disconnect()
-            msg = "Can't get list of available mailboxes / folders: %s" % str(rv)
-            raise self.MailError(msg)
-        else:
-            logging.info("Mailboxes:")
-            logging.info(mailboxes)
+    async def acquire(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        await self.chat_buckets[chat_id].acquire()
+        await self.global_bucket.acquire()
 
-        rv, _ = self.mailbox.select(config.imap_folder)
-        if rv == 'OK':
-            logging.info("Processing mailbox...")
-        else:
-            msg = "ERROR: Unable to open mailbox: %s" % str(rv)
-            logging.debug(msg)
-            raise self.MailError(msg)
+    def pause(self, chat_id, seconds: float):
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        self.chat_buckets[chat_id].pause(seconds)
 
-    def is_connected(self):
-        if self.mailbox is not None:
-            try:
-                rv, _ = self.mailbox.noop()
-                if rv == 'OK':
-                    logging.debug("Connection is working...")
-                    return True
-            except Exception as connection_check_error:
-                msg = "Error during connection check [noop]: %s" \
-                      % (', '.join(map(str, connection_check_error.args)))
-                logging.error(msg)
-        return False
+
+class DeliveryEngine:
+    """
+    Deliver mails concurrently by a limited number of workers. If ordered, mails sent to the
+    same chat will be delivered one after another (in order of UIDs).
+    """
+    semaphore: asyncio.Semaphore
+    ordered: bool
+    chat_locks: dict[typing.Any, asyncio.Lock]
+
+    def __init__(self, workers: int, ordered: bool = True):
+        self.semaphore = asyncio.Semaphore(max(1, workers))
+        self.ordered = ordered
+        self.chat_locks = {}
+
+    async def _run(self, chat_id, job: typing.Callable[[], typing.Awaitable]):
+        if self.ordered:
+            if chat_id not in self.chat_locks:
+                self.chat_locks[chat_id] = asyncio.Lock()
+            # wait for previous mails of chat first (locks are acquired in FIFO order)
+            async with self.chat_locks[chat_id]:
+                async with self.semaphore:
+                    await job()
+        else:
+            async with self.semaphore:
+                await job()
+
+    async def deliver(self, jobs: list[tuple[typing.Any, typing.Callable[[], typing.Awaitable]]]):
+        """
+        Run delivery jobs (chat ID, job) and wait until all jobs are done
+        """
+        await asyncio.gather(*[self._run(chat_id, job) for chat_id, job in jobs])
+
+
+class TelegramClient:
+    """
+    Telegram bot, connection pool, rate limits and delivery workers,
+    shared by all mailboxes using the same bot token
+    """
+    config: Config
+    request: HTTPXRequest
+    bot: Bot
+    rate_limiter: RateLimiter
+    delivery: DeliveryEngine
+    initialized: bool = False
+    start_lock: asyncio.Lock
+    chat_titles: dict[typing.Any, str]
+    store: 'StateStore'
+    bot_id: str
+    error_send_message: str = "Failed to send Telegram message: %s"
+
+    def __init__(self, config: Config, store: 'StateStore | None' = None):
+        self.config = config
+        # cache of file IDs (state file, or in memory)
+        self.store = store if store is not None else StateStore()
+        # file IDs are valid for the bot which uploaded the file only
+        self.bot_id = str(config.tg_bot_token).split(':')[0]
+        self.rate_limiter = RateLimiter(config.tg_rate_limit, config.tg_chat_rate_limit)
+        self.delivery = DeliveryEngine(config.tg_delivery_workers, config.tg_ordered_delivery)
+        self.start_lock = asyncio.Lock()
+        self.chat_titles = {}
+        try:
+            # Initialize the Bot with HTTPXRequest with increased connection pool size and proper timeouts
+            self.request = HTTPXRequest(
+                connection_pool_size=config.tg_connection_pool_size,
+                pool_timeout=config.tg_connection_pool_timeout,
+                connect_timeout=config.tg_connection_connect_timeout,
+                read_timeout=config.tg_connection_read_timeout,
+                write_timeout=config.tg_connection_read_timeout
+            )
+            if config.tg_base_url:
+                # ex.: local Bot API server
+                self.bot = Bot(token=self.config.tg_bot_token, request=self.request, base_url=config.tg_base_url)
+            else:
+                self.bot = Bot(token=self.config.tg_bot_token, request=self.request)
+        except error.TelegramError as tg_error:
+            logging.critical(self.error_send_message % tg_error.message)
+
+    async def start(self):
+        """
+        Initialize bot and connection pool once, both will be reused for all messages
+        """
+        async with self.start_lock:
+            if not self.initialized:
+                await self.bot.initialize()
+                self.initialized = True
+                logging.debug("Bot initialized")
+
+    async def stop(self):
+        if self.initialized:
+            self.initialized = False
+            await self.bot.shutdown()
+
+    async def get_chat_title(self, chat_id) -> str:
+        """
+        Get (cached) title of chat
+        """
+        if chat_id not in self.chat_titles:
+            logging.debug("Connecting to Chat '{0}'...".format(chat_id))
+            tg_chat: ChatFullInfo = await self.bot.get_chat(chat_id)
+
+            # get chat title
+            tg_chat_title = tg_chat.full_name
+            if not tg_chat_title:
+                tg_chat_title = tg_chat.title
+            if not tg_chat_title:
+                tg_chat_title = tg_chat.id
+            self.chat_titles[chat_id] = tg_chat_title
+        return self.chat_titles[chat_id]
+
+    def get_file_id(self, kind: str, attachment: MailAttachment) -> str | None:
+        """
+        Get file ID of a file with the same content uploaded before
+        """
+        if self.config.tg_file_cache_size <= 0:
+            return None
+        return self.store.get_file_id(self.bot_id, kind, attachment.get_hash())
+
+    def set_file_id(self, kind: str, attachment: MailAttachment, file_id: str | None):
+        if self.config.tg_file_cache_size > 0:
+            self.store.set_file_id(self.bot_id, kind, attachment.get_hash(), file_id, self.config.tg_file_cache_size)
+
+    async def send(self, chat_id, method, **kwargs):
+        """
+        Call Telegram API method, after rate limit of chat allows next message
+        """
+        await self.rate_limiter.acquire(chat_id)
+        method_name = getattr(method, '__name__', str(method))
+        try:
+            with metrics.time('telegram_request_seconds', method=method_name):
+                return await method(chat_id=chat_id, **kwargs)
+        except error.RetryAfter as flood_error:
+            # no further messages to this chat, until flood wait is over
+            self.rate_limiter.pause(chat_id, self.get_retry_after(flood_error))
+            metrics.inc('telegram_retry_after_total', method=method_name)
+            metrics.inc('telegram_errors_total', method=method_name, error=flood_error.__class__.__name__)
+            raise
+        except Exception as request_error:
+            metrics.inc('telegram_errors_total', method=method_name, error=request_error.__class__.__name__)
+            raise
+
+    @staticmethod
+    def get_retry_after(flood_error: error.RetryAfter) -> float:
+        with warnings.catch_warnings():
+            # type changes from int to timedelta in future versions, both are supported
+            warnings.simplefilter('ignore')
+            retry_after = flood_error.retry_after
+        if isinstance(retry_after, datetime.timedelta):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+
+class TelegramBot:
+    config: Config
+    client: TelegramClient
+    renderer: MailRenderer
+    error_send_message: str = "Failed to send Telegram message: %s"
+    # max. number of photos/documents of an album (media group)
+    MEDIA_GROUP_SIZE = 10
+
+    def __init__(self, config: Config, client: TelegramClient | None = None):
+        self.config = config
+        self.client = client if client is not None else TelegramClient(config)
+        self.renderer = MailRenderer(config)
+
+    @property
+    def bot(self) -> Bot:
+        return self.client.bot
+
+    async def _send(self, chat_id, method, **kwargs):
+        return await self.client.send(chat_id, method, **kwargs)
+
+    async def stop(self):
+        await self.client.stop()
+
+    async def send_text(self, chat_id, parser: str, text: str, **kwargs) -> Message:
+        """
+        Send text message, long messages are split and sent as chain of replies. Returns first message.
+        """
+        first_message: Message | None = None
+        previous_message: Message | None = None
+        for chunk in MessageSplitter(parser).split(text):
+            reply = {} if previous_message is None else {'reply_to_message_id': previous_message.message_id}
+            previous_message = await self._send(chat_id, self.bot.send_message,
+                                                parse_mode=parser,
+                                                text=chunk,
+                                                disable_web_page_preview=False,
+                                                **reply,
+                                                **kwargs)
+            if first_message is None:
+                first_message = previous_message
+        return first_message
+
+    async def send_media(self, chat_id, parser: str, items: list[tuple[MailAttachment, str]],
+                         photo: bool = False, **kwargs) -> list[Message]:
+        """
+        Send photos or documents (attachment, caption), grouped as albums of up to 10 items
+        (one API call per album). Files uploaded before are sent by their cached file ID.
+        Returns message of each item.
+        """
+        kind = 'photo' if photo else 'document'
+        messages: list[Message] = []
+        group_size = self.MEDIA_GROUP_SIZE if self.config.tg_media_groups else 1
+        for group_start in range(0, len(items), group_size):
+            group = items[group_start:group_start + group_size]
+            file_ids = [self.client.get_file_id(kind, attachment) for attachment, _ in group]
+            try:
+                group_messages = await self._send_media(chat_id, parser, group, file_ids, photo, **kwargs)
+            except error.BadRequest as file_id_error:
+                if not any(file_ids):
+                    raise file_id_error
+                # cached file ID is not valid anymore, upload files again
+                logging.warning("Cached file ID was rejected (%s), uploading files again." % file_id_error.message)
+                for (attachment, _), file_id in zip(group, file_ids):
+                    if file_id:
+                        self.client.set_file_id(kind, attachment, None)
+                file_ids = [None] * len(group)
+                group_messages = await self._send_media(chat_id, parser, group, file_ids, photo, **kwargs)
+
+            for (attachment, _), file_id, tg_message in zip(group, file_ids, group_messages):
+                if file_id is None:
+                    if photo:
+                        # largest size of photo
+                        new_file_id = tg_message.photo[-1].file_id if tg_message.photo else None
+                    else:
+                        new_file_id = tg_message.document.file_id if tg_message.document else None
+                    self.client.set_file_id(kind, attachment, new_file_id)
+            messages += group_messages
+        return messages
+
+    async def _send_media(self, chat_id, parser: str, group: list[tuple[MailAttachment, str]],
+                          file_ids: list[str | None], photo: bool, **kwargs) -> list[Message]:
+        if len(group) > 1:
+            if photo:
+                media = [InputMediaPhoto(media=file_id or attachment.get_file(attach=True),
+                                         caption=caption, parse_mode=parser)
+                         for (attachment, caption), file_id in zip(group, file_ids)]
+            else:
+                media = [InputMediaDocument(media=file_id or attachment.get_file(attach=True), caption=caption,
+                                            parse_mode=parser, filename=attachment.name,
+                                            disable_content_type_detection=False)
+                         for (attachment, caption), file_id in zip(group, file_ids)]
+            return list(await self._send(chat_id, self.bot.send_media_group, media=media, **kwargs))
+
+        (attachment, caption), file_id = group[0], file_ids[0]
+        if photo:
+            return [await self._send(chat_id, self.bot.send_photo,
+                                     parse_mode=parser,
+                                     caption=caption,
+                                     photo=file_id or attachment.get_file(),
+                                     **kwargs)]
+        return [await self._send(chat_id, self.bot.send_document,
+                                 parse_mode=parser,
+                                 caption=caption,
+                                 document=file_id or attachment.get_file(),
+                                 filename=attachment.name,
+                                 disable_content_type_detection=False,
+                                 **kwargs)]
+
+    async def send_mail(self, mail: MailData, target: RouteTarget, tg_chat_title) -> bool:
+        """
+        Send single mail (images, summary and attachments) in order to chat/user (or topic of chat).
+        """
+        chat_id = target.chat_id
+        kwargs = {} if target.thread_id is None else {'message_thread_id': target.thread_id}
+        full_format = target.message_format == RouteTarget.FORMAT_FULL
+        try:
+            if self.config.tg_markdown_version == 2:
+                parser = ParseMode.MARKDOWN_V2
+            else:
+                parser = ParseMode.MARKDOWN
+            if mail.type == MailDataType.HTML:
+                parser = ParseMode.HTML
+
+            if not full_format:
+                # send From, Subject and list of attachments only
+                with profiler.span('telegram_text', mail, chat_id=chat_id):
+                    tg_message: Message = await self.send_text(chat_id, parser, mail.header_summary, **kwargs)
+
+                logging.info("Mail summary (headers) for '%s' (UID: '%s') was sent"
+                             " with message ID '%i' to '%s' (ID: '%s')"
+                             % (mail.mail_subject, mail.uid, tg_message.message_id,
+                                tg_chat_title, target))
+
+            elif self.config.tg_forward_mail_content or not self.config.tg_forward_attachment:
+                # send mail content (summary)
+                message = mail.summary
+
+                # upload images
+                images: list[tuple[MailAttachment, str]] = []
+                image_no = 1
+                for mail_image in mail.mail_images:
+                    # image = mail.mail_images.[image_id]
+                    image = mail_image['image']
+                    title = '%s' % image.get_title()
+
+                    if self.config.tg_forward_embedded_images:
+                        title = '%i. %s: %s' % (image_no, mail.mail_subject, image.get_title())
+                        images.append((image, title))
+
+                    message = message.replace(
+                        '${file:%s}' % image.id,
+                        '🖼 %s' % title
+                    )
+                    image_no += 1
+
+                with profiler.span('telegram_images', mail, chat_id=chat_id):
+                    image_messages = await self.send_media(chat_id, parser, images, photo=True, **kwargs)
+                for (image, title), doc_message in zip(images, image_messages):
+                    photo_size: list[PhotoSize] = doc_message.photo
+                    image.tg_id = photo_size[0].file_id
+
+                # write image links
+                message = self.renderer.render_image_links(message)
+
+                with profiler.span('telegram_text', mail, chat_id=chat_id):
+                    tg_message: Message = await self.send_text(chat_id, parser, message, **kwargs)
+
+                logging.info("Mail summary for '%s' (UID: '%s') was sent"
+                             " with message ID '%i' to '%s' (ID: '%s')"
+                             % (mail.mail_subject, mail.uid, tg_message.message_id,
+                                tg_chat_title, target))
+
+            if full_format and self.config.tg_forward_attachment and len(mail.attachments) > 0:
+                documents: list[tuple[MailAttachment, str]] = []
+                for attachment in mail.attachments:
+                    subject = mail.mail_subject
+                    if mail.type == MailDataType.HTML:
+                        file_name = attachment.name
+                        caption = '<b>' + subject + '</b>:\n' + file_name
+                    else:
+                        file_name = self.renderer.escape(attachment.name)
+                        caption = '*' + subject + '*:\n' + file_name
+                    documents.append((attachment, caption))
+
+                with profiler.span('telegram_attachments', mail, chat_id=chat_id):
+                    document_messages = await self.send_media(chat_id, parser, documents, **kwargs)
+                for (attachment, caption), tg_message in zip(documents, document_messages):
+                    logging.info("Attachment '%s' was sent with ID '%i' to '%s' (ID: '%s')"
+                                 % (attachment.name, tg_message.message_id,
+                                    tg_chat_title, target))
+
+            return True
+
+        except error.RetryAfter as flood_error:
+            # flood control: mail will be sent again after flood wait, error message would be rejected too
+            mail.retry_after = max(mail.retry_after, self.client.get_retry_after(flood_error))
+            mail.error = flood_error.message
+            logging.warning("Failed to send Telegram message (UID: %s) to '%s': %s"
+                            % (mail.uid, str(chat_id), flood_error.message))
+
+        except error.TelegramError as tg_mail_error:
+            # mail will be sent again, error is sent to chat if mail is moved to dead letters
+            mail.error = tg_mail_error.message
+            logging.critical("Failed to send Telegram message (UID: %s) to '%s': %s"
+                             % (mail.uid, str(chat_id), tg_mail_error.message))
+
+        except Exception as send_mail_error:
+            error_msgs = [self.config.tool.binary_to_string(arg) for arg in send_mail_error.args]
+            mail.error = ', '.join(error_msgs)
+            logging.critical("Failed to send Telegram message (UID: %s) to '%s': %s"
+                             % (mail.uid, str(chat_id), mail.error))
+
+        return False
+
+    async def send_error(self, chat_id, msg: str, **kwargs):
+        """
+        Try to send error via telegram, and ignore further errors
+        """
+        try:
+            await self._send(chat_id, self.bot.send_message,
+                             parse_mode=ParseMode.MARKDOWN_V2,
+                             text=MailRenderer.escape_markdown(msg, version=2),
+                             disable_web_page_preview=False,
+                             **kwargs)
+        except Exception as error_message_error:
+            logging.critical("Failed to send error message: %s" % ', '.join(map(str, error_message_error.args)))
+
+    async def send_dead_letter(self, mail: MailData):
+        """
+        Send error to chats, the mail failed to be sent to before it was moved to dead letters
+        """
+        for target in mail.failed_targets:
+            kwargs = {} if target.thread_id is None else {'message_thread_id': target.thread_id}
+            await self.send_error(target.chat_id,
+                                  "❌ Failed to send Telegram message (UID: %s) to '%s', moved to dead letters: %s"
+                                  % (mail.uid, str(target.chat_id), mail.error or 'Unknown error'), **kwargs)
+
+    async def deliver_mail(self, mail: MailData, target: RouteTarget, failed: list[RouteTarget]):
+        with profiler.span('telegram_chat', mail, chat_id=target.chat_id):
+            tg_chat_title = await self.client.get_chat_title(target.chat_id)
+        if not await self.send_mail(mail, target, tg_chat_title):
+            failed.append(target)
+
+    async def deliver(self, mail: MailData) -> bool:
+        """
+        Send mail to all of its targets, buffers of mail are released afterwards.
+        """
+        try:
+            await self.client.start()
+
+            # mails without matching routing rule are sent to default chat
+            targets = [RouteTarget(self.config.tg_forward_to_chat_id)] if mail.targets is None else mail.targets
+            if not targets:
+                logging.info("Mail '%s' (UID: '%s') was dropped by routing rules." % (mail.mail_subject, mail.uid))
+
+            failed: list[RouteTarget] = []
+            with profiler.span('deliver', mail):
+                await self.client.delivery.deliver([(target.chat_id,
+                                                     functools.partial(self.deliver_mail, mail, target, failed))
+                                                    for target in targets])
+            # a mail is delivered, if sent to all of its targets
+            mail.failed_targets = failed
+            mail.delivered = len(failed) == 0
+
+        except error.TelegramError as tg_error:
+            logging.critical(self.error_send_message % tg_error.message)
+            mail.error = tg_error.message
+            if isinstance(tg_error, error.RetryAfter):
+                mail.retry_after = max(mail.retry_after, self.client.get_retry_after(tg_error))
+            mail.delivered = False
+
+        except Exception as send_error:
+            error_msgs = [self.config.tool.binary_to_string(arg) for arg in send_error.args]
+            logging.critical(self.error_send_message % ', '.join(error_msgs))
+            mail.error = ', '.join(error_msgs)
+            mail.delivered = False
+
+        finally:
+            mail.release()
+
+        return mail.delivered
+
+    async def send_message(self, mails: list[MailData]):
+        """
+        Send mail data over Telegram API to chat/user.
+        """
+        results = await asyncio.gather(*[self.deliver(mail) for mail in mails])
+        return all(results)
+
+
+class ImapResponse:
+    """
+    Parser for IMAP FETCH responses (parenthesized lists, quoted strings and literals)
+    """
+    token_pattern = re.compile(rb'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<quoted>(?:[^"\\]|\\.)*)"'
+                               rb'|\{(?P<literal>\d+)}\r\n|(?P<atom>[^\s()"{]+(?:\[[^\]]*])?(?:<\d+>)?))')
+
+    @staticmethod
+    def join(data: list) -> bytes:
+        """
+        Join response data of imaplib2, literals are returned as tuple (<prefix ending with '{size}'>, <literal>)
+        """
+        stream = b''
+        for item in data:
+            if isinstance(item, tuple):
+                stream += item[0] + b'\r\n' + item[1]
+            elif isinstance(item, bytes):
+                stream += b' ' + item
+        return stream
+
+    @classmethod
+    def parse(cls, stream: bytes) -> list:
+        """
+        Parse response into nested lists, NIL will be returned as None and strings as bytes
+        """
+        root: list = []
+        stack: list[list] = [root]
+        pos = 0
+        while pos < len(stream):
+            match = cls.token_pattern.match(stream, pos)
+            if match is None:
+                if stream[pos:].strip() == b'':
+                    break
+                raise ValueError("Unexpected IMAP response data at %i: %s" % (pos, stream[pos:pos + 20]))
+            pos = match.end()
+            if match.group('open'):
+                stack.append([])
+            elif match.group('close'):
+                if len(stack) > 1:
+                    item = stack.pop()
+                    stack[-1].append(item)
+            elif match.group('quoted') is not None:
+                stack[-1].append(re.sub(rb'\\(.)', rb'\1', match.group('quoted')))
+            elif match.group('literal') is not None:
+                size = int(match.group('literal'))
+                stack[-1].append(stream[pos:pos + size])
+                pos += size
+            else:
+                atom = match.group('atom')
+                stack[-1].append(None if atom.upper() == b'NIL' else atom)
+        return root
+
+    @classmethod
+    def parse_fetch(cls, data: list) -> dict[str, dict[str, typing.Any]]:
+        """
+        Parse FETCH response and return items of each message (ex.: {'<UID>': {'BODYSTRUCTURE': [...]}})
+        """
+        messages: dict[str, dict[str, typing.Any]] = {}
+        for item in cls.parse(cls.join(data)):
+            if not isinstance(item, list):
+                # message sequence number
+                continue
+            values: dict[str, typing.Any] = {}
+            for idx in range(0, len(item) - 1, 2):
+                key = Tool.binary_to_string(item[idx]).upper()
+                # response to 'BODY.PEEK[<section>]' is 'BODY[<section>]'
+                values[re.sub(r'^BODY(\.PEEK)?\[(?P<section>[^]]*)](<\d+>)?$', r'\g<section>', key)] = item[idx + 1]
+            if 'UID' in values:
+                messages[Tool.binary_to_string(values['UID'])] = values
+        return messages
+
+
+class MailPart:
+    """
+    MIME part of mail, based on IMAP BODYSTRUCTURE
+    """
+    section: str = ''
+    content_type: str = 'text/plain'
+    params: dict[str, str]
+    disposition: str | None = None
+    parts: list['MailPart']
+
+    def __init__(self, structure: list, section: str = ''):
+        self.params = {}
+        self.parts = []
+        self.section = section
+
+        if structure and isinstance(structure[0], list):
+            # multipart: (<part 1>)(<part 2>)... "<subtype>" [<params> <disposition>...]
+            idx = 0
+            while idx < len(structure) and isinstance(structure[idx], list):
+                child_section = '%s.%i' % (section, idx + 1) if section else str(idx + 1)
+                self.parts.append(MailPart(structure[idx], child_section))
+                idx += 1
+            subtype = Tool.binary_to_string(structure[idx]) if idx < len(structure) else 'mixed'
+            self.content_type = 'multipart/' + subtype.lower()
+            self.params = self._params(structure[idx + 1] if idx + 1 < len(structure) else None)
+            self.disposition = self._disposition(structure[idx + 2] if idx + 2 < len(structure) else None)
+        else:
+            # single part: "<type>" "<subtype>" <params> <id> <description> <encoding> <size> ...
+            self.content_type = ('%s/%s' % (Tool.binary_to_string(structure[0]),
+                                            Tool.binary_to_string(structure[1]))).lower()
+            self.params = self._params(structure[2])
+            # extension data is placed behind type specific fields (text: lines, message: envelope, body, lines)
+            if self.content_type == 'message/rfc822':
+                disposition_idx = 11
+            elif self.content_type.startswith('text/'):
+                disposition_idx = 9
+            else:
+                disposition_idx = 8
+            self.disposition = self._disposition(
+                structure[disposition_idx] if disposition_idx < len(structure) else None)
+
+    @staticmethod
+    def _params(params) -> dict[str, str]:
+        result: dict[str, str] = {}
+        if isinstance(params, list):
+            for idx in range(0, len(params) - 1, 2):
+                result[Tool.binary_to_string(params[idx]).lower()] = Tool.binary_to_string(params[idx + 1])
+        return result
+
+    @staticmethod
+    def _disposition(disposition) -> str | None:
+        if isinstance(disposition, list) and disposition and disposition[0] is not None:
+            return Tool.binary_to_string(disposition[0]).lower()
+        return None
+
+    def is_multipart(self) -> bool:
+        return self.content_type.startswith('multipart/')
+
+    def get_content_charset(self) -> str | None:
+        return self.params.get('charset')
+
+    def header_section(self) -> str:
+        return '%s.MIME' % self.section if self.section else 'HEADER'
+
+    def body_section(self) -> str:
+        return self.section if self.section else 'TEXT'
+
+    def fetch_sections(self, is_required: typing.Callable[['MailPart'], bool]) -> list[str]:
+        """
+        Get sections needed to rebuild mail: headers of all parts and body of required parts only
+        """
+        sections: list[str] = [self.header_section()]
+        if self.is_multipart():
+            for part in self.parts:
+                sections += part.fetch_sections(is_required)
+        elif is_required(self):
+            sections.append(self.body_section())
+        return sections
+
+    def build(self, sections: dict[str, typing.Any]) -> bytes:
+        """
+        Rebuild mail (or MIME part) based on fetched sections, skipped bodies will be empty
+        """
+        data: bytes = sections.get(self.header_section()) or b''
+        if self.is_multipart():
+            boundary = self.params.get('boundary', '').encode()
+            for part in self.parts:
+                data += b'--' + boundary + b'\r\n' + part.build(sections) + b'\r\n'
+            data += b'--' + boundary + b'--\r\n'
+        else:
+            data += sections.get(self.body_section()) or b''
+        return data
+
+
+class StateStore:
+    """
+    Persistent state (SQLite) to resume processing after restart: last forwarded UID,
+    UIDVALIDITY and HIGHESTMODSEQ (CONDSTORE) of folder and delivery status of each mail.
+    Telegram file IDs of uploaded files are cached by hash of their content. Failed deliveries
+    are kept in an outbox to be retried, and moved to dead letters after too many attempts.
+    """
+    STATUS_FETCHED = 'fetched'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_RETRY = 'retry'
+    STATUS_FAILED = 'failed'
+
+    connection: sqlite3.Connection
+    lock: threading.Lock
+
+    def __init__(self, file_name: str | None = None):
+        """
+        Open state file, in memory database is used if no file name is provided.
+        """
+        self.lock = threading.Lock()
+        # connection is shared by IMAP threads, access is serialized by lock
+        self.connection = sqlite3.connect(file_name if file_name else ':memory:', check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS checkpoint ('
+                                    'account TEXT, folder TEXT, uid_validity TEXT, last_uid TEXT, updated REAL, '
+                                    'PRIMARY KEY (account, folder))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS sync ('
+                                    'account TEXT, folder TEXT, uid_validity TEXT, modseq TEXT, updated REAL, '
+                                    'PRIMARY KEY (account, folder))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS delivery ('
+                                    'account TEXT, folder TEXT, uid INTEGER, status TEXT, updated REAL, '
+                                    'PRIMARY KEY (account, folder, uid))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS file_cache ('
+                                    'bot TEXT, kind TEXT, hash TEXT, file_id TEXT, used REAL, '
+                                    'PRIMARY KEY (bot, kind, hash))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS file_cache_used ON file_cache (used)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                                    'account TEXT, folder TEXT, uid INTEGER, attempts INTEGER, next_try REAL, '
+                                    'last_error TEXT, updated REAL, targets TEXT, PRIMARY KEY (account, folder, uid))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS outbox_next_try ON outbox (next_try)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS dead_letter ('
+                                    'account TEXT, folder TEXT, uid INTEGER, attempts INTEGER, '
+                                    'last_error TEXT, updated REAL, targets TEXT, PRIMARY KEY (account, folder, uid))')
+            for table in ('outbox', 'dead_letter'):
+                # state file of previous version: failed targets weren't stored (mail is sent to all targets)
+                if 'targets' not in [row[1] for row in self.connection.execute('PRAGMA table_info(%s)' % table)]:
+                    self.connection.execute('ALTER TABLE %s ADD COLUMN targets TEXT' % table)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_checkpoint(self, account: str, folder: str) -> tuple[str, str] | None:
+        """
+        Get (UIDVALIDITY, last UID) of folder
+        """
+        with self.lock:
+            return self.connection.execute('SELECT uid_validity, last_uid FROM checkpoint '
+                                           'WHERE account = ? AND folder = ?', (account, folder)).fetchone()
+
+    def set_checkpoint(self, account: str, folder: str, uid_validity: str, last_uid: str):
+        """
+        Store last UID of folder, delivery status of older mails is not needed anymore
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?)',
+                                    (account, folder, uid_validity, last_uid, time.time()))
+            if last_uid:
+                self.connection.execute('DELETE FROM delivery WHERE account = ? AND folder = ? '
+                                        'AND uid < ? AND status != ?',
+                                        (account, folder, int(last_uid), self.STATUS_FETCHED))
+
+    def get_sync_state(self, account: str, folder: str) -> tuple[str, str] | None:
+        """
+        Get (UIDVALIDITY, HIGHESTMODSEQ) of folder at last complete search
+        """
+        with self.lock:
+            return self.connection.execute('SELECT uid_validity, modseq FROM sync '
+                                           'WHERE account = ? AND folder = ?', (account, folder)).fetchone()
+
+    def set_sync_state(self, account: str, folder: str, uid_validity: str, modseq: str):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO sync VALUES (?, ?, ?, ?, ?)',
+                                    (account, folder, uid_validity, modseq, time.time()))
+
+    def reset(self, account: str, folder: str):
+        """
+        Remove state of folder (ex.: UIDVALIDITY changed, all UIDs are invalid)
+        """
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM checkpoint WHERE account = ? AND folder = ?', (account, folder))
+            self.connection.execute('DELETE FROM sync WHERE account = ? AND folder = ?', (account, folder))
+            self.connection.execute('DELETE FROM delivery WHERE account = ? AND folder = ?', (account, folder))
+            self.connection.execute('DELETE FROM outbox WHERE account = ? AND folder = ?', (account, folder))
+            self.connection.execute('DELETE FROM dead_letter WHERE account = ? AND folder = ?', (account, folder))
+
+    def set_status(self, account: str, folder: str, uids: list[str], status: str):
+        with self.lock, self.connection:
+            now = time.time()
+            self.connection.executemany('INSERT OR REPLACE INTO delivery VALUES (?, ?, ?, ?, ?)',
+                                        [(account, folder, int(uid), status, now) for uid in uids])
+
+    def get_uids(self, account: str, folder: str, status: str) -> list[str]:
+        with self.lock:
+            rows = self.connection.execute('SELECT uid FROM delivery WHERE account = ? AND folder = ? '
+                                           'AND status = ? ORDER BY uid', (account, folder, status)).fetchall()
+        return [str(row[0]) for row in rows]
+
+    def get_attempts(self, account: str, folder: str, uid: str) -> int:
+        """
+        Get number of failed deliveries of mail in outbox
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT attempts FROM outbox WHERE account = ? AND folder = ? AND uid = ?',
+                                          (account, folder, int(uid))).fetchone()
+        return row[0] if row is not None else 0
+
+    def set_retry(self, account: str, folder: str, uid: str, attempts: int, next_try: float, last_error: str,
+                  targets: str | None = None):
+        """
+        Add mail to outbox, 'targets' (JSON) the mail failed to be sent to are kept if not provided
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO outbox VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, '
+                                    '(SELECT targets FROM outbox WHERE account = ? AND folder = ? AND uid = ?)))',
+                                    (account, folder, int(uid), attempts, next_try, last_error, time.time(),
+                                     targets, account, folder, int(uid)))
+
+    def get_retry_targets(self, account: str, folder: str, uids: list[str]) -> dict[str, str]:
+        """
+        Get targets (JSON) of mails in outbox, mails without targets are sent to all of their targets
+        """
+        with self.lock:
+            rows = [self.connection.execute('SELECT uid, targets FROM outbox WHERE account = ? AND folder = ? '
+                                            'AND uid = ? AND targets IS NOT NULL',
+                                            (account, folder, int(uid))).fetchone() for uid in uids]
+        return {str(row[0]): row[1] for row in rows if row is not None}
+
+    def get_due_retries(self, account: str, folder: str, limit: int) -> list[str]:
+        """
+        Get UIDs of mails in outbox, which have to be delivered again now
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT uid FROM outbox WHERE account = ? AND folder = ? '
+                                           'AND next_try <= ? ORDER BY uid LIMIT ?',
+                                           (account, folder, time.time(), limit)).fetchall()
+        return [str(row[0]) for row in rows]
+
+    def get_retry_uids(self, account: str, folder: str) -> set[str]:
+        """
+        Get UIDs of mails in outbox or dead letters, these are not delivered with new mails
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT uid FROM outbox WHERE account = ? AND folder = ? UNION '
+                                           'SELECT uid FROM dead_letter WHERE account = ? AND folder = ?',
+                                           (account, folder, account, folder)).fetchall()
+        return {str(row[0]) for row in rows}
+
+    def remove_retries(self, account: str, folder: str, uids: list[str]):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM outbox WHERE account = ? AND folder = ? AND uid = ?',
+                                        [(account, folder, int(uid)) for uid in uids])
+
+    def set_dead_letter(self, account: str, folder: str, uid: str, attempts: int, last_error: str,
+                        targets: str | None = None):
+        """
+        Move mail from outbox to dead letters, it won't be delivered again until replayed
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO dead_letter VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, '
+                                    '(SELECT targets FROM outbox WHERE account = ? AND folder = ? AND uid = ?)))',
+                                    (account, folder, int(uid), attempts, last_error, time.time(),
+                                     targets, account, folder, int(uid)))
+            self.connection.execute('DELETE FROM outbox WHERE account = ? AND folder = ? AND uid = ?',
+                                    (account, folder, int(uid)))
+
+    def get_dead_letters(self) -> list[tuple[str, str, int, int, str, float]]:
+        """
+        Get dead letters of all accounts: (account, folder, UID, attempts, last error, time of last attempt)
+        """
+        with self.lock:
+            return self.connection.execute('SELECT account, folder, uid, attempts, last_error, updated '
+                                           'FROM dead_letter ORDER BY account, folder, uid').fetchall()
+
+    def replay_dead_letters(self) -> int:
+        """
+        Move all dead letters back to outbox, to deliver them again as soon as possible
+        """
+        with self.lock, self.connection:
+            now = time.time()
+            count = self.connection.execute('INSERT OR REPLACE INTO outbox '
+                                            'SELECT account, folder, uid, 0, ?, last_error, ?, targets '
+                                            'FROM dead_letter',
+                                            (now, now)).rowcount
+            self.connection.execute('DELETE FROM dead_letter')
+        return count
+
+    def get_file_id(self, bot: str, kind: str, content_hash: str) -> str | None:
+        """
+        Get Telegram file ID of file uploaded before (and mark it as recently used)
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT file_id FROM file_cache WHERE bot = ? AND kind = ? AND hash = ?',
+                                          (bot, kind, content_hash)).fetchone()
+            if row is not None:
+                self.connection.execute('UPDATE file_cache SET used = ? WHERE bot = ? AND kind = ? AND hash = ?',
+                                        (time.time(), bot, kind, content_hash))
+        return row[0] if row is not None else None
+
+    def set_file_id(self, bot: str, kind: str, content_hash: str, file_id: str | None, max_size: int):
+        """
+        Store (or remove, if file ID is None) Telegram file ID of uploaded file,
+        least recently used entries are removed to keep 'max_size' entries.
+        """
+        with self.lock, self.connection:
+            if file_id is None:
+                self.connection.execute('DELETE FROM file_cache WHERE bot = ? AND kind = ? AND hash = ?',
+                                        (bot, kind, content_hash))
+                return
+            self.connection.execute('INSERT OR REPLACE INTO file_cache VALUES (?, ?, ?, ?, ?)',
+                                    (bot, kind, content_hash, file_id, time.time()))
+            self.connection.execute('DELETE FROM file_cache WHERE rowid IN ('
+                                    'SELECT rowid FROM file_cache ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                    (max_size,))
+
+
+class Mail:
+    mailbox: typing.Optional[imaplib2.IMAP4_SSL] = None
+    config: Config
+    html_cleaner: HtmlCleaner
+    renderer: MailRenderer
+    store: StateStore
+    account: str = ''
+    uid_validity: str = ''
+    last_uid: str = ''
+    max_uid: str = ''
+    newest_uid: str = ''
+    # mails fetched before restart, but not delivered
+    pending_uids: list[str]
+    idle_unsupported_logged: bool = False
+    # start (perf_counter) and duration (seconds) of last fetch
+    fetch_started: float = 0
+    fetch_time: float = 0
+    # CONDSTORE/QRESYNC enabled for connection, HIGHESTMODSEQ of last complete search,
+    # of current search (stored when all mails found were fetched) and of SELECT response
+    condstore: bool = False
+    qresync: bool = False
+    modseq: str = ''
+    search_modseq: str = ''
+    selected_modseq: str = ''
+
+    previous_error = None
+    # characters of encoded payload decoded at once (spool mode)
+    DECODE_CHUNK_SIZE = 65536
+
+    class MailError(Exception):
+        def __init__(self, message, errors=None):
+            super().__init__(message)
+            self.errors = errors
+
+    def __init__(self, config, store: StateStore):
+        """
+        Login to remote IMAP server.
+        """
+        self.config = config
+        self.store = store
+        self.html_cleaner = HtmlCleaner(config)
+        self.renderer = MailRenderer(config)
+        self.account = config.get_account_id()
+        self.pending_uids = []
+        try:
+            # plain connection without SSL, ex.: local mail server or SSH tunnel
+            imap_class = imaplib2.IMAP4_SSL if config.imap_ssl else imaplib2.IMAP4
+            self.mailbox = imap_class(host=config.imap_server,
+                                      port=config.imap_port,
+                                      timeout=config.imap_timeout)
+            rv, _ = self.mailbox.login(config.imap_user, config.imap_password)
+            if rv != 'OK':
+                msg = "Cannot login to mailbox: %s" % str(rv)
+                raise self.MailError(msg)
+
+        except socket.gaierror as gai_error:
+            msg = "Connection error '%s:%i': %s" % (config.imap_server,
+                                                    config.imap_port,
+                                                    gai_error.strerror)
+            logging.debug(msg)
+            raise self.MailError(msg, gai_error)
+
+        except imaplib2.IMAP4_SSL.error as imap_ssl_error:
+            error_msgs = [self.config.tool.binary_to_string(arg) for arg in imap_ssl_error.args]
+            msg = "Login to '%s:%i' failed: %s" % (config.imap_server,
+                                                   config.imap_port,
+                                                   ', '.join(error_msgs))
+            logging.debug(msg)
+            raise self.MailError(msg, imap_ssl_error)
+
+        except Exception as login_error:
+            msg = "Mail error during connection to '%s:%i' failed: %s" \
+                  % (config.imap_server, config.imap_port, ', '.join(map(str, login_error.args)))
+            logging.debug(msg)
+            raise self.MailError(msg, login_error)
+
+        rv, mailboxes = self.mailbox.list()
+        if rv != 'OK':
+            self.disconnect()
+            msg = "Can't get list of available mailboxes / folders: %s" % str(rv)
+            raise self.MailError(msg)
+        else:
+            logging.info("Mailboxes:")
+            logging.info(mailboxes)
+
+        sync_state = None
+        folder = config.imap_folder
+        if config.imap_condstore:
+            self.enable_condstore()
+            sync_state = self.store.get_sync_state(self.account, config.imap_folder)
+            if self.qresync and sync_state is not None:
+                # server reports mails changed and vanished since last search (RFC 7162)
+                folder = '%s (QRESYNC (%s %s))' % (config.imap_folder, sync_state[0], sync_state[1])
+            elif self.condstore and not self.qresync:
+                folder = '%s (CONDSTORE)' % config.imap_folder
+
+        rv, _ = self.mailbox.select(folder)
+        if rv == 'OK':
+            logging.info("Processing mailbox...")
+        else:
+            msg = "ERROR: Unable to open mailbox: %s" % str(rv)
+            logging.debug(msg)
+            raise self.MailError(msg)
+
+        _, uid_validity = self.mailbox.response('UIDVALIDITY')
+        if uid_validity and uid_validity[0] is not None:
+            self.uid_validity = self.config.tool.binary_to_string(uid_validity[0])
+        if self.condstore:
+            self.init_sync(sync_state)
+
+    @classmethod
+    def create_parser(cls, config: Config) -> 'Mail':
+        """
+        Create instance without IMAP connection, to parse mails only (ex.: by worker process).
+        """
+        parser = cls.__new__(cls)
+        parser.config = config
+        parser.html_cleaner = HtmlCleaner(config)
+        parser.renderer = MailRenderer(config)
+        parser.account = config.get_account_id()
+        parser.pending_uids = []
+        return parser
+
+    def is_connected(self):
+        if self.mailbox is not None:
+            try:
+                rv, _ = self.mailbox.noop()
+                if rv == 'OK':
+                    logging.debug("Connection is working...")
+                    return True
+            except Exception as connection_check_error:
+                msg = "Error during connection check [noop]: %s" \
+                      % (', '.join(map(str, connection_check_error.args)))
+                logging.error(msg)
+        return False
+
+    def enable_condstore(self):
+        """
+        Enable QRESYNC (or use CONDSTORE), if supported by server (capabilities after login)
+        """
+        try:
+            rv, data = self.mailbox.capability()
+            if rv == 'OK' and data and data[-1] is not None:
+                self.mailbox.capabilities = tuple(self.config.tool.binary_to_string(data[-1]).upper().split())
+            capabilities = self.mailbox.capabilities
+            if 'QRESYNC' in capabilities and 'ENABLE' in capabilities:
+                # not by 'enable()', which keeps lock of state change (next command would wait forever)
+                rv, _ = self.mailbox.xatom('ENABLE', 'QRESYNC')
+                self.qresync = rv == 'OK'
+            self.condstore = self.qresync or 'CONDSTORE' in capabilities
+        except imaplib2.IMAP4_SSL.error as enable_error:
+            error_msgs = [self.config.tool.binary_to_string(arg) for arg in enable_error.args]
+            logging.warning("Cannot enable QRESYNC: %s" % ', '.join(error_msgs))
+            self.condstore = self.qresync = False
+        if not self.condstore:
+            logging.warning("IMAP server '%s' does not support CONDSTORE, searching on each poll."
+                            % self.config.imap_server)
+
+    def init_sync(self, sync_state: tuple[str, str] | None):
+        """
+        Get HIGHESTMODSEQ of selected folder and resume with HIGHESTMODSEQ of last search,
+        mails vanished since then (QRESYNC) are removed from outbox.
+        """
+        folder = self.config.imap_folder
+        _, highest_modseq = self.mailbox.response('HIGHESTMODSEQ')
+        # changes reported by QRESYNC, not part of responses of next commands
+        _, changed = self.mailbox.response('FETCH')
+        _, vanished = self.mailbox.response('VANISHED')
+        if not highest_modseq or highest_modseq[0] is None:
+            # NOMODSEQ: mod-sequences not stored for folder
+            logging.warning("Folder '%s' has no mod-sequences (CONDSTORE), searching on each poll." % folder)
+            self.condstore = False
+            return
+
+        self.selected_modseq = self.config.tool.binary_to_string(highest_modseq[0])
+        if sync_state is None or sync_state[0] != self.uid_validity or not sync_state[1]:
+            return
+        self.modseq = sync_state[1]
+        logging.info("Resuming with HIGHESTMODSEQ '%s' of folder '%s' (current: '%s', %i changed mail(s))"
+                     % (self.modseq, folder, self.selected_modseq, len([item for item in changed if item])))
+
+        vanished_uids = [self.config.tool.binary_to_string(item) for item in vanished if item]
+        if vanished_uids:
+            ranges = [uid_range for item in vanished_uids
+                      for uid_range in self.parse_uid_set(item.replace('(EARLIER)', '').strip())]
+            expunged = [uid for uid in self.store.get_retry_uids(self.account, folder)
+                        if any(first <= int(uid) <= last for first, last in ranges)]
+            if expunged:
+                self.store.remove_retries(self.account, folder, expunged)
+                logging.info("Removed %i vanished mail(s) from outbox of folder '%s'" % (len(expunged), folder))
+
+    def get_highest_modseq(self) -> str:
+        """
+        Get HIGHESTMODSEQ of folder, by SELECT response on first search and by STATUS command later on
+        """
+        if self.selected_modseq:
+            modseq, self.selected_modseq = self.selected_modseq, ''
+            return modseq
+        try:
+            rv, data = self.mailbox.status(self.config.imap_folder, '(HIGHESTMODSEQ)')
+        except imaplib2.IMAP4_SSL.error as status_error:
+            error_msgs = [self.config.tool.binary_to_string(arg) for arg in status_error.args]
+            logging.warning("Cannot get HIGHESTMODSEQ of folder '%s': %s"
+                            % (self.config.imap_folder, ', '.join(error_msgs)))
+            return ''
+        match = None
+        if rv == 'OK' and data and data[-1] is not None:
+            match = re.search(r'\bHIGHESTMODSEQ\s+(\d+)', self.config.tool.binary_to_string(data[-1]),
+                              flags=re.IGNORECASE)
+        return match.group(1) if match is not None else ''
+
+    def supports_idle(self) -> bool:
+        """
+        Check if IMAP IDLE (push) mode can be used for current connection.
+        """
+        if self.mailbox is None:
+            return False
+        if 'IDLE' in self.mailbox.capabilities:
+            return True
+        if not self.idle_unsupported_logged:
+            logging.warning("IMAP server '%s' does not support IDLE, using polling every %i seconds."
+                            % (self.config.imap_server, self.config.imap_refresh))
+            self.idle_unsupported_logged = True
+        return False
+
+    def has_new_mail_notification(self) -> bool:
+        """
+        Check (and clear) untagged EXISTS/RECENT responses received from server.
+        """
+        _, exists = self.mailbox.response('EXISTS')
+        _, recent = self.mailbox.response('RECENT')
+        return exists != [None] or recent != [None]
+
+    def start_idle(self, callback) -> bool:
+        """
+        Enter IMAP IDLE mode, 'callback' is called by imaplib2 thread when IDLE ends.
+        Returns False (IDLE isn't started), if mail was received by previous command (search, fetch, noop).
+        Blocks while other commands of connection are in progress.
+        """
+        if self.has_new_mail_notification():
+            return False
+        logging.debug("Entering IMAP IDLE mode (timeout: %i seconds)..." % self.config.imap_idle_timeout)
+        self.mailbox.idle(timeout=self.config.imap_idle_timeout, callback=callback)
+        return True
+
+    async def wait_for_mail(self, run: typing.Callable[..., typing.Awaitable] = asyncio.to_thread):
+        """
+        Wait in IMAP IDLE mode until server notifies about new mails (EXISTS/RECENT).
+        IDLE will be renewed after 'idle_timeout' seconds or on other notifications (like EXPUNGE).
+        IDLE is started by 'run' (ex.: thread of IMAP commands), event loop isn't blocked meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            idle_done = loop.create_future()
+
+            def idle_callback(callback_arg):
+                # called by imaplib2 thread, hand over result to event loop
+                _, _, idle_error = callback_arg
+                loop.call_soon_threadsafe(
+                    lambda: idle_done.done() or idle_done.set_result(idle_error))
+
+            if not await run(self.start_idle, idle_callback):
+                return
+            idle_error = await idle_done
+
+            if idle_error is not None:
+                error_class, reason = idle_error
+                msg = "IMAP IDLE failed: %s" % self.config.tool.binary_to_string(reason)
+                logging.debug(msg)
+                raise self.MailError(msg, error_class)
 
     def disconnect(self):
         if self.mailbox is not None:
@@ -739,7 +2522,46 @@ class Mail:
                 self.mailbox = None
 
     @staticmethod
-    def decode_body(msg) -> MailBody:
+    def decode_payload(part, spool_size: int = 0) -> bytes | typing.IO[bytes]:
+        """
+        Get decoded payload of MIME part. If 'spool_size' is set, base64 or quoted-printable encoded
+        payloads are decoded chunk by chunk into a temporary file (kept in memory up to 'spool_size' bytes).
+        """
+        payload = part.get_payload(decode=False)
+        transfer_encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+        if spool_size <= 0 or not isinstance(payload, str) \
+                or transfer_encoding not in ('base64', 'quoted-printable'):
+            return part.get_payload(decode=True)
+
+        file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        rest = b''
+        position = 0
+        while position < len(payload):
+            if transfer_encoding == 'base64':
+                # decode complete groups of 4 characters only, keep rest for next chunk
+                chunk = rest + b''.join(payload[position:position + Mail.DECODE_CHUNK_SIZE]
+                                        .encode('ascii', 'surrogateescape').split())
+                position += Mail.DECODE_CHUNK_SIZE
+                end = len(chunk) - len(chunk) % 4
+                chunk, rest = chunk[:end], chunk[end:]
+                file.write(binascii.a2b_base64(chunk))
+            else:
+                # decode complete lines only (soft line breaks)
+                end = payload.find('\n', position + Mail.DECODE_CHUNK_SIZE)
+                end = len(payload) if end < 0 else end + 1
+                file.write(binascii.a2b_qp(payload[position:end].encode('ascii', 'surrogateescape')))
+                position = end
+        if rest:
+            # incomplete padding
+            try:
+                file.write(binascii.a2b_base64(rest + b'=' * (-len(rest) % 4)))
+            except binascii.Error:
+                pass
+        file.seek(0)
+        return file
+
+    @staticmethod
+    def decode_body(msg, spool_size: int = 0) -> MailBody:
         """
         Get payload from message and return structured body data
         """
@@ -777,7 +2599,7 @@ class Mail:
                 attachment = MailAttachment()
                 attachment.idx = index
                 attachment.name = 'invite.ics'
-                attachment.file = part.get_payload(decode=True)
+                attachment.file = Mail.decode_payload(part, spool_size)
                 attachments.append(attachment)
                 index += 1
 
@@ -787,7 +2609,7 @@ class Mail:
                     attachment = MailAttachment()
                     attachment.idx = index
                     attachment.set_name(str(part.get_filename()))
-                    attachment.file = part.get_payload(decode=True)
+                    attachment.file = Mail.decode_payload(part, spool_size)
                     attachments.append(attachment)
                     index += 1
 
@@ -798,16 +2620,11 @@ class Mail:
                         image.idx = index
                         image.set_name(str(part.get_filename()))
                         image.set_id(part.get('Content-ID', image.name))
-                        image.file = part.get_payload(decode=True)
+                        image.file = Mail.decode_payload(part, spool_size)
                         images.append(MailImage(key=image.id, image=image))
                         index += 1
 
-        body = MailBody()
-        body.text = text_part
-        body.html = html_part
-        body.attachments = attachments
-        body.images = images
-        return body
+        return MailBody(text=text_part or '', html=html_part or '', images=images, attachments=attachments)
 
     def get_last_uid(self) -> str:
         """
@@ -819,17 +2636,238 @@ class Mail:
             return ''
         return self.config.tool.binary_to_string(data[0])
 
+    def load_checkpoint(self) -> str:
+        """
+        Get UID to resume from, based on stored checkpoint or most recent UID on server
+        """
+        folder = self.config.imap_folder
+        checkpoint = self.store.get_checkpoint(self.account, folder)
+        if checkpoint is not None:
+            uid_validity, last_uid = checkpoint
+            if uid_validity == self.uid_validity and last_uid:
+                # mails fetched before, but not delivered (ex.: crash or connection error)
+                self.pending_uids = self.store.get_uids(self.account, folder, StateStore.STATUS_FETCHED)
+                logging.info("Resuming with UID '%s' and %i pending mail(s)" % (last_uid, len(self.pending_uids)))
+                return last_uid
+            logging.warning("UIDVALIDITY of folder '%s' changed from '%s' to '%s', stored state was reset."
+                            % (folder, uid_validity, self.uid_validity))
+            self.store.reset(self.account, folder)
+
+        last_uid = self.get_last_uid()
+        self.store.set_checkpoint(self.account, folder, self.uid_validity, last_uid)
+        return last_uid
+
+    def confirm_delivery(self, mails: list[MailData]) -> list[MailData]:
+        """
+        Store delivery status of sent mails and move checkpoint to most recent UID,
+        failed mails are added to outbox to be delivered again. Returns mails moved to dead letters.
+        """
+        folder = self.config.imap_folder
+        delivered = [mail.uid for mail in mails if mail.delivered]
+        self.store.set_status(self.account, folder, delivered, StateStore.STATUS_DELIVERED)
+        self.store.remove_retries(self.account, folder, delivered)
+        metrics.inc('mails_delivered_total', len(delivered), account=self.account)
+        dead_letters: list[MailData] = []
+        for mail in mails:
+            if not mail.delivered:
+                metrics.inc('mails_failed_total', account=self.account)
+                if self.schedule_retry(mail.uid, mail.error, mail.retry_after, mail.failed_targets or None):
+                    dead_letters.append(mail)
+
+        # next mails may be fetched already, so checkpoint is moved to most recent UID of these mails only
+        last_uid = max([mail.uid for mail in mails], key=int, default='')
+        checkpoint = self.store.get_checkpoint(self.account, folder)
+        if last_uid and (checkpoint is None or not checkpoint[1] or int(last_uid) > int(checkpoint[1])):
+            self.store.set_checkpoint(self.account, folder, self.uid_validity, last_uid)
+        self.update_uid_lag()
+        return dead_letters
+
+    def update_uid_lag(self):
+        """
+        Update number of UIDs between most recent mail found by search and last forwarded mail
+        """
+        checkpoint = self.store.get_checkpoint(self.account, self.config.imap_folder)
+        if self.newest_uid and checkpoint is not None and checkpoint[1]:
+            metrics.set('imap_uid_lag', max(0, int(self.newest_uid) - int(checkpoint[1])), account=self.account)
+
+    def schedule_retry(self, uid: str, reason: str, retry_after: float = 0,
+                       targets: list[RouteTarget] | None = None) -> bool:
+        """
+        Deliver mail again after exponential backoff (with jitter) or flood wait requested by Telegram,
+        mails failed 'retry_attempts' times are moved to dead letters (returns True).
+        Mail is delivered again to failed 'targets' only (all targets or targets of previous attempt if None).
+        """
+        folder = self.config.imap_folder
+        attempts = self.store.get_attempts(self.account, folder, uid) + 1
+        if not reason:
+            reason = 'Unknown error'
+        targets_json = None
+        if targets is not None:
+            targets_json = json.dumps([[target.chat_id, target.thread_id, target.message_format]
+                                       for target in targets])
+        if attempts >= self.config.tg_retry_attempts:
+            self.store.set_dead_letter(self.account, folder, uid, attempts, reason, targets_json)
+            self.store.set_status(self.account, folder, [uid], StateStore.STATUS_FAILED)
+            metrics.inc('mails_dead_letters_total', account=self.account)
+            logging.critical("Delivery of mail with UID '%s' failed %i time(s), moved to dead letters: %s"
+                             % (uid, attempts, reason))
+            return True
+
+        delay = min(self.config.tg_retry_max_delay, self.config.tg_retry_delay * 2 ** (attempts - 1))
+        # jitter: don't retry all mails failed at the same time at once
+        delay = max(random.uniform(delay / 2, delay), retry_after)
+        self.store.set_retry(self.account, folder, uid, attempts, time.time() + delay, reason, targets_json)
+        self.store.set_status(self.account, folder, [uid], StateStore.STATUS_RETRY)
+        logging.warning("Delivery of mail with UID '%s' failed (attempt %i of %i), retry in %i seconds: %s"
+                        % (uid, attempts, self.config.tg_retry_attempts, delay, reason))
+        return False
+
+    def get_due_retries(self) -> list[str]:
+        return self.store.get_due_retries(self.account, self.config.imap_folder,
+                                          max(1, self.config.imap_fetch_batch_size))
+
+    def get_retry_targets(self, uids: list[str]) -> dict[str, list[RouteTarget]]:
+        """
+        Get targets of mails in outbox, their previous delivery failed for
+        """
+        return {uid: [RouteTarget(*target) for target in json.loads(targets)]
+                for uid, targets in self.store.get_retry_targets(self.account, self.config.imap_folder, uids).items()}
+
+    @staticmethod
+    def build_uid_set(uids: list[bytes]) -> str:
+        """
+        Build IMAP sequence set of sorted UIDs, ranges will be merged (ex.: '1:3,7,9:10')
+        """
+        ranges: list[str] = []
+        first = previous = None
+        for uid in map(int, uids):
+            if previous is not None and uid == previous + 1:
+                previous = uid
+                continue
+            if first is not None:
+                ranges.append(str(first) if first == previous else '%i:%i' % (first, previous))
+            first = previous = uid
+        if first is not None:
+            ranges.append(str(first) if first == previous else '%i:%i' % (first, previous))
+        return ','.join(ranges)
+
+    @staticmethod
+    def parse_uid_set(uid_set: str) -> list[tuple[int, int]]:
+        """
+        Get (first, last) UID of each range of IMAP sequence set (ex.: '1:3,7' -> [(1, 3), (7, 7)])
+        """
+        ranges: list[tuple[int, int]] = []
+        for item in uid_set.split(','):
+            first, _, last = item.partition(':')
+            if first.isdigit() and (not last or last.isdigit()):
+                ranges.append((min(int(first), int(last or first)), max(int(first), int(last or first))))
+        return ranges
+
+    def fetch_mails(self, uids: list[bytes]) -> list[tuple[str, bytes]]:
+        """
+        Fetch multiple mails by a single UID FETCH command and return (UID, RFC822 data) of each mail
+        """
+        if self.config.imap_partial_fetch:
+            return self.fetch_mails_partial(uids)
+
+        uid_set = self.build_uid_set(uids)
+        data = self._uid_fetch(uid_set, '(UID RFC822)')
+
+        mails: list[tuple[str, bytes]] = []
+        for idx, item in enumerate(data):
+            if not isinstance(item, tuple):
+                continue
+            # ex.: (b'1 (UID 42 RFC822 {1234}', b'<mail>'), b')'
+            match = re.search(rb'\bUID\s+(\d+)', item[0])
+            if match is None and idx + 1 < len(data) and isinstance(data[idx + 1], bytes):
+                # some servers send UID after literal, ex.: (b'1 (RFC822 {1234}', b'<mail>'), b' UID 42)'
+                match = re.search(rb'\bUID\s+(\d+)', data[idx + 1])
+            if match is None:
+                logging.error("Missing UID in fetch response: %s" % self.config.tool.binary_to_string(item[0]))
+                continue
+            mails.append((self.config.tool.binary_to_string(match.group(1)), item[1]))
+
+        # process mails in order of UIDs
+        mails.sort(key=lambda mail: int(mail[0]))
+        return mails
+
+    def _uid_fetch(self, uid_set: str, items: str) -> list:
+        try:
+            rv, data = self.mailbox.uid('fetch', uid_set, items)
+        except imaplib2.IMAP4_SSL.error as fetch_error:
+            error_msgs = [self.config.tool.binary_to_string(arg) for arg in fetch_error.args]
+            raise self.MailError("Fetch of UIDs '%s' failed: %s" % (uid_set, ', '.join(error_msgs)))
+        if rv != 'OK':
+            raise self.MailError("Fetch of UIDs '%s' returned: %s" % (uid_set, str(rv)))
+        return data
+
+    def is_part_required(self, part: MailPart) -> bool:
+        """
+        Check if content of MIME part will be used by 'decode_body'/'parse_mail' (see config)
+        """
+        content_type = part.content_type
+        if content_type in ('text/plain', 'text/html', 'message/rfc822'):
+            return self.config.tg_forward_mail_content
+        elif content_type == 'text/calendar':
+            return self.config.tg_forward_attachment
+        elif part.get_content_charset() is None:
+            if part.disposition == 'attachment':
+                return self.config.tg_forward_attachment
+            elif part.disposition == 'inline' and content_type in ('image/png', 'image/jpeg'):
+                return self.config.tg_forward_mail_content and self.config.tg_forward_embedded_images
+        return False
+
+    def fetch_mails_partial(self, uids: list[bytes]) -> list[tuple[str, bytes]]:
+        """
+        Fetch BODYSTRUCTURE first and get only required MIME parts of each mail,
+        skipped parts (ex.: attachments, if not forwarded) will be rebuilt with headers only.
+        """
+        structures = ImapResponse.parse_fetch(self._uid_fetch(self.build_uid_set(uids), '(UID BODYSTRUCTURE)'))
+
+        # group mails having same structure, to fetch them by a single command
+        plans: dict[tuple[str, ...], list[bytes]] = {}
+        parts: dict[str, MailPart] = {}
+        for uid, values in structures.items():
+            try:
+                parts[uid] = MailPart(values['BODYSTRUCTURE'])
+            except (KeyError, IndexError, TypeError) as structure_error:
+                logging.error("Cannot parse BODYSTRUCTURE of mail with UID '%s': %s" % (uid, structure_error))
+                continue
+            sections = tuple(parts[uid].fetch_sections(self.is_part_required))
+            plans.setdefault(sections, []).append(uid.encode())
+
+        mails: list[tuple[str, bytes]] = []
+        for sections, plan_uids in plans.items():
+            # 'BODY[HEADER]' marks mail as seen (like 'RFC822'), parts are fetched by 'BODY.PEEK'
+            items = ' '.join(['BODY[%s]' % section if section == 'HEADER' else 'BODY.PEEK[%s]' % section
+                              for section in sections])
+            fetched = ImapResponse.parse_fetch(self._uid_fetch(self.build_uid_set(sorted(plan_uids, key=int)),
+                                                               '(UID %s)' % items))
+            for uid, values in fetched.items():
+                if uid in parts:
+                    mails.append((uid, parts[uid].build(values)))
+
+        # process mails in order of UIDs
+        mails.sort(key=lambda mail: int(mail[0]))
+        return mails
+
     def parse_mail(self, uid, mail) -> (MailData | None):
         """
         parse data from mail like subject, body and attachments and return structured mail data
         """
         try:
-            msg: email.message.Message[str, str] = email.message_from_bytes(mail)
+            started = time.perf_counter()
+            timings = {'message_from_bytes': 0.0, 'decode_body': 0.0, 'cleanup_html': 0.0, 'escape_markdown': 0.0,
+                       'render': 0.0}
+            with Profiler.measure(timings, 'message_from_bytes'):
+                msg: email.message.Message[str, str] = email.message_from_bytes(mail)
 
             # decode body data (text, html, multipart/attachments)
-            body = self.decode_body(msg)
+            with Profiler.measure(timings, 'decode_body'):
+                body = self.decode_body(msg, self.config.imap_spool_size)
             message_type = MailDataType.TEXT
             content = ''
+            truncated = False
 
             if self.config.tg_forward_mail_content:
                 # remove useless content
@@ -839,8 +2877,7 @@ class Mail:
                     # insert inline image
                     if self.config.tg_forward_embedded_images:
                         cid: Match[str]
-                        for cid in re.finditer(r'\[cid:([^]]*)]', content,
-                                               flags=(re.DOTALL | re.MULTILINE | re.IGNORECASE)):
+                        for cid in self.renderer.cid_pattern.finditer(content):
                             for mail_image in body.images:
                                 if mail_image['key'] == cid:
                                     content = content.replace(
@@ -849,111 +2886,72 @@ class Mail:
                                     )
                                     break
 
-                bot = TelegramBot(self.config)
                 if self.config.tg_prefer_html:
                     # Prefer HTML
                     if body.html:
                         message_type = MailDataType.HTML
-                        content = bot.cleanup_html(body.html, body.images)
+                        with Profiler.measure(timings, 'cleanup_html'):
+                            content, truncated = self.html_cleaner.convert(body.html, body.images,
+                                                                           self.config.imap_max_length)
 
                     elif body.text:
-                        content = helpers.escape_markdown(text=content,
-                                                          version=self.config.tg_markdown_version)
+                        with Profiler.measure(timings, 'escape_markdown'):
+                            content = self.renderer.escape(content)
 
                 else:
                     if body.text:
-                        content = helpers.escape_markdown(text=content,
-                                                          version=self.config.tg_markdown_version)
+                        with Profiler.measure(timings, 'escape_markdown'):
+                            content = self.renderer.escape(content)
 
                     elif body.html:
                         message_type = MailDataType.HTML
-                        content = bot.cleanup_html(body.html, body.images)
-
-                if content:
-                    # remove multiple line breaks (keeping up to 1 empty line)
-                    content = re.sub(r'(\s*\r?\n){2,}', "\n\n", content)
-
-                    if message_type == MailDataType.HTML:
-                        # add space after links (provide space for touch on link lists)
-                        # '&lt;' keep mail marker together (ex.: &lt;<a href="mailto:t@ex.com">t@ex.xom</a>&gt;)
-                        content = re.sub(r'(?P<a></a>(\s*&gt;)?)\s*', r'\g<a>\n\n', content, flags=re.MULTILINE)
-
-                    # remove spaces and line breaks on start and end (enhanced strip)
-                    content = re.sub(r'^\s*', '', content)
-                    content = re.sub(r'\s*$', '', content)
-
-                    max_len = self.config.imap_max_length
-                    content_len = len(content)
-                    if message_type == MailDataType.HTML and content_len > 0:
-                        # get length of parsed HTML (all tags and masked images (ex.: '${<image>|<title>}') removed)
-                        content_plain: str = re.sub(r'(<[^>]*>)|(\${[^}]+})', '', content, flags=re.MULTILINE)
-                        # get new max length based on plain text factor
-                        plain_factor: float = (len(content_plain) / content_len) + float(1)
-                        max_len = int(max_len * plain_factor)
-                    if content_len > max_len:
-                        content = content[:max_len]
-                        if message_type == MailDataType.HTML:
-                            # remove incomplete html tag
-                            content = re.sub(r'<(\s*\w*(\s*[^>]*?)?(</[^>]*)?)?$', '', content)
-                        else:
-                            # remove last "\"
-                            content = re.sub(r'\\*$', '', content)
-                        content += "... (first " + str(max_len) + " characters)"
+                        with Profiler.measure(timings, 'cleanup_html'):
+                            content, truncated = self.html_cleaner.convert(body.html, body.images,
+                                                                           self.config.imap_max_length)
+
+                with Profiler.measure(timings, 'render'):
+                    content = self.renderer.render_content(content, message_type, truncated)
 
             # attachment summary
-            attachments_summary = ""
-            if body.attachments:
-                if message_type == MailDataType.HTML:
-                    attachments_summary = "\n\n" + chr(10133) + \
-                                          " <b>" + str(len(body.attachments)) + " attachments:</b>\n"
-                else:
-                    attachments_summary = "\n\n" + chr(10133) + \
-                                          " **" + str(len(body.attachments)) + " attachments:**\n"
-                for attachment in body.attachments:
-                    if message_type == MailDataType.HTML:
-                        file_name = attachment.name
-                    else:
-                        file_name = helpers.escape_markdown(
-                            text=attachment.name, version=self.config.tg_markdown_version)
-                    attachments_summary += "\n " + str(attachment.idx) + ": " + file_name
+            with Profiler.measure(timings, 'render'):
+                attachments_summary = self.renderer.render_attachments(body.attachments, message_type)
 
             # subject
             subject = self.config.tool.decode_mail_data(msg['Subject'])
 
-            # build summary
-            mail_from = self.config.tool.decode_mail_data(msg['From'])
-
-            if self.config.tg_forward_mail_content:
-                summary_line = "\n=============================\n"
-            else:
-                summary_line = "\n"
+            # build summary
+            mail_from = self.config.tool.decode_mail_data(msg['From'])
 
-            if message_type == MailDataType.HTML:
-                mail_from = html.escape(mail_from, quote=True)
-                email_text = "<b>From:</b> " + mail_from + "\n<b>Subject:</b> "
-            else:
-                subject = helpers.escape_markdown(text=subject,
-                                                  version=self.config.tg_markdown_version)
-                mail_from = helpers.escape_markdown(text=mail_from,
-                                                    version=self.config.tg_markdown_version)
-                summary_line = helpers.escape_markdown(text=summary_line,
-                                                       version=self.config.tg_markdown_version)
-                email_text = "*From:* " + mail_from + "\n*Subject:* "
-            email_text += subject + summary_line + content + " " + attachments_summary
-
-            mail_data = MailData()
-            mail_data.uid = uid
-            mail_data.raw = msg
-            mail_data.type = message_type
-            mail_data.mail_from = mail_from
-            mail_data.mail_subject = subject
-            mail_data.mail_body = content
-            mail_data.mail_images = body.images
-            mail_data.summary = email_text
-            mail_data.attachment_summary = attachments_summary
-            mail_data.attachments = body.attachments
-
-            return mail_data
+            # decoded headers used by routing rules
+            headers = {
+                'from': mail_from,
+                'to': ', '.join(self.config.tool.decode_mail_data(msg[name])
+                                for name in ('To', 'Cc') if msg[name] is not None),
+                'subject': subject,
+                'list_id': self.config.tool.decode_mail_data(msg['List-Id']) if msg['List-Id'] else '',
+                'folder': self.config.imap_folder
+            }
+
+            with Profiler.measure(timings, 'render'):
+                email_header, mail_from, subject, summary_line = self.renderer.render_header(mail_from, subject,
+                                                                                             message_type)
+            email_text = email_header + subject + summary_line + content + " " + attachments_summary
+
+            # message is rendered, it isn't kept (decoded attachments/images are)
+            timings['parse'] = time.perf_counter() - started
+            return MailData(uid=uid,
+                            type=message_type,
+                            mail_from=mail_from,
+                            mail_subject=subject,
+                            mail_body=content,
+                            mail_images=body.images,
+                            summary=email_text,
+                            attachment_summary=attachments_summary,
+                            attachments=body.attachments,
+                            header_summary=email_header + subject + "\n" + attachments_summary,
+                            headers=headers,
+                            size=len(mail),
+                            timings=timings)
 
         except Exception as parse_error:
             if len(parse_error.args) > 0:
@@ -962,12 +2960,12 @@ class Mail:
                 logging.critical("Cannot parse mail: %s" % parse_error.__str__())
             return None
 
-    def search_mails(self) -> list[MailData]:
+    def search_uids(self) -> list[bytes]:
         """
-        Search mail on remote IMAP server and return list of parsed mails.
+        Search mail on remote IMAP server and return sorted list of UIDs to forward.
         """
         if self.last_uid is None or self.last_uid == '':
-            self.last_uid = self.get_last_uid()
+            self.last_uid = self.load_checkpoint()
             logging.info("Most recent UID: '%s'" % self.last_uid)
 
         # build IMAP search string
@@ -981,8 +2979,24 @@ class Mail:
             # empty mailbox
             return []
 
+        self.search_modseq = ''
+        # search of old mails (first loop of 'read_old_mails') is not restricted to changed mails
+        if self.condstore and not (self.config.imap_read_old_mails and not self.config.imap_read_old_mails_processed):
+            self.search_modseq = self.get_highest_modseq()
+            if self.search_modseq and self.modseq:
+                # mails changed (ex.: new mails or flags) since last search
+                search_string = '%s MODSEQ %i' % (search_string, int(self.modseq) + 1)
+
         try:
-            rv, data = self.mailbox.uid('search', '', search_string)
+            if self.search_modseq and self.search_modseq == self.modseq and not self.pending_uids:
+                logging.debug("Folder '%s' not changed since HIGHESTMODSEQ '%s', search skipped"
+                              % (self.config.imap_folder, self.modseq))
+                metrics.inc('imap_searches_skipped_total', account=self.account)
+                rv, data = 'OK', [b'']
+            else:
+                with metrics.time('imap_search_seconds', account=self.account), \
+                        profiler.span('imap_search', account=self.account):
+                    rv, data = self.mailbox.uid('search', '', search_string)
             if rv != 'OK':
                 logging.info("No messages found!")
                 return []
@@ -1002,51 +3016,530 @@ class Mail:
             self.disconnect()
             raise self.MailError(msg)
 
-        mails = []
         if self.config.imap_read_old_mails and not self.config.imap_read_old_mails_processed:
             # ignore current/max UID during first loop
-            max_uid = ''
+            self.max_uid = ''
             # don't repeat this on next loops
             self.config.imap_read_old_mails = False
             logging.info("Ignore most recent UID '%s', as old mails have to be processed first..." % self.last_uid)
         else:
-            max_uid = self.last_uid
+            self.max_uid = self.last_uid
             if not self.config.imap_read_old_mails_processed:
                 self.config.imap_read_old_mails_processed = True
                 logging.info("Reading mails having UID more recent than '%s', using search: '%s'"
                              % (self.last_uid, search_string))
 
-        for cur_uid in sorted(data[0].split()):
-            current_uid = self.config.tool.binary_to_string(cur_uid)
+        # highest mod-sequence of found mails is added to response of search by MODSEQ
+        uids = re.sub(rb'\(MODSEQ\s+\d+\)', b'', data[0] or b'', flags=re.IGNORECASE).split()
+        if uids:
+            self.newest_uid = self.config.tool.binary_to_string(max(uids, key=int))
+            self.update_uid_lag()
+        if self.pending_uids:
+            # retry mails fetched before, but not delivered
+            uids = list(set(uids) | {uid.encode() for uid in self.pending_uids})
+            self.pending_uids = []
+        # skip mails already delivered (ex.: search without UNSEEN) and mails waiting in outbox
+        skipped = set(self.store.get_uids(self.account, self.config.imap_folder, StateStore.STATUS_DELIVERED))
+        skipped |= self.store.get_retry_uids(self.account, self.config.imap_folder)
+        return sorted([uid for uid in uids if self.config.tool.binary_to_string(uid) not in skipped], key=int)
+
+    def fetch_raw(self, batch: list[bytes]) -> list[tuple[str, bytes]] | None:
+        """
+        Fetch mails of (sorted) UIDs, returns list of (UID, raw mail), or None if fetch failed.
+        """
+        try:
+            self.fetch_started = time.perf_counter()
+            with metrics.time('imap_fetch_seconds', account=self.account):
+                fetched = self.fetch_mails(batch)
+            self.fetch_time = time.perf_counter() - self.fetch_started
+            profiler.emit('imap_fetch', self.fetch_time, account=self.account, mails=len(fetched))
+            metrics.inc('imap_fetched_bytes_total', sum(len(msg_raw) for _, msg_raw in fetched), account=self.account)
+            metrics.inc('imap_fetched_mails_total', len(fetched), account=self.account)
+        except self.MailError as fetch_error:
+            logging.error("ERROR getting messages: %s" % ', '.join(map(str, fetch_error.args)))
+            return None
 
-            try:
-                rv, data = self.mailbox.uid('fetch', cur_uid, '(RFC822)')
-                if rv != 'OK':
-                    logging.error("ERROR getting message: %s" % current_uid)
-                    return []
+        # store status before delivery starts, to resume with undelivered mails after restart
+        self.store.set_status(self.account, self.config.imap_folder, [uid for uid, _ in fetched],
+                              StateStore.STATUS_FETCHED)
+        return fetched
 
-                msg_raw = data[0][1]
-                mail = self.parse_mail(current_uid, msg_raw)
-                if mail is None:
-                    logging.error("Can't parse mail with UID: '%s'" % current_uid)
-                else:
-                    logging.info("Parsed mail with UID '%s': '%s'" % (current_uid, mail.mail_subject))
-                    mails.append(mail)
+    def parse_fetched(self, current_uid: str, msg_raw: bytes) -> MailData | None:
+        """
+        Parse fetched mail, failed mails are marked to be skipped.
+        """
+        try:
+            return self.check_parsed(current_uid, profiler.parse(self, current_uid, msg_raw))
+
+        except Exception as mail_error:
+            logging.critical("Cannot process mail with UID '%s': %s"
+                             % (current_uid, ', '.join(map(str, mail_error.args))))
+        return None
+
+    def check_parsed(self, current_uid: str, mail: MailData | None) -> MailData | None:
+        if mail is None:
+            logging.error("Can't parse mail with UID: '%s'" % current_uid)
+            metrics.inc('parse_failures_total', account=self.account)
+            self.store.set_status(self.account, self.config.imap_folder, [current_uid],
+                                  StateStore.STATUS_FAILED)
+        else:
+            logging.info("Parsed mail with UID '%s': '%s'" % (current_uid, mail.mail_subject))
+            for stage, duration in mail.timings.items():
+                metrics.observe('parse_seconds', duration, account=self.account, stage=stage)
+                profiler.emit(stage, duration, mail, account=self.account)
+            # fetch of batch is shared by its mails
+            mail.started = self.fetch_started
+            mail.timings['imap_fetch'] = self.fetch_time
+        return mail
+
+    def complete_batch(self, batch: list[bytes], mail_count: int):
+        """
+        Remember most recent UID of fetched batch for next search.
+        """
+        # remember new UID for next loop (including mails deleted in the meantime)
+        if not self.max_uid or int(batch[-1]) > int(self.max_uid):
+            self.max_uid = self.config.tool.binary_to_string(batch[-1])
 
-            except Exception as mail_error:
-                logging.critical("Cannot process mail with UID '%s': %s" % (current_uid,
-                                                                            ', '.join(map(str, mail_error.args))))
+        if mail_count > 0:
+            self.last_uid = self.max_uid
+            logging.info("Got %i new mail(s) to forward, using most recent UID: '%s'" % (mail_count, self.last_uid))
 
-            finally:
-                # remember new UID for next loop
-                max_uid = current_uid
+    def complete_search(self):
+        """
+        Remember HIGHESTMODSEQ of search, after all mails found were fetched (CONDSTORE),
+        next searches are restricted to mails changed since then.
+        """
+        if self.search_modseq and self.search_modseq != self.modseq:
+            self.modseq = self.search_modseq
+            self.store.set_sync_state(self.account, self.config.imap_folder, self.uid_validity, self.modseq)
+        self.search_modseq = ''
+
+    def fetch_batch(self, batch: list[bytes]) -> list[MailData] | None:
+        """
+        Fetch and parse mails of (sorted) UIDs, returns list of parsed mails, or None if fetch failed.
+        """
+        fetched = self.fetch_raw(batch)
+        if fetched is None:
+            return None
+        mails: list[MailData] = []
+        for current_uid, msg_raw in fetched:
+            mail = self.parse_fetched(current_uid, msg_raw)
+            if mail is not None:
+                mails.append(mail)
+        self.complete_batch(batch, len(mails))
+        return mails
 
-        if len(mails) > 0:
-            self.last_uid = max_uid
-            logging.info("Got %i new mail(s) to forward, using most recent UID: '%s'" % (len(mails), self.last_uid))
+    def search_mails(self) -> list[MailData]:
+        """
+        Search mail on remote IMAP server and return list of parsed mails.
+        """
+        mails: list[MailData] = []
+        uids = self.search_uids()
+        batch_size = max(1, self.config.imap_fetch_batch_size)
+        for batch_start in range(0, len(uids), batch_size):
+            batch_mails = self.fetch_batch(uids[batch_start:batch_start + batch_size])
+            if batch_mails is None:
+                # UID and mod-sequence are kept, failed mails are searched again on next loop
+                return mails
+            mails += batch_mails
+        self.complete_search()
         return mails
 
 
+class ParserPool:
+    """
+    Parse mails by worker processes, as MIME decoding and HTML cleanup are CPU bound.
+    Parsed mails are returned (pickled) in order of submission. A single pool is shared by all
+    accounts, each worker process parses mails by a parser of the account (config name).
+    """
+    # parsers of worker process by config name
+    parsers: dict[str, Mail] = {}
+
+    executor: concurrent.futures.ProcessPoolExecutor
+
+    def __init__(self, configs: list[Config]):
+        # accounts share processes, the largest number of 'parse_workers' is used
+        workers = max(config.imap_parse_workers for config in configs)
+        # 'spawn': forked workers would inherit threads and locks of IMAP connections
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                               mp_context=multiprocessing.get_context('spawn'),
+                                                               initializer=ParserPool.init_worker,
+                                                               initargs=(configs, logging.getLogger().level,
+                                                                         SystemdHandler.get_stream_name(),
+                                                                         profiler.capture))
+
+    @classmethod
+    def create(cls, configs: list[Config]) -> 'ParserPool | None':
+        """
+        Create pool for accounts having 'parse_workers' set (None, if no account uses worker processes)
+        """
+        configs = [config for config in configs if config.imap_parse_workers > 0]
+        return cls(configs) if configs else None
+
+    @staticmethod
+    def init_worker(configs: list[Config], log_level: int, log_stream: str, capture: bool):
+        # same stream as main process (ex.: standard output is used by output of dry run)
+        sys_handler = SystemdHandler(getattr(sys, log_stream))
+        sys_handler.tool = configs[0].tool
+        root_logger = logging.getLogger()
+        root_logger.setLevel(log_level)
+        root_logger.addHandler(sys_handler)
+        ParserPool.parsers = {config.name: Mail.create_parser(config) for config in configs}
+        if capture:
+            profiler.enable_capture()
+
+    @staticmethod
+    def parse(name: str, uid: str, msg_raw: bytes) -> MailData | None:
+        return profiler.parse(ParserPool.parsers[name], uid, msg_raw)
+
+    def submit(self, config: Config, uid: str, msg_raw: bytes) -> asyncio.Future:
+        return asyncio.wrap_future(self.executor.submit(ParserPool.parse, config.name, uid, msg_raw))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncMail:
+    """
+    Run blocking IMAP commands of Mail in a dedicated thread, to keep event loop
+    (Telegram uploads) responsive while mails are fetched.
+    """
+    config: Config
+    store: StateStore
+    mail: Mail | None = None
+    executor: concurrent.futures.ThreadPoolExecutor
+    pool: ParserPool | None = None
+
+    def __init__(self, config: Config, store: StateStore, pool: ParserPool | None = None):
+        self.config = config
+        self.store = store
+        # single thread: commands of a connection are processed one after another
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='imap')
+        if config.imap_parse_workers > 0:
+            # pool is shared by all accounts (and closed by owner)
+            self.pool = pool
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def connect(self):
+        self.mail = await self._run(Mail, self.config, self.store)
+
+    async def is_connected(self) -> bool:
+        return self.mail is not None and await self._run(self.mail.is_connected)
+
+    async def disconnect(self):
+        if self.mail is not None:
+            await self._run(self.mail.disconnect)
+
+    async def search_uids(self) -> list[bytes]:
+        return await self._run(self.mail.search_uids)
+
+    async def fetch_batch(self, batch: list[bytes]) -> list[MailData] | None:
+        return await self._run(self.mail.fetch_batch, batch)
+
+    async def iter_mails(self, uids: list[bytes], complete: bool = True) -> typing.AsyncIterator[MailData]:
+        """
+        Fetch (in batches) and parse mails of UIDs, parsed mails are returned one by one,
+        so delivery of first mails starts while next mails are fetched and parsed.
+        UID for next search is not changed, if 'complete' is not set (ex.: retry of older mails).
+        Failed fetch ends the pass, UID and mod-sequence are kept to search remaining mails again.
+        """
+        batch_size = max(1, self.config.imap_fetch_batch_size)
+        for batch_start in range(0, len(uids), batch_size):
+            batch = uids[batch_start:batch_start + batch_size]
+            mail = self.mail
+            fetched = await self._run(mail.fetch_raw, batch)
+            if fetched is None:
+                return
+            if self.pool is not None and len(fetched) >= self.config.imap_parse_min_batch:
+                # parse all mails of batch by worker processes, small batches are parsed in-process
+                jobs = [(uid, msg_raw, self.pool.submit(self.config, uid, msg_raw)) for uid, msg_raw in fetched]
+            else:
+                jobs = [(uid, msg_raw, None) for uid, msg_raw in fetched]
+            del fetched
+            # drop raw mails as soon as they are parsed
+            jobs.reverse()
+            mail_count = 0
+            while jobs:
+                uid, msg_raw, parsed = jobs.pop()
+                if parsed is not None:
+                    try:
+                        mail_data = await self._run(mail.check_parsed, uid, await parsed)
+                    except Exception as pool_error:
+                        logging.warning("Parsing of mail with UID '%s' by worker process failed: %s"
+                                        % (uid, ', '.join(map(str, pool_error.args))))
+                        parsed = None
+                if parsed is None:
+                    mail_data = await self._run(mail.parse_fetched, uid, msg_raw)
+                del msg_raw
+                if mail_data is not None:
+                    mail_count += 1
+                    yield mail_data
+            if complete:
+                await self._run(mail.complete_batch, batch, mail_count)
+        if complete:
+            await self._run(self.mail.complete_search)
+
+    async def confirm_delivery(self, mails: list[MailData]) -> list[MailData]:
+        return await self._run(self.mail.confirm_delivery, mails)
+
+    async def get_due_retries(self) -> list[str]:
+        return await self._run(self.mail.get_due_retries)
+
+    async def schedule_retry(self, uid: str, reason: str) -> bool:
+        return await self._run(self.mail.schedule_retry, uid, reason)
+
+    async def get_retry_targets(self, uids: list[str]) -> dict[str, list[RouteTarget]]:
+        return await self._run(self.mail.get_retry_targets, uids)
+
+    def supports_idle(self) -> bool:
+        return self.mail is not None and self.mail.supports_idle()
+
+    async def wait_for_mail(self):
+        # IDLE is started after commands in progress, its end is handed over by imaplib2 callback
+        await self.mail.wait_for_mail(self._run)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class MailArchive:
+    """
+    Mails of a directory of *.eml files, a Maildir or a mbox file (or single mail), read one by one:
+    archives are not loaded into memory at once. Returns (key, raw mail), key is the file name of
+    the mail (relative to directory) or the number of the mail in mbox file.
+    """
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> typing.Iterator[tuple[str, bytes]]:
+        if not os.path.isdir(self.path):
+            return self.read_mbox(self.path)
+        if os.path.isdir(os.path.join(self.path, 'cur')) and os.path.isdir(os.path.join(self.path, 'new')):
+            return self.read_maildir(self.path)
+        return self.read_directory(self.path)
+
+    @staticmethod
+    def read_file(file_name: str) -> bytes:
+        with open(file_name, 'rb') as mail_file:
+            return mail_file.read()
+
+    @staticmethod
+    def read_directory(path: str) -> typing.Iterator[tuple[str, bytes]]:
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.eml'):
+                    file_name = os.path.join(root, name)
+                    yield os.path.relpath(file_name, path), MailArchive.read_file(file_name)
+
+    @staticmethod
+    def read_maildir(path: str) -> typing.Iterator[tuple[str, bytes]]:
+        for sub_directory in ('cur', 'new'):
+            for name in sorted(os.listdir(os.path.join(path, sub_directory))):
+                if not name.startswith('.'):
+                    file_name = os.path.join(path, sub_directory, name)
+                    yield '%s/%s' % (sub_directory, name), MailArchive.read_file(file_name)
+
+    @staticmethod
+    def read_mbox(file_name: str) -> typing.Iterator[tuple[str, bytes]]:
+        """
+        Mails of mbox file separated by 'From ' lines (like module 'mailbox'), read line by line
+        """
+        with open(file_name, 'rb') as mbox_file:
+            first_line = mbox_file.readline()
+            if not first_line.startswith(b'From '):
+                # single mail, ex.: *.eml file
+                yield os.path.basename(file_name), first_line + mbox_file.read()
+                return
+            number = 1
+            content = bytearray()
+            for line in mbox_file:
+                if line.startswith(b'From '):
+                    yield str(number), bytes(content)
+                    number += 1
+                    content = bytearray()
+                else:
+                    content += line
+            yield str(number), bytes(content)
+
+
+class ReplayClient(TelegramClient):
+    """
+    Telegram client of dry runs: API requests are recorded instead of being sent, answered by
+    messages having sequential IDs. Files are recorded by size and hash of content.
+    """
+    requests: list[dict[str, typing.Any]]
+    message_id: int = 0
+
+    # noinspection PyMissingConstructor
+    def __init__(self, config: Config):
+        self.config = config
+        self.store = StateStore()
+        # bot isn't initialized, its methods identify API requests only
+        self.bot = Bot(token='0:replay')
+        self.delivery = DeliveryEngine(1)
+        self.requests = []
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def get_chat_title(self, chat_id) -> str:
+        return str(chat_id)
+
+    def get_file_id(self, kind: str, attachment: MailAttachment) -> str | None:
+        # files are uploaded each time, output doesn't depend on mails replayed before
+        return None
+
+    def set_file_id(self, kind: str, attachment: MailAttachment, file_id: str | None):
+        pass
+
+    @classmethod
+    def describe(cls, value) -> typing.Any:
+        """
+        Get JSON serializable value of request argument
+        """
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        if isinstance(value, (list, tuple)):
+            return [cls.describe(item) for item in value]
+        if isinstance(value, (InputMediaPhoto, InputMediaDocument)):
+            media = {'type': value.type, 'media': cls.describe(value.media), 'caption': value.caption,
+                     'parse_mode': value.parse_mode}
+            if isinstance(value, InputMediaDocument) and isinstance(value.media, InputFile):
+                # file name of photos is not used by Telegram
+                media['file_name'] = value.media.filename
+            return media
+        if isinstance(value, InputFile):
+            return cls.describe(value.input_file_content)
+        if hasattr(value, 'read'):
+            value.seek(0)
+            value = value.read()
+        if isinstance(value, bytes):
+            return {'size': len(value), 'sha256': hashlib.sha256(value).hexdigest()}
+        return str(value)
+
+    def message(self, chat_id, media_type: str | None = None) -> Message:
+        self.message_id += 1
+        file_info = {'file_id': 'replay-%i' % self.message_id, 'file_unique_id': 'replay-%i' % self.message_id}
+        content = {}
+        if media_type == 'photo':
+            content['photo'] = (PhotoSize(width=1, height=1, **file_info),)
+        elif media_type == 'document':
+            content['document'] = Document(**file_info)
+        return Message(message_id=self.message_id, date=datetime.datetime.fromtimestamp(0, datetime.timezone.utc),
+                       chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type=Chat.PRIVATE), **content)
+
+    async def send(self, chat_id, method, **kwargs):
+        method_name = getattr(method, '__name__', str(method))
+        request = {'method': method_name, 'chat_id': chat_id}
+        request.update((key, self.describe(value)) for key, value in kwargs.items())
+        self.requests.append(request)
+        if method_name == 'send_media_group':
+            return [self.message(chat_id, media.type) for media in kwargs['media']]
+        return self.message(chat_id, {'send_photo': 'photo', 'send_document': 'document'}.get(method_name))
+
+    def take(self) -> list[dict[str, typing.Any]]:
+        requests, self.requests = self.requests, []
+        return requests
+
+
+class Replay:
+    """
+    Dry run of mails of an archive (see MailArchive), without IMAP server and Telegram API: mails are
+    parsed, routed and rendered like fetched mails, Telegram API requests of each mail are written as
+    JSON line (ex.: to compare output of versions or to measure throughput of parsing and rendering).
+    """
+    config: Config
+    parser: Mail
+    pool: ParserPool | None = None
+    router: MailRouter
+    client: ReplayClient
+    tg_bot: TelegramBot
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.parser = Mail.create_parser(config)
+        self.pool = ParserPool.create([config])
+        self.router = MailRouter(config)
+        self.client = ReplayClient(config)
+        self.tg_bot = TelegramBot(config, self.client)
+
+    async def parse(self, uid: str, msg_raw: bytes) -> MailData | None:
+        started = time.perf_counter()
+        mail = None
+        if self.pool is not None:
+            try:
+                mail = await self.pool.submit(self.config, uid, msg_raw)
+            except Exception as pool_error:
+                logging.warning("Parsing of mail '%s' by worker process failed: %s"
+                                % (uid, ', '.join(map(str, pool_error.args))))
+        if mail is None:
+            mail = profiler.parse(self.parser, uid, msg_raw)
+        if mail is not None:
+            mail.started = started
+        return mail
+
+    async def render(self, uid: str, mail: MailData | None, path: str) -> dict[str, typing.Any]:
+        if mail is None:
+            return {'uid': uid, 'delivered': False, 'error': 'Mail not parsable'}
+        self.router.apply([mail])
+        await self.tg_bot.deliver(mail)
+        record = {'uid': uid, 'delivered': mail.delivered, 'requests': self.client.take()}
+        if mail.error:
+            record['error'] = mail.error
+        profiler.finish(mail, account=self.parser.account, folder=path)
+        return record
+
+    async def run(self, path: str, file_name: str = '-'):
+        """
+        Replay mails of archive, requests are written to file ('-': standard output).
+        Up to 'max_in_flight' mails are parsed at once (in order, see 'parse_workers').
+        """
+        output = sys.stdout if file_name == '-' else open(file_name, 'w', encoding='utf-8')
+        pending: collections.deque[tuple[str, asyncio.Task]] = collections.deque()
+        window = max(1, self.config.imap_max_in_flight)
+        count = failed = 0
+        started = time.perf_counter()
+        try:
+            mails = iter(MailArchive(path))
+            while True:
+                # read next mails, while earlier mails are parsed
+                while len(pending) < window:
+                    uid, msg_raw = next(mails, (None, None))
+                    if uid is None:
+                        break
+                    pending.append((uid, asyncio.ensure_future(self.parse(uid, msg_raw))))
+                    del msg_raw
+                if not pending:
+                    break
+                uid, parsed = pending.popleft()
+                record = await self.render(uid, await parsed, path)
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+                if not record['delivered']:
+                    failed += 1
+        finally:
+            for _, parsed in pending:
+                parsed.cancel()
+            if self.pool is not None:
+                self.pool.close()
+            if output is not sys.stdout:
+                output.close()
+            else:
+                output.flush()
+
+        duration = time.perf_counter() - started
+        logging.info("Replayed %i mail(s) of '%s' in %.1f seconds (%.1f mails/s), %i failed"
+                     % (count, path, duration, count / duration if duration > 0 else 0.0, failed))
+
+
 class SystemdHandler(logging.Handler):
     """
         Class to handle logging options.
@@ -1065,6 +3558,16 @@ class SystemdHandler(logging.Handler):
         self.stream = stream
         logging.Handler.__init__(self)
 
+    @staticmethod
+    def get_stream_name() -> str:
+        """
+        Get stream ('stdout' or 'stderr') of log messages of this process
+        """
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, SystemdHandler) and handler.stream is sys.stderr:
+                return 'stderr'
+        return 'stdout'
+
     def emit(self, record):
         try:
             if self.tool is not None:
@@ -1081,67 +3584,490 @@ class SystemdHandler(logging.Handler):
                 print("ERROR: SystemdHandler.emit failed with: " + emit_error.__str__())
 
 
-async def main() -> None:
+class Metrics:
     """
-        Run the main program
+    Counters, gauges and histograms of the forwarding pipeline, exported in Prometheus text format
+    by HTTP endpoint or by file for the textfile collector of node exporter. Thread safe.
     """
-    sys_handler = SystemdHandler()
-    root_logger = logging.getLogger()
-    root_logger.setLevel("INFO")
-    root_logger.addHandler(sys_handler)
+    PREFIX = 'mail_to_telegram_'
+    # upper bounds (seconds) of histogram buckets
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    # name: (type, help)
+    DEFINITIONS = {
+        'imap_search_seconds': ('histogram', 'Duration of IMAP searches'),
+        'imap_fetch_seconds': ('histogram', 'Duration of IMAP fetches of a batch of mails'),
+        'imap_fetched_bytes_total': ('counter', 'Bytes of mails fetched from IMAP server'),
+        'imap_fetched_mails_total': ('counter', 'Mails fetched from IMAP server'),
+        'imap_uid_lag': ('gauge', 'Most recent UID found by search minus UID of last forwarded mail'),
+        'imap_searches_skipped_total': ('counter', 'Searches skipped, as HIGHESTMODSEQ of folder was not changed'),
+        'parse_seconds': ('histogram', 'Duration of parsing a mail by stage (message_from_bytes, decode_body, '
+                                       'cleanup_html, escape_markdown, render, parse)'),
+        'parse_failures_total': ('counter', 'Mails which could not be parsed'),
+        'telegram_request_seconds': ('histogram', 'Duration of Telegram API requests by method'),
+        'telegram_errors_total': ('counter', 'Failed Telegram API requests by method and error'),
+        'telegram_retry_after_total': ('counter', 'Flood control errors (429, RetryAfter) of Telegram API'),
+        'mails_in_flight': ('gauge', 'Mails parsed, but not yet delivered'),
+        'mails_delivered_total': ('counter', 'Mails delivered to all of their targets'),
+        'mails_failed_total': ('counter', 'Failed deliveries of mails (retried from outbox)'),
+        'mails_dead_letters_total': ('counter', 'Mails moved to dead letters'),
+    }
 
-    args_parser = argparse.ArgumentParser(description='Mail to Telegram Forwarder')
-    args_parser.add_argument('-c', '--config', type=str, help='Path to config file', required=True)
-    args_parser.add_argument('-o', '--read-old-mails', action='store_true', required=False,
-                             help='Read mails received, before application was started')
-    cmd_args = args_parser.parse_args()
+    lock: threading.Lock
+    values: dict[str, dict[tuple, float]]
+    histograms: dict[str, dict[tuple, list[float]]]
+    server: http.server.ThreadingHTTPServer | None = None
 
-    if cmd_args.config is None:
-        logging.warning("Could not load config file, as no config file was provided.")
-        sys.exit(2)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.histograms = {}
 
-    mailbox = None
-    last_try = time.time()
-    tool = Tool()
-    sys_handler.tool = tool
-    try:
-        config = Config(tool, cmd_args)
-        sys_handler.mask_error_data = tool.mask_error_data
-        tg_bot = TelegramBot(config)
-        mailbox = Mail(config)
+    @staticmethod
+    def _labels(labels: dict[str, typing.Any]) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = self._labels(labels)
+        with self.lock:
+            values = self.values.setdefault(name, {})
+            values[key] = values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.values.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._labels(labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {})
+            if key not in histogram:
+                # counts of buckets, sum, count
+                histogram[key] = [0.0] * (len(self.BUCKETS) + 2)
+            counts = histogram[key]
+            for idx, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
 
-        # Keep polling
+    @staticmethod
+    def _format(name: str, labels: tuple, value: float) -> str:
+        if labels:
+            label_text = ','.join('%s="%s"' % (key, label.replace('\\', '\\\\').replace('"', '\\"')
+                                               .replace('\n', '\\n')) for key, label in labels)
+            return '%s{%s} %s\n' % (name, label_text, repr(float(value)))
+        return '%s %s\n' % (name, repr(float(value)))
+
+    def render(self) -> str:
+        """
+        Get all metrics in Prometheus text format
+        """
+        lines: list[str] = []
+        with self.lock:
+            for name, (metric_type, help_text) in self.DEFINITIONS.items():
+                full_name = self.PREFIX + name
+                lines.append('# HELP %s %s\n# TYPE %s %s\n' % (full_name, help_text, full_name, metric_type))
+                if metric_type == 'histogram':
+                    for labels, counts in self.histograms.get(name, {}).items():
+                        cumulative = 0.0
+                        for bound, count in zip(self.BUCKETS, counts):
+                            cumulative += count
+                            lines.append(self._format(full_name + '_bucket', labels + (('le', repr(bound)),),
+                                                      cumulative))
+                        lines.append(self._format(full_name + '_bucket', labels + (('le', '+Inf'),), counts[-1]))
+                        lines.append(self._format(full_name + '_sum', labels, counts[-2]))
+                        lines.append(self._format(full_name + '_count', labels, counts[-1]))
+                else:
+                    for labels, value in self.values.get(name, {}).items():
+                        lines.append(self._format(full_name, labels, value))
+        return ''.join(lines)
+
+    def serve(self, address: str, port: int):
+        """
+        Export metrics by HTTP endpoint (any path), served by a background thread
+        """
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, message_format, *args):
+                logging.debug("Metrics request: " + message_format % args)
+
+        self.server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logging.info("Metrics are available on 'http://%s:%i/metrics'" % (address, port))
+
+    def write(self, file_name: str):
+        """
+        Export metrics to file, replaced atomically (textfile collector must not read partial files)
+        """
+        directory = os.path.dirname(os.path.abspath(file_name))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.metrics-', delete=False) as metrics_file:
+            metrics_file.write(self.render())
+        os.chmod(metrics_file.name, 0o644)
+        os.replace(metrics_file.name, file_name)
+
+    async def export(self, file_name: str, interval: float = 15.0):
+        """
+        Export metrics to file every 'interval' seconds, until cancelled
+        """
         while True:
             try:
-                if mailbox is None:
-                    mailbox = Mail(config)
-                else:
-                    if not mailbox.is_connected():  # reconnect on error (broken connection)
-                        if last_try + 60 < time.time():
-                            mailbox = Mail(config)
-                            if not mailbox.is_connected():
-                                await asyncio.sleep(20)
-                                continue
-                            else:
-                                last_try = time.time()  # new timeout on success
-                        else:
-                            await asyncio.sleep(20)
-                            continue
+                self.write(file_name)
+            except OSError as write_error:
+                logging.error("Cannot write metrics to '%s': %s" % (file_name, write_error.strerror))
+            await asyncio.sleep(interval)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# metrics of all accounts (process wide)
+metrics = Metrics()
+
+
+class Profiler:
+    """
+    Timing hooks around processing stages of mails, to find out why mails take long to be forwarded:
+    imap_search and imap_fetch (of several mails), message_from_bytes, decode_body, cleanup_html,
+    escape_markdown, render and parse (parsing), telegram_chat, telegram_images, telegram_text,
+    telegram_attachments and deliver (delivery), confirm (state of delivery) and mail (end-to-end,
+    fetch until delivery was confirmed).
+    Hooks are called by hook(stage, duration, mail, labels), 'mail' is None for stages of several mails.
+    Durations of stages of a mail are summed up by 'MailData.timings'.
+    """
+    # frames of tracemalloc tracebacks (profile mode)
+    TRACE_FRAMES = 10
+
+    lock: threading.Lock
+    capture_lock: threading.Lock
+    hooks: list[typing.Callable[[str, float, MailData | None, dict[str, typing.Any]], None]]
+    output: typing.TextIO | None = None
+    # capture cProfile stats and tracemalloc snapshot of parsing, dumped for 'top' slowest mails
+    capture: bool = False
+    dump_dir: str = ''
+    top: int = 10
+    dumps: int = 0
+    # (duration, file name without extension) of slowest mails, min-heap
+    slowest: list[tuple[float, str]]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.capture_lock = threading.Lock()
+        self.hooks = []
+        self.slowest = []
+
+    def add_hook(self, hook: typing.Callable[[str, float, MailData | None, dict[str, typing.Any]], None]):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: typing.Callable[[str, float, MailData | None, dict[str, typing.Any]], None]):
+        self.hooks.remove(hook)
+
+    def emit(self, stage: str, duration: float, mail: MailData | None = None, **labels):
+        for hook in self.hooks:
+            try:
+                hook(stage, duration, mail, labels)
+            except Exception as hook_error:
+                logging.error("Profiling hook failed for stage '%s': %s"
+                              % (stage, ', '.join(map(str, hook_error.args))))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def measure(timings: dict[str, float], stage: str):
+        """
+        Add duration of block to stage of 'timings', without calling hooks (ex.: in worker process)
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+    @contextlib.contextmanager
+    def span(self, stage: str, mail: MailData | None = None, **labels):
+        """
+        Measure duration of block, added to timings of mail (if any) and handed over to hooks
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            if mail is not None:
+                mail.timings[stage] = mail.timings.get(stage, 0.0) + duration
+            self.emit(stage, duration, mail, **labels)
+
+    def start(self, file_name: str | None, dump_dir: str | None = None, top: int = 10):
+        """
+        Start profile mode: stages of each mail are written as JSON lines to file ('-': standard output),
+        cProfile stats and tracemalloc snapshots of parsing of the 'top' slowest mails are written to 'dump_dir'
+        """
+        if file_name:
+            self.output = sys.stdout if file_name == '-' else open(file_name, 'a', encoding='utf-8')
+            self.add_hook(self.write)
+        if dump_dir:
+            os.makedirs(dump_dir, exist_ok=True)
+            self.dump_dir = dump_dir
+            self.top = max(1, top)
+            self.enable_capture()
+
+    def enable_capture(self):
+        self.capture = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.TRACE_FRAMES)
+
+    def parse(self, parser: 'Mail', uid: str, msg_raw: bytes) -> MailData | None:
+        """
+        Parse mail, in capture mode cProfile stats, tracemalloc snapshot (memory still allocated
+        after parsing) and memory peak of parsing are kept by mail
+        """
+        if not self.capture:
+            return parser.parse_mail(uid, msg_raw)
+
+        # a single profiler can be active (ex.: accounts parsing by parallel threads)
+        with self.capture_lock:
+            profile = cProfile.Profile()
+            tracemalloc.clear_traces()
+            profile.enable()
+            try:
+                mail = parser.parse_mail(uid, msg_raw)
+            finally:
+                profile.disable()
+            if mail is not None:
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                                      tracemalloc.Filter(False, cProfile.__file__)))
+                profile.create_stats()
+                mail.profile = {'stats': profile.stats, 'snapshot': snapshot, 'peak_bytes': peak}
+        return mail
+
+    def write(self, stage: str, duration: float, mail: MailData | None, labels: dict[str, typing.Any]):
+        """
+        Hook of profile mode: write stages of each mail (end-to-end) and stages of several mails as JSON line
+        """
+        if mail is not None and stage != 'mail':
+            return
+        line = json.dumps(dict(stage=stage, duration=round(duration, 6), **labels), default=str)
+        with self.lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def finish(self, mail: MailData, **labels):
+        """
+        Processing of mail was finished (delivered or not): end-to-end duration and stages of mail are handed
+        over to hooks, cProfile stats and tracemalloc snapshot are dumped if mail is one of the slowest mails
+        """
+        profile, mail.profile = mail.profile, None
+        if mail.started <= 0 or (not self.hooks and profile is None):
+            return
+        duration = time.perf_counter() - mail.started
+        extra = {} if profile is None else {'parse_peak_bytes': profile['peak_bytes']}
+        self.emit('mail', duration, mail, uid=mail.uid, size=mail.size, delivered=mail.delivered,
+                  stages={stage: round(value, 6) for stage, value in mail.timings.items()}, **extra, **labels)
+        if profile is not None and self.dump_dir:
+            self.dump('%s-%s' % (labels.get('account', ''), mail.uid), duration, profile)
+
+    def dump(self, name: str, duration: float, profile: dict[str, typing.Any]):
+        """
+        Write cProfile stats (*.prof, see pstats) and tracemalloc snapshot (*.tracemalloc) of the slowest mails
+        """
+        with self.lock:
+            if len(self.slowest) >= self.top and duration <= self.slowest[0][0]:
+                return
+            self.dumps += 1
+            path = os.path.join(self.dump_dir, '%s-%i' % (re.sub(r'[^\w.@-]+', '_', name), self.dumps))
+            try:
+                with open(path + '.prof', 'wb') as stats_file:
+                    marshal.dump(profile['stats'], stats_file)
+                profile['snapshot'].dump(path + '.tracemalloc')
+            except OSError as dump_error:
+                logging.error("Cannot write profile '%s': %s" % (path, dump_error.strerror))
+                return
+            heapq.heappush(self.slowest, (duration, path))
+            if len(self.slowest) > self.top:
+                _, removed = heapq.heappop(self.slowest)
+                for extension in ('.prof', '.tracemalloc'):
+                    with contextlib.suppress(OSError):
+                        os.remove(removed + extension)
+
+    def stop(self):
+        if self.slowest:
+            logging.info("Profiles of %i slowest mail(s): %s"
+                         % (len(self.slowest), ', '.join("'%s' (%.3f s)" % (path, duration)
+                                                         for duration, path in sorted(self.slowest, reverse=True))))
+        if self.output is not None:
+            self.remove_hook(self.write)
+            if self.output is not sys.stdout:
+                self.output.close()
+            self.output = None
+        if self.capture and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.capture = False
+
+
+# profiling hooks of all accounts (process wide)
+profiler = Profiler()
+
+
+class PollScheduler:
+    """
+    Delays between polls of a mailbox: shortened to 'refresh' while mails are received,
+    increased exponentially up to 'max_refresh' on quiet mailboxes and up to
+    'max_reconnect_delay' on connection errors. Delays are randomized by jitter,
+    to spread polls of many accounts.
+    """
+    min_delay: float
+    max_delay: float
+    max_error_delay: float
+    delay: float
+    errors: int = 0
+    BACKOFF = 2.0
+    JITTER = 0.1
+
+    def __init__(self, config: Config):
+        self.min_delay = max(1.0, float(config.imap_refresh))
+        self.max_delay = max(self.min_delay, float(config.imap_max_refresh))
+        self.max_error_delay = max(self.min_delay, float(config.imap_max_reconnect_delay))
+        self.delay = self.min_delay
+
+    def jitter(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+    def first_delay(self) -> float:
+        """
+        Delay of first poll, spread over 'refresh' seconds
+        """
+        return random.uniform(0, self.min_delay)
 
-                mails = mailbox.search_mails()
+    def next_delay(self, mail_count: int) -> float:
+        """
+        Delay of next poll, after poll has found 'mail_count' mails
+        """
+        self.errors = 0
+        if mail_count > 0:
+            self.delay = self.min_delay
+        else:
+            self.delay = min(self.max_delay, self.delay * self.BACKOFF)
+        return self.jitter(self.delay)
 
-                if config.imap_disconnect:
-                    # if not reuse previous connection
-                    mailbox.disconnect()
+    def error_delay(self) -> float:
+        """
+        Delay of next connection attempt, after connection or poll has failed
+        """
+        self.errors += 1
+        self.delay = self.min_delay
+        return self.jitter(min(self.max_error_delay, self.min_delay * self.BACKOFF ** min(self.errors - 1, 32)))
 
-                # send mail data via TG bot
-                if mails is not None and len(mails) > 0:
-                    await tg_bot.send_message(mails)
 
-                if config.imap_push_mode:
-                    logging.info("IMAP IDLE mode")
+class Forwarder:
+    """
+    Forward mails of a mailbox as pipeline: mails are fetched, parsed and delivered one by one,
+    the number of mails parsed but not yet delivered is limited by 'max_in_flight'.
+    Failed deliveries are retried from outbox concurrently with new mails.
+    """
+    config: Config
+    account: str
+    source: AsyncMail
+    tg_bot: TelegramBot
+    router: MailRouter
+    window: asyncio.Semaphore
+    session: asyncio.Lock
+    scheduler: PollScheduler
+    in_flight: set[str]
+    # targets of retried mails, these failed to be sent to (by UID)
+    retry_targets: dict[str, list[RouteTarget]]
+    tasks: set[asyncio.Task]
+    # seconds between checks for mails in outbox to be delivered again
+    RETRY_INTERVAL = 10
+
+    def __init__(self, config: Config, store: StateStore, tg_bot: TelegramBot, pool: ParserPool | None = None):
+        self.config = config
+        # label of metrics, same as of mailbox (see Mail)
+        self.account = config.get_account_id()
+        self.source = AsyncMail(config, store, pool)
+        self.tg_bot = tg_bot
+        self.router = MailRouter(config)
+        self.window = asyncio.Semaphore(max(1, config.imap_max_in_flight))
+        # search/fetch of new mails and retries are not interleaved (ex.: disconnect after each loop)
+        self.session = asyncio.Lock()
+        self.scheduler = PollScheduler(config)
+        self.in_flight = set()
+        self.retry_targets = {}
+        self.tasks = set()
+
+    async def forward(self, mails: typing.AsyncIterator[MailData]) -> set[str]:
+        """
+        Start delivery of each mail, as soon as it was fetched and parsed. Returns UIDs of these mails.
+        """
+        started: set[str] = set()
+        while True:
+            # wait, if too many mails are waiting for delivery
+            await self.window.acquire()
+            mail = None
+            try:
+                mail = await anext(mails, None)
+            finally:
+                if mail is None:
+                    self.window.release()
+            if mail is None:
+                break
+
+            self.in_flight.add(mail.uid)
+            metrics.set('mails_in_flight', len(self.in_flight), account=self.account)
+            started.add(mail.uid)
+            task = asyncio.create_task(self.consume(mail))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return started
+
+    async def produce(self):
+        """
+        Search new mails and start delivery of each mail, as soon as it was fetched and parsed.
+        """
+        # Keep polling
+        while True:
+            try:
+                async with self.session:
+                    if self.source.mail is None or not await self.source.is_connected():
+                        # (re)connect on error (broken connection) or after disconnect
+                        await self.source.connect()
+
+                    # skip mails still waiting for delivery
+                    uids = [uid for uid in await self.source.search_uids()
+                            if self.config.tool.binary_to_string(uid) not in self.in_flight]
+                    started = await self.forward(self.source.iter_mails(uids))
+                    delay = self.scheduler.next_delay(len(started))
+
+                    if self.config.imap_disconnect:
+                        # if not reuse previous connection
+                        await self.source.disconnect()
+
+                if self.config.imap_push_mode and not self.config.imap_disconnect and self.source.supports_idle():
+                    # wait for new mails (EXISTS/RECENT notification of server)
+                    await self.source.wait_for_mail()
                 else:
-                    await asyncio.sleep(float(config.imap_refresh))
+                    logging.debug("Next poll of '%s' in %.1f seconds" % (self.config.name, delay))
+                    await asyncio.sleep(delay)
+                continue
 
             except Mail.MailError as mail_ex:
                 if len(mail_ex.args) > 0:
@@ -1149,8 +4075,7 @@ async def main() -> None:
                 else:
                     logging.critical('Error occurred [mail]: %s' % mail_ex.__str__())
 
-                if mailbox is not None:
-                    mailbox.disconnect()
+                await self.source.disconnect()
 
                 # ignore errors already handled by Mail- Class
 
@@ -1160,8 +4085,199 @@ async def main() -> None:
                 else:
                     logging.critical('Error occurred [loop]: %s' % loop_error.__str__())
 
-                if mailbox is not None:
-                    mailbox.disconnect()
+                await self.source.disconnect()
+
+            delay = self.scheduler.error_delay()
+            logging.info("Reconnecting to '%s' in %.1f seconds" % (self.config.name, delay))
+            await asyncio.sleep(delay)
+
+    async def retry(self):
+        """
+        Deliver mails of outbox again when their retry is due, mails are fetched again from server.
+        """
+        while True:
+            await asyncio.sleep(self.RETRY_INTERVAL)
+            try:
+                async with self.session:
+                    if self.source.mail is None:
+                        continue
+                    uids = [uid for uid in await self.source.get_due_retries() if uid not in self.in_flight]
+                    if not uids:
+                        continue
+                    if not await self.source.is_connected():
+                        if not self.config.imap_disconnect:
+                            # broken connection, reconnect is left to producer
+                            continue
+                        await self.source.connect()
+
+                    logging.info("Retrying delivery of %i mail(s) from outbox" % len(uids))
+                    # chats, which received mail already, don't get it again
+                    self.retry_targets.update(await self.source.get_retry_targets(uids))
+                    started = await self.forward(self.source.iter_mails([uid.encode() for uid in uids],
+                                                                        complete=False))
+                    for uid in uids:
+                        if uid not in started:
+                            self.retry_targets.pop(uid, None)
+                            await self.source.schedule_retry(uid, "Mail not found or not parsable")
+
+                    if self.config.imap_disconnect:
+                        await self.source.disconnect()
+
+            except Exception as retry_error:
+                if len(retry_error.args) > 0:
+                    logging.critical('Error occurred [retry]: %s' % ', '.join(map(str, retry_error.args)))
+                else:
+                    logging.critical('Error occurred [retry]: %s' % retry_error.__str__())
+
+    async def consume(self, mail: MailData):
+        """
+        Route and send mail via TG bot, checkpoint is moved after delivery.
+        """
+        try:
+            self.router.apply([mail])
+            if mail.uid in self.retry_targets:
+                mail.targets = self.retry_targets.pop(mail.uid)
+            await self.tg_bot.deliver(mail)
+            with profiler.span('confirm', mail):
+                dead_letters = await self.source.confirm_delivery([mail])
+            if dead_letters:
+                # errors of retries are logged only
+                await self.tg_bot.send_dead_letter(mail)
+
+        except Exception as delivery_error:
+            if len(delivery_error.args) > 0:
+                logging.critical('Error occurred [delivery]: %s' % ', '.join(map(str, delivery_error.args)))
+            else:
+                logging.critical('Error occurred [delivery]: %s' % delivery_error.__str__())
+
+        finally:
+            profiler.finish(mail, account=self.account, folder=self.config.imap_folder)
+            self.in_flight.discard(mail.uid)
+            self.retry_targets.pop(mail.uid, None)
+            metrics.set('mails_in_flight', len(self.in_flight), account=self.account)
+            self.window.release()
+
+    async def run(self, fail_fast: bool = True, spread: bool = False):
+        """
+        Forward mails until stopped, initial connection errors are fatal if 'fail_fast' is set,
+        otherwise connection will be retried (ex.: to keep other accounts running).
+        First connection is delayed randomly if 'spread' is set (ex.: many accounts).
+        """
+        if spread:
+            await asyncio.sleep(self.scheduler.first_delay())
+        logging.info("Forwarding mails of '%s' (folder: '%s')" % (self.config.name, self.config.imap_folder))
+        try:
+            await self.source.connect()
+        except Mail.MailError as connect_error:
+            if fail_fast:
+                raise connect_error
+            logging.critical("Error occurred [%s]: %s" % (self.config.name, ', '.join(map(str, connect_error.args))))
+        await asyncio.gather(self.produce(), self.retry())
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await self.source.disconnect()
+        self.source.close()
+
+
+async def main() -> None:
+    """
+        Run the main program
+    """
+    sys_handler = SystemdHandler()
+    root_logger = logging.getLogger()
+    root_logger.setLevel("INFO")
+    root_logger.addHandler(sys_handler)
+
+    args_parser = argparse.ArgumentParser(description='Mail to Telegram Forwarder')
+    args_parser.add_argument('-c', '--config', type=str, action='append', required=True,
+                             help='Path to config file or directory of config files (*.conf), can be repeated')
+    args_parser.add_argument('-o', '--read-old-mails', action='store_true', required=False,
+                             help='Read mails received, before application was started')
+    args_parser.add_argument('--list-dead-letters', action='store_true', required=False,
+                             help='List mails failed to be delivered too often and exit')
+    args_parser.add_argument('--replay-dead-letters', action='store_true', required=False,
+                             help='Deliver mails failed to be delivered too often again')
+    args_parser.add_argument('--metrics-port', type=int, required=False, default=0,
+                             help='Export metrics (Prometheus text format) by HTTP on this port (default: disabled)')
+    args_parser.add_argument('--metrics-address', type=str, required=False, default='127.0.0.1',
+                             help='Listen address of metrics endpoint (default: 127.0.0.1)')
+    args_parser.add_argument('--metrics-file', type=str, required=False,
+                             help='Export metrics to file (ex.: for textfile collector of node exporter)')
+    args_parser.add_argument('--profile', type=str, nargs='?', const='-', required=False,
+                             help='Write duration of processing stages of each mail as JSON lines to file '
+                                  '(default: standard output)')
+    args_parser.add_argument('--profile-dump', type=str, required=False,
+                             help='Write cProfile stats and tracemalloc snapshots of parsing of the slowest mails '
+                                  'to this directory')
+    args_parser.add_argument('--profile-top', type=int, required=False, default=10,
+                             help='Number of slowest mails to keep profiles of (default: 10)')
+    args_parser.add_argument('--replay', type=str, required=False,
+                             help='Dry run: forward mails of a directory of *.eml files, a Maildir or a mbox file '
+                                  'without IMAP server and Telegram, write Telegram API requests as JSON lines')
+    args_parser.add_argument('--replay-output', type=str, required=False, default='-',
+                             help='File of Telegram API requests of dry run (default: standard output)')
+    cmd_args = args_parser.parse_args()
+    if (cmd_args.replay and cmd_args.replay_output == '-') or cmd_args.profile == '-':
+        # standard output is used by JSON lines of dry run or profile
+        sys_handler.stream = sys.stderr
+
+    if cmd_args.config is None:
+        logging.warning("Could not load config file, as no config file was provided.")
+        sys.exit(2)
+
+    forwarders: list[Forwarder] = []
+    metrics_export: asyncio.Task | None = None
+    stores: dict[str, StateStore] = {}
+    clients: dict[str, TelegramClient] = {}
+    pool: ParserPool | None = None
+    tool = Tool()
+    sys_handler.tool = tool
+    try:
+        if cmd_args.profile or cmd_args.profile_dump:
+            # before parser pools are started, worker processes capture profiles too
+            profiler.start(cmd_args.profile, cmd_args.profile_dump, cmd_args.profile_top)
+
+        configs = Config.load_all(tool, cmd_args)
+        sys_handler.mask_error_data = tool.mask_error_data
+        if cmd_args.replay:
+            # options of first account are used
+            await Replay(configs[0]).run(cmd_args.replay, cmd_args.replay_output)
+            return
+
+        # worker processes parsing mails are shared by all accounts
+        pool = ParserPool.create(configs)
+        for config in configs:
+            # accounts share state file, bot and connection pool
+            if config.imap_state_file not in stores:
+                stores[config.imap_state_file] = StateStore(config.imap_state_file)
+            if config.tg_bot_token not in clients:
+                clients[config.tg_bot_token] = TelegramClient(config, stores[config.imap_state_file])
+            tg_bot = TelegramBot(config, clients[config.tg_bot_token])
+            forwarders.append(Forwarder(config, stores[config.imap_state_file], tg_bot, pool))
+
+        if cmd_args.list_dead_letters:
+            for store in stores.values():
+                for account, folder, uid, attempts, last_error, updated in store.get_dead_letters():
+                    logging.info("Dead letter '%s' (folder: '%s', UID: '%s'), %i attempt(s), last at %s: %s"
+                                 % (account, folder, uid, attempts, time.strftime('%Y-%m-%d %H:%M:%S',
+                                                                                  time.localtime(updated)),
+                                    last_error))
+            return
+
+        if cmd_args.replay_dead_letters:
+            for file_name, store in stores.items():
+                logging.info("Replaying %i dead letter(s) of state file '%s'"
+                             % (store.replay_dead_letters(), file_name or ':memory:'))
+
+        if cmd_args.metrics_port:
+            metrics.serve(cmd_args.metrics_address, cmd_args.metrics_port)
+        if cmd_args.metrics_file:
+            metrics_export = asyncio.create_task(metrics.export(cmd_args.metrics_file))
+
+        await asyncio.gather(*[forwarder.run(fail_fast=len(forwarders) == 1, spread=len(forwarders) > 1)
+                               for forwarder in forwarders])
 
     except KeyboardInterrupt:
         logging.critical('Stopping user aborted with CTRL+C')
@@ -1176,8 +4292,18 @@ async def main() -> None:
             logging.critical('Error occurred [main]: %s' % main_error.__str__())
 
     finally:
-        if mailbox is not None:
-            mailbox.disconnect()
+        for forwarder in forwarders:
+            await forwarder.stop()
+        if pool is not None:
+            pool.close()
+        if metrics_export is not None:
+            metrics_export.cancel()
+        metrics.stop()
+        profiler.stop()
+        for client in clients.values():
+            await client.stop()
+        for store in stores.values():
+            store.close()
         logging.info('Mail to Telegram Forwarder stopped!')
 
 
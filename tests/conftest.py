@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mailToTelegramForwarder as forwarder  # noqa: E402
+from benchmark.fake_imap import FakeImapServer  # noqa: E402
+
+CONFIG = """
+[Mail]
+server: %(server)s
+user: user
+password: secret
+%(mail)s
+[Telegram]
+bot_token: 1:token
+forward_to_chat_id: 42
+%(telegram)s
+%(sections)s
+"""
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """
+    Create config of options given as 'key: value' lines of sections 'Mail' and 'Telegram',
+    further sections (ex.: 'Mail:<account>') are added as they are
+    """
+    def make(mail: str = '', telegram: str = '', sections: str = '', account: str = '',
+             server: str = 'imap.example.com') -> forwarder.Config:
+        config_file = tmp_path / 'mailToTelegramForwarder.conf'
+        config_file.write_text(CONFIG % {'server': server, 'mail': mail, 'telegram': telegram, 'sections': sections})
+        cmd_args = argparse.Namespace(config=[str(config_file)], read_old_mails=False)
+        return forwarder.Config(forwarder.Tool(), cmd_args, str(config_file), account)
+    return make
+
+
+@pytest.fixture
+def imap_server():
+    """
+    IMAP server on localhost (single folder in memory, see benchmark/fake_imap.py)
+    """
+    server = FakeImapServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_imap_config(make_config, imap_server):
+    """
+    Create config of account of IMAP server (further options as 'key: value' lines of section 'Mail')
+    """
+    def make(mail: str = '', **kwargs) -> forwarder.Config:
+        return make_config(mail='ssl: False\nport: %i\n%s' % (imap_server.port, mail), server='127.0.0.1', **kwargs)
+    return make
@@ -0,0 +1,35 @@
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+
+@pytest.mark.parametrize('message, expected', [
+    # closing outer element closes unclosed inner elements
+    ('<b>bold <i>both</b> plain</i> text', '<b>bold <i>both</i></b> plain text'),
+    # elements without content are skipped
+    ('<a href="https://example.com/track"></a><b><i></i></b>text', 'text'),
+    ('<b>a<b>b</b>c</b>d', '<b>a<b>b</b>c</b>d'),
+    # end tags of elements not opened are ignored, open elements are closed at end
+    ('<i>x</i></b>y<u><s>z', '<i>x</i>y<u><s>z</s></u>'),
+])
+def test_nested_elements(make_config, message, expected):
+    assert forwarder.TelegramHtmlParser(make_config()).convert(message) == expected
+
+
+def test_deeply_nested_elements(make_config):
+    depth = 500
+    message = '<b><i>' * depth + ' '.join('<u>%i</u>' % idx for idx in range(1000)) + '</i></b>' * depth
+    assert forwarder.TelegramHtmlParser(make_config()).convert(message) == message
+
+
+@pytest.mark.parametrize('message, max_length, expected', [
+    # text fitting exactly isn't truncated
+    ('<p>abcde</p>', 5, ('abcde', False)),
+    ('<b>ab</b>cde', 5, ('<b>ab</b>cde', False)),
+    ('<p>abcdef</p>', 5, ('abcde', True)),
+    # content after limit is dropped, open elements are closed
+    ('<b>abcde</b> <i>f</i>', 5, ('<b>abcde</b>', True)),
+    ('<b>abc<i>defg</i></b>', 5, ('<b>abc<i>de</i></b>', True)),
+])
+def test_truncated_after_max_length(make_config, message, max_length, expected):
+    assert forwarder.HtmlCleaner(make_config()).convert(message, max_length=max_length) == expected
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import mailToTelegramForwarder as forwarder
+
+MAIL = b'From: sender@example.com\r\nSubject: New mail\r\n\r\nText of mail'
+
+
+def connect(config) -> forwarder.Mail:
+    mail = forwarder.Mail(config, forwarder.StateStore())
+    assert mail.supports_idle()
+    return mail
+
+
+def test_idle_wakeup_by_new_mail(make_imap_config, imap_server):
+    mail = connect(make_imap_config(mail='push_mode: True'))
+
+    async def wait() -> float:
+        waiting = asyncio.create_task(mail.wait_for_mail())
+        await asyncio.sleep(0.3)
+        assert not waiting.done()
+        started = time.perf_counter()
+        imap_server.mailbox.append(MAIL)
+        await asyncio.wait_for(waiting, 5)
+        return time.perf_counter() - started
+    try:
+        # server notifies by EXISTS during IDLE
+        assert asyncio.run(wait()) < 2
+    finally:
+        mail.disconnect()
+
+
+def test_idle_renewed_after_timeout(make_imap_config, imap_server):
+    mail = connect(make_imap_config(mail='push_mode: True\nidle_timeout: 1'))
+
+    async def wait():
+        waiting = asyncio.create_task(mail.wait_for_mail())
+        await asyncio.sleep(2.5)
+        # IDLE without notification is renewed, mail isn't reported
+        assert not waiting.done()
+        imap_server.mailbox.append(MAIL)
+        await asyncio.wait_for(waiting, 5)
+    try:
+        asyncio.run(wait())
+        assert imap_server.mailbox.commands['IDLE'] >= 3
+    finally:
+        mail.disconnect()
+
+
+def test_idle_does_not_block_event_loop(make_imap_config, imap_server, monkeypatch):
+    mail = connect(make_imap_config(mail='push_mode: True'))
+    started = mail.start_idle
+
+    def slow_start_idle(callback) -> bool:
+        # ex.: IDLE waits for command of other task (retry) in progress
+        time.sleep(1)
+        return started(callback)
+    monkeypatch.setattr(mail, 'start_idle', slow_start_idle)
+
+    async def wait() -> float:
+        waiting = asyncio.create_task(mail.wait_for_mail())
+        ticked = time.perf_counter()
+        await asyncio.sleep(0.1)
+        delay = time.perf_counter() - ticked
+        await asyncio.sleep(1.5)
+        imap_server.mailbox.append(MAIL)
+        await asyncio.wait_for(waiting, 5)
+        return delay
+    try:
+        assert asyncio.run(wait()) < 0.5
+    finally:
+        mail.disconnect()
+
+
+def test_idle_started_by_imap_thread(make_imap_config, imap_server, monkeypatch):
+    config = make_imap_config(mail='push_mode: True')
+    threads = []
+
+    async def wait():
+        mail = forwarder.AsyncMail(config, forwarder.StateStore())
+        await mail.connect()
+        started = mail.mail.start_idle
+
+        def recorded_start_idle(callback) -> bool:
+            threads.append(threading.current_thread().name)
+            return started(callback)
+        monkeypatch.setattr(mail.mail, 'start_idle', recorded_start_idle)
+        try:
+            waiting = asyncio.create_task(mail.wait_for_mail())
+            await asyncio.sleep(0.3)
+            imap_server.mailbox.append(MAIL)
+            await asyncio.wait_for(waiting, 5)
+        finally:
+            await mail.disconnect()
+            mail.close()
+    asyncio.run(wait())
+    # IDLE is serialized with other commands of the connection
+    assert threads and all(name.startswith('imap') for name in threads)
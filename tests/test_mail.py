@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+MAIL = b"From: sender@example.com\r\nSubject: Mail %s\r\nContent-Type: text/plain\r\n\r\nText of mail %s\r\n"
+
+
+@pytest.fixture
+def mail(make_config, monkeypatch) -> forwarder.Mail:
+    """
+    Mail without IMAP connection: UIDs 1-6 are found (2 per batch), fetch of batch having UID 3 fails
+    """
+    config = make_config(mail='fetch_batch_size: 2')
+    mail = forwarder.Mail.create_parser(config)
+    mail.store = forwarder.StateStore()
+    mail.account = 'user@imap.example.com:993'
+    mail.last_uid = mail.max_uid = ''
+    mail.modseq, mail.search_modseq = '5', '9'
+
+    def fetch_mails(uids: list[bytes]) -> list[tuple[str, bytes]]:
+        if b'3' in uids:
+            raise forwarder.Mail.MailError("Fetch of UIDs '3:4' failed: connection reset")
+        return [(uid.decode(), MAIL % (uid, uid)) for uid in uids]
+    monkeypatch.setattr(mail, 'fetch_mails', fetch_mails)
+    monkeypatch.setattr(mail, 'search_uids', lambda: [b'%i' % uid for uid in range(1, 7)])
+    return mail
+
+
+def assert_pass_ended(mail: forwarder.Mail, uids: list[str]):
+    assert uids == ['1', '2']
+    # next search starts after last fetched mail, mails of failed batch are found again
+    assert mail.last_uid == '2'
+    # mod-sequence of search isn't committed
+    assert mail.modseq == '5'
+    assert mail.store.get_sync_state(mail.account, mail.config.imap_folder) is None
+
+
+def test_search_mails_ends_pass_on_fetch_error(mail):
+    assert_pass_ended(mail, [parsed.uid for parsed in mail.search_mails()])
+
+
+def test_iter_mails_ends_pass_on_fetch_error(mail):
+    source = forwarder.AsyncMail(mail.config, mail.store)
+    source.mail = mail
+
+    async def iterate() -> list[str]:
+        return [parsed.uid async for parsed in source.iter_mails(mail.search_uids())]
+    try:
+        assert_pass_ended(mail, asyncio.run(iterate()))
+    finally:
+        source.close()
+
+
+def test_parser_pool_shared_by_accounts(make_config):
+    sections = '[Mail:short]\nmax_length: 20\n'
+    configs = [make_config(mail='parse_workers: 2', sections=sections),
+               make_config(mail='parse_workers: 1', sections=sections, account='short'),
+               make_config(mail='parse_workers: 0', sections=sections, account='inline')]
+    pool = forwarder.ParserPool.create(configs)
+    try:
+        assert pool.executor._max_workers == 2
+        sources = [forwarder.AsyncMail(config, forwarder.StateStore(), pool) for config in configs]
+        assert [source.pool for source in sources] == [pool, pool, None]
+
+        async def parse() -> list[forwarder.MailData]:
+            raw = MAIL % (b'1', b' '.join([b'text'] * 100))
+            return list(await asyncio.gather(*[pool.submit(config, '1', raw) for config in configs[:2]]))
+        long, short = asyncio.run(parse())
+        # each account is parsed by its own options
+        assert len(long.mail_body) > 400
+        assert short.mail_body.startswith('Text of mail text te...') and len(short.mail_body) < 50
+        for source in sources:
+            source.close()
+    finally:
+        pool.close()
+
+
+def test_account_label_of_metrics(make_config):
+    config = make_config(sections='[Mail:news]\nfolder: News\n', account='news')
+    store = forwarder.StateStore()
+    mail_forwarder = forwarder.Forwarder(config, store, forwarder.TelegramBot(config, forwarder.ReplayClient(config)))
+    try:
+        assert config.get_account_id() == 'user@imap.example.com:993/news'
+        assert mail_forwarder.account == forwarder.Mail.create_parser(config).account == config.get_account_id()
+    finally:
+        mail_forwarder.source.close()
+
+
+# recorded responses of UID FETCH (imaplib2 data): multipart mail with text and attached PDF
+BODYSTRUCTURE = [b'1 (UID 42 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 14 1 NIL NIL NIL NIL)'
+                 b'("APPLICATION" "PDF" ("NAME" "report.pdf") NIL NIL "BASE64" 12 NIL '
+                 b'("ATTACHMENT" ("FILENAME" "report.pdf")) NIL NIL) "MIXED" ("BOUNDARY" "XYZ") NIL NIL NIL))']
+HEADER = b'From: sender@example.com\r\nSubject: Report\r\nMIME-Version: 1.0\r\n' \
+         b'Content-Type: multipart/mixed; boundary="XYZ"\r\n\r\n'
+TEXT_MIME = b'Content-Type: text/plain; charset="utf-8"\r\n\r\n'
+TEXT = b'Report of May\r\n'
+PDF_MIME = b'Content-Type: application/pdf; name="report.pdf"\r\nContent-Transfer-Encoding: base64\r\n' \
+           b'Content-Disposition: attachment; filename="report.pdf"\r\n\r\n'
+PDF = b'JVBERi0xLjQK\r\n'
+
+
+def sections_response(sections: dict[str, bytes]) -> list:
+    data: list = []
+    for section, literal in sections.items():
+        prefix = b'1 (UID 42 ' if not data else b' '
+        data.append((prefix + b'BODY[%s] {%i}' % (section.encode(), len(literal)), literal))
+    return data + [b')']
+
+
+@pytest.mark.parametrize('attachments, sections', [
+    (True, {'HEADER': HEADER, '1.MIME': TEXT_MIME, '1': TEXT, '2.MIME': PDF_MIME, '2': PDF}),
+    (False, {'HEADER': HEADER, '1.MIME': TEXT_MIME, '1': TEXT, '2.MIME': PDF_MIME}),
+])
+def test_fetch_mails_partial(make_config, monkeypatch, attachments, sections):
+    config = make_config(mail='partial_fetch: True', telegram='forward_attachment: %s' % attachments)
+    mail = forwarder.Mail.create_parser(config)
+    commands: list[tuple[str, str]] = []
+
+    def uid_fetch(uid_set: str, items: str) -> list:
+        commands.append((uid_set, items))
+        return BODYSTRUCTURE if items == '(UID BODYSTRUCTURE)' else sections_response(sections)
+    monkeypatch.setattr(mail, '_uid_fetch', uid_fetch)
+
+    [(uid, raw)] = mail.fetch_mails([b'42'])
+    # bodies of skipped parts are not fetched, header marks mail as seen
+    items = ['BODY[HEADER]'] + ['BODY.PEEK[%s]' % section for section in list(sections)[1:]]
+    assert commands == [('42', '(UID BODYSTRUCTURE)'), ('42', '(UID %s)' % ' '.join(items))]
+    assert uid == '42'
+    assert raw == (HEADER + b'--XYZ\r\n' + TEXT_MIME + TEXT + b'\r\n--XYZ\r\n' + PDF_MIME
+                   + (PDF if attachments else b'') + b'\r\n--XYZ--\r\n')
+
+    parsed = mail.parse_fetched(uid, raw)
+    assert parsed.mail_subject == 'Report'
+    assert 'Report of May' in parsed.mail_body
+    # skipped attachment is rebuilt with headers only: listed like in complete mail, without content
+    assert [(attachment.name, attachment.file) for attachment in parsed.attachments] == [
+        ('report.pdf', b'%PDF-1.4\n' if attachments else b'')]
+    complete = mail.parse_fetched(uid, HEADER + b'--XYZ\r\n' + TEXT_MIME + TEXT + b'\r\n--XYZ\r\n' + PDF_MIME + PDF
+                                  + b'\r\n--XYZ--\r\n')
+    assert (parsed.mail_body, parsed.attachment_summary) == (complete.mail_body, complete.attachment_summary)
+
+
+def test_pending_uids_not_shared(make_config):
+    config = make_config()
+    first, second = forwarder.Mail.create_parser(config), forwarder.Mail.create_parser(config)
+    first.pending_uids.append('7')
+    assert second.pending_uids == []
+    assert 'pending_uids' not in vars(forwarder.Mail)
@@ -0,0 +1,96 @@
+import re
+import urllib.request
+
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+# sample of Prometheus text format: name, optional labels and value
+SAMPLE_PATTERN = re.compile(r'(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)'
+                            r'(?:\{(?P<labels>[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+                            r'(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*")*)})?'
+                            r' (?P<value>[-+]?(?:\d+\.?\d*(?:e[-+]?\d+)?|Inf|NaN))')
+
+
+def samples(text: str) -> dict[str, float]:
+    """
+    Check syntax of exposition and get samples by name and labels (ex.: 'name{label="value"}')
+    """
+    assert text.endswith('\n')
+    result: dict[str, float] = {}
+    types: dict[str, str] = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, metric_type = line.split(' ')
+            assert metric_type in ('counter', 'gauge', 'histogram')
+            types[name] = metric_type
+            continue
+        match = SAMPLE_PATTERN.fullmatch(line)
+        assert match is not None, line
+        name = match.group('name')
+        # samples follow TYPE of their metric
+        assert re.sub('_(bucket|sum|count)$', '', name) in types or name in types
+        result[line.rpartition(' ')[0]] = float(match.group('value'))
+    return result
+
+
+def test_exposition_format():
+    registry = forwarder.Metrics()
+    registry.inc('mails_delivered_total', 2, account='user@imap.example.com:993')
+    registry.inc('mails_delivered_total', account='user@imap.example.com:993')
+    registry.inc('telegram_errors_total', method='send_message', error='Say "hi"\\\n')
+    registry.set('imap_uid_lag', 7, account='a')
+    registry.set('imap_uid_lag', 3, account='a')
+    for value in (0.003, 0.2, 0.2, 100):
+        registry.observe('imap_fetch_seconds', value, account='a')
+
+    text = registry.render()
+    values = samples(text)
+    assert '# HELP mail_to_telegram_mails_delivered_total Mails delivered to all of their targets\n' \
+           '# TYPE mail_to_telegram_mails_delivered_total counter\n' \
+           'mail_to_telegram_mails_delivered_total{account="user@imap.example.com:993"} 3.0\n' in text
+    assert values['mail_to_telegram_imap_uid_lag{account="a"}'] == 3
+    # label values are escaped
+    assert values['mail_to_telegram_telegram_errors_total{error="Say \\"hi\\"\\\\\\n",method="send_message"}'] == 1
+
+    # histogram: cumulative buckets, +Inf bucket equals count
+    buckets = [(labels, value) for labels, value in values.items()
+               if labels.startswith('mail_to_telegram_imap_fetch_seconds_bucket')]
+    assert buckets[0] == ('mail_to_telegram_imap_fetch_seconds_bucket{account="a",le="0.005"}', 1)
+    assert dict(buckets)['mail_to_telegram_imap_fetch_seconds_bucket{account="a",le="0.25"}'] == 3
+    assert dict(buckets)['mail_to_telegram_imap_fetch_seconds_bucket{account="a",le="60.0"}'] == 3
+    assert buckets[-1] == ('mail_to_telegram_imap_fetch_seconds_bucket{account="a",le="+Inf"}', 4)
+    assert [value for _, value in buckets] == sorted(value for _, value in buckets)
+    assert len(buckets) == len(forwarder.Metrics.BUCKETS) + 1
+    assert values['mail_to_telegram_imap_fetch_seconds_sum{account="a"}'] == pytest.approx(100.403)
+    assert values['mail_to_telegram_imap_fetch_seconds_count{account="a"}'] == 4
+
+
+def test_all_metrics_described():
+    text = forwarder.Metrics().render()
+    samples(text)
+    names = re.findall(r'^# TYPE (\S+) ', text, flags=re.MULTILINE)
+    assert names == [forwarder.Metrics.PREFIX + name for name in forwarder.Metrics.DEFINITIONS]
+    # counters end with '_total'
+    for name, (metric_type, _) in forwarder.Metrics.DEFINITIONS.items():
+        assert name.endswith('_total') == (metric_type == 'counter'), name
+
+
+def test_export_by_file_and_http(tmp_path):
+    registry = forwarder.Metrics()
+    registry.inc('mails_failed_total', account='a')
+    file_name = tmp_path / 'forwarder.prom'
+    registry.write(str(file_name))
+    assert file_name.read_text() == registry.render()
+    # no temporary files are left
+    assert [path.name for path in tmp_path.iterdir()] == ['forwarder.prom']
+
+    registry.serve('127.0.0.1', 0)
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:%i/metrics' % registry.server.server_address[1]) as response:
+            assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+            assert response.read().decode() == registry.render()
+    finally:
+        registry.stop()
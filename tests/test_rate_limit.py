@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+from telegram import error
+
+import mailToTelegramForwarder as forwarder
+
+
+def elapsed(coroutine) -> float:
+    async def run() -> float:
+        started = time.monotonic()
+        await coroutine()
+        return time.monotonic() - started
+    return asyncio.run(run())
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = forwarder.TokenBucket(10)
+
+    async def acquire(count: int):
+        for _ in range(count):
+            await bucket.acquire()
+    # capacity (one second of calls) is available at once
+    assert elapsed(lambda: acquire(10)) < 0.05
+    assert elapsed(lambda: acquire(5)) == pytest.approx(0.5, abs=0.1)
+
+
+def test_token_bucket_pause():
+    bucket = forwarder.TokenBucket(10)
+    bucket.pause(0.5)
+    assert elapsed(bucket.acquire) == pytest.approx(0.5, abs=0.1)
+    # rate applies after pause, no burst
+    assert elapsed(bucket.acquire) == pytest.approx(0.1, abs=0.05)
+
+
+def test_rate_limiter_per_chat():
+    limiter = forwarder.RateLimiter(100, 4)
+    finished: dict[int, float] = {}
+
+    async def send(chat_id: int, count: int, started: float):
+        for _ in range(count):
+            await limiter.acquire(chat_id)
+        finished[chat_id] = time.monotonic() - started
+
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(send(1, 6, started), send(2, 6, started), send(3, 1, started))
+    asyncio.run(run())
+    # burst of 4 messages, 2 more at 4 per second: chats are limited independently
+    assert finished[1] == pytest.approx(0.5, abs=0.1)
+    assert finished[2] == pytest.approx(0.5, abs=0.1)
+    assert finished[3] < 0.05
+
+
+def test_rate_limiter_global():
+    limiter = forwarder.RateLimiter(10, 1)
+
+    async def send():
+        await asyncio.gather(*[limiter.acquire(chat_id) for chat_id in range(15)])
+    assert elapsed(send) == pytest.approx(0.5, abs=0.1)
+
+
+def test_retry_after_pauses_chat(make_config):
+    client = forwarder.TelegramClient(make_config(telegram='rate_limit: 100\nchat_rate_limit: 100'))
+    calls: list[int] = []
+
+    async def flood(chat_id):
+        calls.append(chat_id)
+        raise error.RetryAfter(1)
+
+    async def send_message(chat_id):
+        calls.append(chat_id)
+
+    async def run() -> tuple[float, float]:
+        with pytest.raises(error.RetryAfter):
+            await client.send(42, flood)
+        started = time.monotonic()
+        await client.send(43, send_message)
+        other = time.monotonic() - started
+        await client.send(42, send_message)
+        return other, time.monotonic() - started
+    other, paused = asyncio.run(run())
+    # flood wait applies to chat of failed request only
+    assert other < 0.05
+    assert paused == pytest.approx(1, abs=0.15)
+    assert calls == [42, 43, 42]
+
+
+def test_retry_after_delays_retry(make_config):
+    config = make_config(telegram='retry_delay: 1')
+    mail = forwarder.Mail.create_parser(config)
+    mail.store = forwarder.StateStore()
+    parsed = mail.parse_fetched('7', b'From: sender@example.com\r\nSubject: Mail\r\n\r\nText of mail')
+    parsed.error = 'Flood control exceeded'
+    parsed.retry_after = forwarder.TelegramClient.get_retry_after(error.RetryAfter(120))
+    started = time.time()
+    mail.confirm_delivery([parsed])
+
+    # retry isn't due before flood wait is over (instead of backoff of 1 second)
+    assert mail.get_due_retries() == []
+    [(next_try,)] = mail.store.connection.execute('SELECT next_try FROM outbox').fetchall()
+    assert next_try == pytest.approx(started + 120, abs=1)
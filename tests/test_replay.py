@@ -0,0 +1,78 @@
+import asyncio
+import json
+import subprocess
+import sys
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+# smallest valid PNG (1x1 pixel)
+PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                    '1f15c4890000000d49444154789c6360f8cfc0f01f0005000201a7f5b6'
+                    'd10000000049454e44ae426082')
+
+
+def archive(path):
+    """
+    Directory of mails: plain text, HTML with embedded image and attachments (small and large)
+    """
+    path.mkdir()
+    plain = MIMEText('Plain *text* of mail', 'plain', 'utf-8')
+    related = MIMEMultipart('related')
+    related.attach(MIMEText('<p>HTML <b>mail</b> <img src="cid:logo" alt="Logo"></p>', 'html', 'utf-8'))
+    image = MIMEImage(PNG, 'png')
+    image.add_header('Content-ID', '<logo>')
+    related.attach(image)
+    attachments = MIMEMultipart('mixed')
+    attachments.attach(MIMEText('Mail with attachments', 'plain', 'utf-8'))
+    for name, size in (('small.bin', 100), ('large.bin', 100_000), ('photo.png', 0)):
+        part = MIMEImage(PNG, 'png') if size == 0 else MIMEApplication(bytes(range(256)) * (size // 256))
+        part.add_header('Content-Disposition', 'attachment', filename=name)
+        attachments.attach(part)
+    for number, message in enumerate((plain, related, attachments)):
+        message['From'] = 'sender@example.com'
+        message['Subject'] = 'Mail %i' % number
+        (path / ('%i.eml' % number)).write_bytes(message.as_bytes())
+    return path
+
+
+@pytest.mark.parametrize('spool_size, parse_workers', [(0, 2), (1024, 0), (1024, 2)])
+def test_replay_output_independent_of_spool_and_workers(make_config, tmp_path, spool_size, parse_workers):
+    mails = archive(tmp_path / 'mails')
+
+    def replay(options: str, output: str) -> list[dict]:
+        config = make_config(mail='parse_min_batch: 1\n' + options)
+        asyncio.run(forwarder.Replay(config).run(str(mails), str(tmp_path / output)))
+        with open(tmp_path / output, encoding='utf-8') as records:
+            return [json.loads(record) for record in records]
+
+    expected = replay('', 'expected.jsonl')
+    assert [record['delivered'] for record in expected] == [True] * 3
+    assert replay('spool_size: %i\nparse_workers: %i' % (spool_size, parse_workers), 'output.jsonl') == expected
+
+
+def test_replay_to_standard_output(make_config, tmp_path):
+    config = make_config(mail='parse_workers: 1\nparse_min_batch: 1')
+    mails = archive(tmp_path / 'mails')
+    result = subprocess.run([sys.executable, forwarder.__file__, '-c', config.name, '--replay', str(mails)],
+                            capture_output=True, text=True, check=True)
+    # log messages are written to standard error, standard output contains JSON lines only
+    assert [json.loads(record)['uid'] for record in result.stdout.splitlines()] == ['0.eml', '1.eml', '2.eml']
+    assert 'Replayed 3 mail(s)' in result.stderr
+
+
+def test_profile_to_standard_output(make_config, tmp_path):
+    config = make_config()
+    mails = archive(tmp_path / 'mails')
+    result = subprocess.run([sys.executable, forwarder.__file__, '-c', config.name, '--replay', str(mails),
+                             '--replay-output', str(tmp_path / 'output.jsonl'), '--profile'],
+                            capture_output=True, text=True, check=True)
+    # standard output contains JSON lines of profile only
+    records = [json.loads(record) for record in result.stdout.splitlines()]
+    assert [record['uid'] for record in records if record['stage'] == 'mail'] == ['0.eml', '1.eml', '2.eml']
+    assert 'Replayed 3 mail(s)' in result.stderr
@@ -0,0 +1,29 @@
+import re
+
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+
+@pytest.mark.parametrize('pattern, literal', [
+    ('invoice', 'invoice'),
+    ('ab{0,2}cd', 'cd'),
+    ('abc{2}defg', 'defg'),
+    ('x{,3}yz', 'yz'),
+    (r'\d{3}-invoice', '-invoice'),
+    ('(news){2,}letter', 'letter'),
+    ('colou?r', 'colo'),
+])
+def test_required_literal(pattern, literal):
+    assert forwarder.PatternIndex.required_literal(pattern) == literal
+
+
+def test_match_of_quantified_pattern():
+    patterns = ['ab{0,2}cd', 'abc{2}defg', r'report-\d{4}', 'newsletter', 'x{,3}yz']
+    index = forwarder.PatternIndex()
+    for rule_idx, pattern in enumerate(patterns):
+        index.add(rule_idx, pattern)
+
+    for value in ['xx acd', 'xx abbcd', 'abccdefg', 'abdefg', 'Report-2024', 'yz', 'NEWSLETTER']:
+        expected = [rule_idx for rule_idx, pattern in enumerate(patterns) if re.search(pattern, value, re.IGNORECASE)]
+        assert sorted(index.match(value)) == expected, value
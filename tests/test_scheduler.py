@@ -0,0 +1,46 @@
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+
+@pytest.fixture
+def scheduler(make_config, monkeypatch) -> forwarder.PollScheduler:
+    # delays without jitter
+    monkeypatch.setattr(forwarder.PollScheduler, 'JITTER', 0)
+    return forwarder.PollScheduler(make_config(mail='refresh: 10\nmax_refresh: 60\nmax_reconnect_delay: 100'))
+
+
+def test_backoff_of_quiet_mailbox(scheduler):
+    assert [scheduler.next_delay(0) for _ in range(5)] == [20, 40, 60, 60, 60]
+    # new mail: polled again after 'refresh'
+    assert scheduler.next_delay(3) == 10
+    assert scheduler.next_delay(0) == 20
+
+
+def test_backoff_of_errors(scheduler):
+    scheduler.next_delay(0)
+    assert [scheduler.error_delay() for _ in range(6)] == [10, 20, 40, 80, 100, 100]
+    # successful poll resets errors, quiet mailbox backoff starts again
+    assert scheduler.next_delay(0) == 20
+    assert scheduler.error_delay() == 10
+
+
+def test_many_errors_limited(scheduler):
+    for _ in range(2000):
+        delay = scheduler.error_delay()
+    assert delay == 100
+
+
+def test_jitter_and_first_delay(make_config):
+    scheduler = forwarder.PollScheduler(make_config(mail='refresh: 10\nmax_refresh: 60'))
+    delays = [scheduler.jitter(100) for _ in range(1000)]
+    assert 90 <= min(delays) < 95 and 105 < max(delays) <= 110
+    first = [scheduler.first_delay() for _ in range(1000)]
+    # first polls of accounts are spread over 'refresh' seconds
+    assert 0 <= min(first) < 1 and 9 < max(first) <= 10
+
+
+def test_delays_not_below_one_second(make_config, monkeypatch):
+    monkeypatch.setattr(forwarder.PollScheduler, 'JITTER', 0)
+    scheduler = forwarder.PollScheduler(make_config(mail='refresh: 0\nmax_refresh: 0\nmax_reconnect_delay: 0'))
+    assert (scheduler.next_delay(1), scheduler.next_delay(0), scheduler.error_delay()) == (1, 1, 1)
@@ -0,0 +1,93 @@
+import re
+
+import pytest
+from telegram.constants import ParseMode
+
+import mailToTelegramForwarder as forwarder
+
+LIMIT = forwarder.MessageSplitter.MAX_LENGTH
+
+
+def visible_html(chunk: str) -> int:
+    return forwarder.MessageSplitter.text_length(
+        re.sub(r'&#?\w+;', '.', re.sub(r'<[^>]*>', '', chunk)))
+
+
+def test_short_message_not_split():
+    message = 'word ' * 800 + '<b>bold</b>'
+    assert forwarder.MessageSplitter(ParseMode.HTML).split(message) == [message]
+
+
+def test_split_at_limit():
+    words = ['word%i' % idx for idx in range(2000)]
+    chunks = forwarder.MessageSplitter(ParseMode.HTML).split(' '.join(words))
+    assert len(chunks) == -(-len(' '.join(words)) // LIMIT)
+    assert all(visible_html(chunk) <= LIMIT for chunk in chunks)
+    # chunks are filled and end at word boundaries
+    assert all(visible_html(chunk) > LIMIT - 10 for chunk in chunks[:-1])
+    assert ' '.join(chunks).split(' ') == words
+
+
+def test_length_counted_in_utf16():
+    # emojis are two UTF-16 code units each: 3000 characters exceed limit
+    message = '😀' * 3000
+    chunks = forwarder.MessageSplitter(ParseMode.HTML).split(message)
+    assert [len(chunk) for chunk in chunks] == [LIMIT // 2, 3000 - LIMIT // 2]
+    assert ''.join(chunks) == message
+
+
+def test_formatting_closed_and_reopened():
+    message = 'intro <b>bold <a href="https://example.com">' + 'link ' * 1000 + '</a> end</b> plain'
+    chunks = forwarder.MessageSplitter(ParseMode.HTML).split(message)
+    assert len(chunks) == 2
+    assert chunks[0].startswith('intro <b>bold <a href="https://example.com">link ')
+    assert chunks[0].endswith('link</a></b>')
+    assert chunks[1].startswith('<b><a href="https://example.com">link ')
+    assert chunks[1].endswith('link </a> end</b> plain')
+    assert all(visible_html(chunk) <= LIMIT for chunk in chunks)
+
+
+def test_markdown_v2_escapes_kept():
+    message = '*' + 'a\\. ' * 1500 + 'b\\_' * 1000 + '*'
+    chunks = forwarder.MessageSplitter(ParseMode.MARKDOWN_V2).split(message)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        # bold is closed and reopened, escaped characters aren't separated
+        assert chunk.startswith('*') and chunk.endswith('*')
+        assert re.fullmatch(r'\*(?:[^\\*]|\\.)*\*', chunk), chunk[-10:]
+        assert len(re.sub(r'\\(.)', r'\1', chunk)) - 2 <= LIMIT
+
+
+@pytest.mark.parametrize('parse_mode, message, start, end', [
+    (ParseMode.MARKDOWN_V2, '```python\n' + 'print\\(1\\)\n' * 600 + '```', '```python\n', '```'),
+    (ParseMode.MARKDOWN_V2, '`' + '\\`x' * 5000 + '`', '`', '`'),
+    (ParseMode.MARKDOWN, '```\n' + 'x' * 9000 + '```', '```\n', '```'),
+], ids=['code block', 'inline code', 'markdown'])
+def test_long_code_split(parse_mode, message, start, end):
+    chunks = forwarder.MessageSplitter(parse_mode).split(message)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        # code is closed in each chunk, reopened (with its language) in the next one
+        assert chunk.startswith(start) and chunk.endswith(end)
+        code = chunk[len(start):-len(end)]
+        # escaped characters aren't separated
+        assert not re.search(r'(?<!\\)(?:\\\\)*\\$', code)
+        assert forwarder.MessageSplitter.text_length(code) <= LIMIT
+    # code blocks are split at line breaks (removed at end of chunk)
+    separator = '\n' if start == '```python\n' else ''
+    assert separator.join(chunk[len(start):-len(end)] for chunk in chunks) == message[len(start):-len(end)]
+
+
+def test_code_after_text_split():
+    message = 'Log:\n```\n' + 'line\n' * 1000 + '```\nend'
+    chunks = forwarder.MessageSplitter(ParseMode.MARKDOWN_V2).split(message)
+    assert chunks[0] == 'Log:'
+    assert chunks[1].startswith('```\nline\n') and chunks[1].endswith('line```')
+    assert chunks[-1].startswith('```\nline\n') and chunks[-1].endswith('line\n```\nend')
+
+
+def test_long_pre_split():
+    message = '<pre>' + 'x' * 9000 + '</pre>'
+    chunks = forwarder.MessageSplitter(ParseMode.HTML).split(message)
+    assert [len(chunk) for chunk in chunks] == [LIMIT + 11, LIMIT + 11, 9000 - 2 * LIMIT + 11]
+    assert all(chunk.startswith('<pre>') and chunk.endswith('</pre>') for chunk in chunks)
@@ -0,0 +1,126 @@
+import pytest
+
+import mailToTelegramForwarder as forwarder
+
+MAIL = b'From: sender@example.com\r\nSubject: Mail %i\r\n\r\nText of mail %i'
+
+
+@pytest.fixture
+def store() -> forwarder.StateStore:
+    """
+    State shared by connections (like state file kept during restart)
+    """
+    state = forwarder.StateStore()
+    yield state
+    state.close()
+
+
+def forward(mail: forwarder.Mail) -> list[str]:
+    """
+    Search, fetch and deliver mails (see Forwarder)
+    """
+    mails = mail.search_mails()
+    for parsed in mails:
+        parsed.delivered = True
+    mail.confirm_delivery(mails)
+    return [parsed.uid for parsed in mails]
+
+
+def append(imap_server, count: int):
+    for _ in range(count):
+        uid = imap_server.mailbox.next_uid
+        imap_server.mailbox.append(MAIL % (uid, uid))
+
+
+def searches(imap_server) -> int:
+    return imap_server.mailbox.commands.get('UID SEARCH', 0)
+
+
+def settle(mail: forwarder.Mail, imap_server) -> int:
+    """
+    Search once more: flags of fetched mails were changed (seen), these mails are skipped as delivered
+    """
+    assert forward(mail) == []
+    return searches(imap_server)
+
+
+def test_search_skipped_while_folder_unchanged(make_imap_config, imap_server, store):
+    append(imap_server, 1)
+    mail = forwarder.Mail(make_imap_config(mail='condstore: True'), store)
+    try:
+        assert mail.qresync and mail.condstore
+        # most recent mail on first start
+        assert forward(mail) == ['1']
+        append(imap_server, 2)
+        assert forward(mail) == ['2', '3']
+        searched = settle(mail, imap_server)
+
+        # HIGHESTMODSEQ not changed: no search
+        assert forward(mail) == []
+        assert searches(imap_server) == searched
+
+        append(imap_server, 1)
+        assert forward(mail) == ['4']
+        assert searches(imap_server) == searched + 1
+    finally:
+        mail.disconnect()
+
+
+def test_resync_after_reconnect(make_imap_config, imap_server, store):
+    config = make_imap_config(mail='condstore: True')
+    append(imap_server, 1)
+    mail = forwarder.Mail(config, store)
+    try:
+        forward(mail)
+        append(imap_server, 1)
+        assert forward(mail) == ['2']
+        modseq = mail.modseq
+        assert store.get_sync_state(mail.account, 'INBOX') == ('1', modseq)
+    finally:
+        mail.disconnect()
+
+    # mails changed while disconnected are found by QRESYNC state of last search
+    append(imap_server, 2)
+    mail = forwarder.Mail(config, store)
+    try:
+        assert mail.modseq == modseq
+        assert mail.selected_modseq == str(imap_server.mailbox.highest_modseq)
+        assert forward(mail) == ['3', '4']
+        searched = settle(mail, imap_server)
+        assert forward(mail) == []
+        assert searches(imap_server) == searched
+    finally:
+        mail.disconnect()
+
+
+def test_full_search_after_uid_validity_changed(make_imap_config, imap_server, store):
+    config = make_imap_config(mail='condstore: True')
+    append(imap_server, 3)
+    mail = forwarder.Mail(config, store)
+    try:
+        forward(mail)
+        append(imap_server, 1)
+        assert forward(mail) == ['4']
+        mail.schedule_retry('2', 'Telegram not available')
+    finally:
+        mail.disconnect()
+
+    # ex.: folder recreated, stored UIDs and mod-sequences are invalid
+    imap_server.mailbox.uid_validity = 2
+    append(imap_server, 1)
+    mail = forwarder.Mail(config, store)
+    try:
+        assert mail.uid_validity == '2'
+        assert mail.modseq == ''
+        searched = searches(imap_server)
+        # state is reset, mails are forwarded from most recent UID (like first start)
+        assert forward(mail) == ['5']
+        assert searches(imap_server) > searched
+        assert store.get_checkpoint(mail.account, 'INBOX') == ('2', '5')
+        assert store.get_retry_uids(mail.account, 'INBOX') == set()
+        assert store.get_sync_state(mail.account, 'INBOX')[0] == '2'
+
+        append(imap_server, 1)
+        assert forward(mail) == ['6']
+    finally:
+        mail.disconnect()
@@ -0,0 +1,181 @@
+import asyncio
+import base64
+import email.message
+import json
+
+from telegram import Bot
+from telegram.request import BaseRequest, RequestData
+
+import mailToTelegramForwarder as forwarder
+
+
+class RecordingRequest(BaseRequest):
+    """
+    Bot API stub: records parameters and uploaded files of requests, answers by a message
+    """
+    def __init__(self):
+        self.requests: list[tuple[str, dict, dict]] = []
+        self.streamed: list[str] = []
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url: str, method: str, request_data: RequestData | None = None,
+                         *args, **kwargs) -> tuple[int, bytes]:
+        files = {}
+        for name, (file_name, content, mime_type) in (request_data.multipart_data or {}).items():
+            if hasattr(content, 'read'):
+                # file handle is read by upload (like HTTP client does)
+                self.streamed.append(file_name)
+                content = content.read()
+            files[name] = (file_name, content, mime_type)
+        self.requests.append((url.rsplit('/', 1)[-1], request_data.parameters, files))
+        self.message_id += 1
+        file_info = {'file_id': 'file-%i' % self.message_id, 'file_unique_id': 'file-%i' % self.message_id}
+        message = {'message_id': self.message_id, 'date': 0, 'chat': {'id': 42, 'type': 'private'},
+                   'photo': [dict(width=1, height=1, **file_info)], 'document': file_info}
+        result = [message] if url.endswith('sendMediaGroup') else message
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def spooled_attachment(name: str, content: bytes, spool_size: int) -> forwarder.MailAttachment:
+    part = email.message.Message()
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.set_payload(base64.encodebytes(content).decode())
+    return forwarder.MailAttachment(name=name, file=forwarder.Mail.decode_payload(part, spool_size))
+
+
+def test_send_media_of_spooled_attachment(make_config):
+    config = make_config(mail='spool_size: 1024', telegram='file_cache_size: 0')
+    request = RecordingRequest()
+    client = forwarder.TelegramClient(config)
+    client.bot = Bot(token=config.tg_bot_token, request=request)
+    bot = forwarder.TelegramBot(config, client)
+
+    # small attachment is kept in memory by spooled file (without file name)
+    document = spooled_attachment('report.pdf', b'%PDF-1.4 small', config.imap_spool_size)
+    photo = spooled_attachment('photo.png', b'\x89PNG small', config.imap_spool_size)
+    assert not isinstance(document.file, bytes) and document.file.name is None
+
+    async def send():
+        await bot.send_media(42, 'HTML', [(document, 'document')])
+        await bot.send_media(42, 'HTML', [(photo, 'photo')], photo=True)
+        await bot.send_media(42, 'HTML', [(document, 'first'), (photo, 'second')])
+    asyncio.run(send())
+
+    assert [method for method, _, _ in request.requests] == ['sendDocument', 'sendPhoto', 'sendMediaGroup']
+    uploads = [(file_name, content) for _, _, files in request.requests
+               for file_name, content, _ in files.values()]
+    assert uploads == [('report.pdf', b'%PDF-1.4 small'), ('photo.png', b'\x89PNG small'),
+                       ('report.pdf', b'%PDF-1.4 small'), ('photo.png', b'\x89PNG small')]
+    # spooled files are passed to upload without reading them into memory
+    assert request.streamed == ['report.pdf', 'photo.png', 'report.pdf', 'photo.png']
+
+
+def test_send_spooled_attachment_without_name(make_config):
+    config = make_config(mail='spool_size: 16', telegram='file_cache_size: 0')
+    request = RecordingRequest()
+    client = forwarder.TelegramClient(config)
+    client.bot = Bot(token=config.tg_bot_token, request=request)
+    bot = forwarder.TelegramBot(config, client)
+
+    # large attachment is spooled to temporary file
+    document = spooled_attachment('', b'%PDF-1.4 ' + b'x' * 64, config.imap_spool_size)
+    assert document.file.name is not None
+    asyncio.run(bot.send_media(42, 'HTML', [(document, 'document')]))
+
+    [(_, _, files)] = request.requests
+    assert [(file_name, content) for file_name, content, _ in files.values()] == [
+        ('application.octet-stream', b'%PDF-1.4 ' + b'x' * 64)]
+
+
+class FailingClient(forwarder.ReplayClient):
+    """
+    Telegram not available, except for error messages
+    """
+    async def send(self, chat_id, method, **kwargs):
+        if not kwargs.get('text', '').startswith('❌'):
+            raise forwarder.error.NetworkError('Telegram not available')
+        return await super().send(chat_id, method, **kwargs)
+
+
+def test_error_sent_when_moved_to_dead_letters(make_config):
+    config = make_config(telegram='retry_attempts: 3')
+    client = FailingClient(config)
+    mail_forwarder = forwarder.Forwarder(config, client.store, forwarder.TelegramBot(config, client))
+    mail_forwarder.source.mail = forwarder.Mail.create_parser(config)
+    mail_forwarder.source.mail.store = client.store
+    raw = b'From: sender@example.com\r\nSubject: Mail\r\n\r\nText of mail'
+
+    async def attempt():
+        await mail_forwarder.window.acquire()
+        await mail_forwarder.consume(mail_forwarder.source.mail.parse_fetched('7', raw))
+    try:
+        for _ in range(2):
+            asyncio.run(attempt())
+        # failed attempts are retried without error message in chat
+        assert client.requests == []
+        asyncio.run(attempt())
+        assert [(request['method'], request['chat_id']) for request in client.requests] == [('send_message', 42)]
+        assert 'moved to dead letters: Telegram not available' in client.requests[0]['text']
+        assert [uid for _, _, uid, *_ in client.store.get_dead_letters()] == [7]
+    finally:
+        mail_forwarder.source.close()
+
+
+class FlakyClient(forwarder.ReplayClient):
+    """
+    Telegram not available for chats of 'failing' only
+    """
+    failing: set[int] = set()
+
+    async def send(self, chat_id, method, **kwargs):
+        if chat_id in self.failing:
+            raise forwarder.error.NetworkError('Telegram not available')
+        return await super().send(chat_id, method, **kwargs)
+
+
+def test_retry_sent_to_failed_targets_only(make_config):
+    config = make_config(sections='[Route:All]\nfrom: example\nchat_id: 42, 43/5\n')
+    client = FlakyClient(config)
+    mail_forwarder = forwarder.Forwarder(config, client.store, forwarder.TelegramBot(config, client))
+    mail_forwarder.source.mail = forwarder.Mail.create_parser(config)
+    mail_forwarder.source.mail.store = client.store
+    raw = b'From: sender@example.com\r\nSubject: Mail\r\n\r\nText of mail'
+
+    async def attempt():
+        await mail_forwarder.window.acquire()
+        await mail_forwarder.consume(mail_forwarder.source.mail.parse_fetched('7', raw))
+
+    def retry():
+        # see Forwarder.retry
+        mail_forwarder.retry_targets.update(mail_forwarder.source.mail.get_retry_targets(['7']))
+        asyncio.run(attempt())
+    try:
+        client.failing = {43}
+        asyncio.run(attempt())
+        assert {request['chat_id'] for request in client.take()} == {42}
+        assert repr(mail_forwarder.source.mail.get_retry_targets(['7'])) == "{'7': [43/5 (full)]}"
+
+        # failure before delivery (ex.: mail not found) keeps targets of previous attempt
+        mail_forwarder.source.mail.schedule_retry('7', 'Mail not found or not parsable')
+        client.failing = {42, 43}
+        retry()
+        assert client.take() == []
+        assert repr(mail_forwarder.source.mail.get_retry_targets(['7'])) == "{'7': [43/5 (full)]}"
+
+        client.failing = set()
+        retry()
+        assert [(request['chat_id'], request['message_thread_id']) for request in client.take()] == [(43, 5)]
+        assert mail_forwarder.source.mail.get_retry_targets(['7']) == {}
+        assert mail_forwarder.retry_targets == {}
+    finally:
+        mail_forwarder.source.close()